@@ -3,9 +3,10 @@ Content API for retrieving module item content from PostgreSQL database
 Handles the /api/v1/content/module-item/{module_item_id} endpoint
 """
 
+import asyncio
 import logging
 from typing import Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
@@ -15,7 +16,7 @@ router = APIRouter(prefix="/api/v1/content", tags=["content"])
 
 # Import database configuration
 from app.core.config import settings
-from app.services.db_config_rce import get_database_connection
+from app.services.db_config_rce import db_conn
 
 # Response models
 class ModuleItemContent(BaseModel):
@@ -34,36 +35,29 @@ class ContentResponse(BaseModel):
     content: Optional[ModuleItemContent] = None
     message: Optional[str] = None
 
-def get_db_session():
-    """Get database session using existing database configuration"""
-    try:
-        connection = get_database_connection()
-        if not connection:
-            raise HTTPException(status_code=500, detail="Database connection failed")
-        return connection
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise HTTPException(status_code=500, detail="Database connection failed")
+MODULE_ITEM_CONTENT_QUERY = """
+    SELECT 
+        m.id as module_id, m.name as module_name, m.position as module_position,
+        mi.title as item_title, mi.item_type, mi.position as item_position,
+        p.body as page_content, p.title as page_title,
+        p.yt_transcript as yt_transcript
+    FROM modules m
+    JOIN module_items mi ON m.id = mi.module_id
+    LEFT JOIN pages p ON mi.id = p.module_item_id
+    WHERE mi.id = %s
+"""
+
+def _fetch_module_item_row(module_item_id: int) -> Optional[Dict[str, Any]]:
+    """Blocking psycopg2 lookup; run through asyncio.to_thread from the endpoint"""
+    with db_conn() as connection, connection.cursor() as cursor:
+        cursor.execute(MODULE_ITEM_CONTENT_QUERY, (module_item_id,))
+        return cursor.fetchone()
 
 @router.get("/module-item/{module_item_id}", response_model=ContentResponse)
 async def get_module_item_content(module_item_id: int):
     """Get module item content from database"""
     try:
-        connection = get_db_session()
-        query = """
-            SELECT 
-                m.id as module_id, m.name as module_name, m.position as module_position,
-                mi.title as item_title, mi.item_type, mi.position as item_position,
-                p.body as page_content, p.title as page_title,
-                p.yt_transcript as yt_transcript
-            FROM modules m
-            JOIN module_items mi ON m.id = mi.module_id
-            LEFT JOIN pages p ON mi.id = p.module_item_id
-            WHERE mi.id = %s
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(query, (module_item_id,))
-            row = cursor.fetchone()
+        row = await asyncio.to_thread(_fetch_module_item_row, module_item_id)
         
         if row:
             content = ModuleItemContent(
@@ -86,9 +80,6 @@ async def get_module_item_content(module_item_id: int):
     except Exception as e:
         logger.error(f"Error getting module item content: {e}")
         return ContentResponse(status="error", message=str(e))
-    finally:
-        if 'connection' in locals():
-            connection.close()
 
 @router.get("/health")
 async def content_health_check():
@@ -11,6 +11,7 @@ from fastapi.templating import Jinja2Templates
 from app.services.lti_service import lti_service
 # from app.models.lti_models import LTILaunchResponse, LTIDeepLinkingResponse
 from app.services.memory_service import memory_service
+from app.services.memory_store import memory_store
 # from app.services.canvas_api_service import canvas_api_service
 from app.services.vector import tutor
 from app.repository.conversation_memory import ConversationMemoryRawRepository
@@ -864,7 +865,8 @@ async def lti_course_chat(
             raise HTTPException(status_code=401, detail="Invalid session")
         
         # Generate contextual AI response with Canvas progress
-        previous_summary = await conversation_repo.get_latest_summary(user_id)
+        # Stored summaries end with the session's facts; only the summary text goes to the tutor
+        previous_summary, _ = memory_store.split_summary(await conversation_repo.get_latest_summary(user_id))
 
         if is_quiz_active:
             # logger.info(f"Quiz State Active for user: {user_id}")
@@ -1,10 +1,11 @@
 import pathlib
+from array import array
 from pydoc import doc
 from fastapi import HTTPException, status, APIRouter
 from pydantic import BaseModel
 import logging
 from typing import Optional
-from app.services.huggingface_embeddings import embed_course_doc
+from app.services.huggingface_embeddings import embed_course_docs_batch
 from app.core.dependancies import get_db
 from app.core.config import embedding_model
 
@@ -50,40 +51,29 @@ setup_status = {
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException
 
+# Embeddings are bound as real[] (asyncpg sends float4 arrays in binary, 4 bytes per value)
+# and cast to vector on the server, instead of formatting each float into a "[...]" string
+INSERT_COURSE_EMBEDDING_SQL = """
+    INSERT INTO course_embeddings (doc_name, module_name, content, embedding)
+    VALUES (:doc_name, :module_name, :content, CAST(:embedding AS real[])::vector)
+"""
 
 
-async def insert_course_chunk(db: AsyncSession, doc_name: str, module_name: str, content: str, embedding):
-    # Convert embedding list to PostgreSQL array format
-    # embedding_array = "{" + ",".join(str(x) for x in embedding) + "}"
-    
-    # Use SQLAlchemy core for async execution with raw SQL
-    embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
-    
-    stmt = text("""
-        INSERT INTO course_embeddings (doc_name, module_name, content, embedding)
-        VALUES (:doc_name, :module_name, :content, :embedding)
-    """)
-
-    params = {
+async def insert_course_chunks(db: AsyncSession, chunks):
+    """Insert (doc_name, module_name, content, embedding) rows in one executemany and a single commit"""
+    stmt = text(INSERT_COURSE_EMBEDDING_SQL)
+    params = [
+        {
             'doc_name': doc_name,
             'module_name': module_name,
             'content': content,
-            'embedding': embedding_str
-            # 'context_used': json.dumps(memory_data.get('context_used')) if memory_data.get('context_used') else None
+            'embedding': embedding
         }
-        
-    result = await db.execute(stmt, params)
-    
-    # stmt = stmt.bindparams(
-    #     doc_name=doc_name,
-    #     module_name=module_name,
-    #     content=content,
-    #     embedding=embedding_str
-    # )
+        for doc_name, module_name, content, embedding in chunks
+    ]
+    if params:
+        await db.execute(stmt, params)
     await db.commit()
-    
-    # await db.execute(stmt)
-    # await db.commit()
 
 @router.post("/v2", status_code=status.HTTP_201_CREATED)
 async def setup_database_endpoint(
@@ -95,7 +85,7 @@ async def setup_database_endpoint(
             chunks_data = json.load(f)
             logger.debug('FILE READ: %s', chunks_data)
         
-        count = 0
+        docs = []
         for chunk_data in chunks_data:
             logger.debug('chunk: %s', chunk_data)
             if chunk_data['metadata']['chunk_type'] != 'content':
@@ -107,15 +97,17 @@ async def setup_database_endpoint(
                 content = chunk_data['content'].replace('content:', '')
 
                 logger.debug('Processing - doc_name: %s, module: %s, content: %s', doc_name, module_name, content[:30])  
-                obj = await embed_course_doc(str(content), str(doc_name), str(module_name))
-
-                logger.debug('Embedding object: %s', obj)
-
-                # Pass the db session to the insert function
-                await insert_course_chunk(db, doc_name, module_name, content, obj['embedding'])
-
-                logger.info('Embedded document: %s', doc_name)
-                count += 1
+                docs.append((str(content), str(doc_name), str(module_name)))
+
+        # Embed every document together, then insert them all in one statement and commit
+        objs = await embed_course_docs_batch(docs)
+        await insert_course_chunks(db, [
+            (doc_name, module_name, content, obj['embedding'])
+            for (content, doc_name, module_name), obj in zip(docs, objs)
+        ])
+        for obj in objs:
+            logger.info('Embedded document: %s', obj['doc_name'])
+        count = len(objs)
 
         logger.info(f"✅ Loaded {count} chunks")
         return {
@@ -168,9 +160,7 @@ async def get_top_5_content(query: str, db: AsyncSession) -> List[Dict]:
     """
     # 1️⃣ Encode query to vector
     embeddings = embedding_model.get_embeddings([query])
-    query_embedding = embeddings[0].values
-
-    embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
+    query_embedding = array("f", embeddings[0].values)
 
     try:
         # 2️⃣ Use SQLAlchemy with pgvector distance operator
@@ -179,11 +169,11 @@ async def get_top_5_content(query: str, db: AsyncSession) -> List[Dict]:
         sql = text("""
             SELECT id, doc_name, module_name, content, embedding
             FROM course_embeddings
-            ORDER BY embedding <=> :embedding
+            ORDER BY embedding <=> CAST(:embedding AS real[])::vector
             LIMIT 5
         """)
         
-        result = await db.execute(sql, {"embedding": embedding_str})
+        result = await db.execute(sql, {"embedding": query_embedding})
         rows = result.mappings().all()
         
         # Convert to list of dictionaries and handle embedding serialization
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 import os
 
 # Database configuration overrides - Force .env values
@@ -22,6 +22,8 @@ class Settings(BaseModel):
     
     CANVAS_URL: str = os.getenv("CANVAS_URL")
     CANVAS_API_TOKEN: str = os.getenv("CANVAS_API_TOKEN")
+    canvas_cache_ttl: int = Field(default=int(os.getenv("CANVAS_CACHE_TTL", "300")), description="Seconds to reuse Canvas API responses")
+    redis_url: Optional[str] = Field(default=os.getenv("REDIS_URL"), description="Redis URL for the shared Canvas response cache (optional)")
 
     # LTI Configuratio
     LTI_CONSUMER_KEY: str = os.getenv("LTI_CONSUMER_KEY")
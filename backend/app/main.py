@@ -2,6 +2,7 @@
 FastAPI application for AI Tutor Platform - Clean Version
 Simplified for iframe widget flow - only essential endpoints
 """
+import asyncio
 import logging
 import json
 import os
@@ -19,6 +20,9 @@ from app.services.database_service_rce import database_service
 from app.canvas.canvas_service_rce import canvas_service
 from app.services.widget_ai_service_rce import widget_ai_service
 from app.services.summarize_conversation import summary_creator
+from app.services.memory_store import memory_store
+from app.services.canvas_api_service import close_http_client as close_canvas_http_client
+from app.services.db_config_rce import ainit_db, close_pool
 from app.repository.conversation_rce import ConversationMemoryRawRepository_rce
 from app.core.dependancies import get_db
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
@@ -34,6 +38,9 @@ import httpx
 logging.basicConfig(level=getattr(logging, settings.log_level))
 logger = logging.getLogger(__name__)
 
+# Claude sometimes wraps its JSON in code fences despite the prompt rules
+CODE_FENCE_RE = regex.compile(r'```json\s*|\s*```')
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.api_title,
@@ -80,6 +87,25 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def init_database_pool():
+    """Create the pgvector connection pool and extension once at startup"""
+    await ainit_db()
+
+
+@app.on_event("shutdown")
+async def close_database_pool():
+    """Close pooled pgvector connections"""
+    close_pool()
+
+
+@app.on_event("shutdown")
+async def close_canvas_api_client():
+    """Release pooled Canvas API connections"""
+    await close_canvas_http_client()
+    await database_service.close()
+
+
 # Request/Response models
 class ChatRequest(BaseModel):
     message: str
@@ -190,6 +216,9 @@ async def chat(request: ChatRequest, http_request: Request, background_tasks: Ba
         
         # Get relevant context based on request parameters
         context_docs = []
+
+        # Follow-up turns on the same module item reuse its course material when the page omits it
+        doc_cache_key = f"{request.course_id}:{request.module_item_id}" if request.course_id and request.module_item_id else None
         
         # Priority 1: Use database content if available (most accurate)
         if request.page_content and request.module_context:
@@ -267,18 +296,19 @@ async def chat(request: ChatRequest, http_request: Request, background_tasks: Ba
             
             # repo = ConversationMemoryRawRepository_rce(db)
         
-            embeddings = embedding_model.get_embeddings([request.message])
-            query_embedding = embeddings[0].values
-
-            embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
-
             summary=None
             history = []
 
-            similar_convo = 'None'
+            similar_convo = []
             exists = await conversation_repo.get_by_session_id(session_id=request.session_id)
             # logger.info(f"Exists: {exists}")
             if not exists:
+                # Only the first row of a session stores the message embedding; run the blocking
+                # Vertex call off the event loop
+                embeddings = await asyncio.to_thread(embedding_model.get_embeddings, [request.message])
+                query_embedding = embeddings[0].values
+
+                embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
             
                 params = {
                 'user_id': None,
@@ -298,8 +328,13 @@ async def chat(request: ChatRequest, http_request: Request, background_tasks: Ba
 
                 user_record = await conversation_repo.create(params)
             else:
-                similar_convo = await conversation_repo.find_similar_conversations(session_id=request.session_id, embedding=embedding_str)
-                summary = await conversation_repo.get_latest_summary(session_id=request.session_id)
+                # The latest row carries the session's facts after its summary; load them into the
+                # local memory store, which may have restarted or not seen this session yet
+                summary, triples = memory_store.split_summary(
+                    await conversation_repo.get_latest_summary(session_id=request.session_id)
+                )
+                memory_store.add_triples(request.session_id, triples)
+                similar_convo = memory_store.get_triples(request.session_id)
                 history = await conversation_repo.format_conversations_for_chatbot(session_id=request.session_id)
                 user_record = await conversation_repo.get_by_session_id(session_id=request.session_id)
                 user_record = user_record[0]
@@ -328,11 +363,13 @@ async def chat(request: ChatRequest, http_request: Request, background_tasks: Ba
                     similar_past_convo=similar_convo,
                     difficulty=quiz_difficulty,
                     quiz_active=quiz_active,
-                    questions=questions
+                    questions=questions,
+                    doc_cache_key=doc_cache_key,
+                    session_id=request.session_id
                 )
                 # print(response)
                 try:
-                    cleaned_response = regex.sub(r'```json\s*|\s*```', '', response).strip()
+                    cleaned_response = CODE_FENCE_RE.sub('', response).strip()
                     response_data = json.loads(cleaned_response)
                 except Exception as e:
                     try:
@@ -374,10 +411,12 @@ async def chat(request: ChatRequest, http_request: Request, background_tasks: Ba
                 history=history,
                 difficulty=quiz_difficulty,
                 questions=[],
-                quiz_active=False
+                quiz_active=False,
+                doc_cache_key=doc_cache_key,
+                session_id=request.session_id
             )
             try:
-                cleaned_response = regex.sub(r'```json\s*|\s*```', '', ai_response_dict).strip()
+                cleaned_response = CODE_FENCE_RE.sub('', ai_response_dict).strip()
                 response_data = json.loads(cleaned_response)
                 logger.info(f"1 succeeded")
             except Exception as e:
@@ -431,12 +470,14 @@ async def chat(request: ChatRequest, http_request: Request, background_tasks: Ba
                 history=[],
                 difficulty='easy',
                 questions=[],
-                quiz_active=False
+                quiz_active=False,
+                doc_cache_key=doc_cache_key,
+                session_id=request.session_id
             )
             
             # logger.info(f"✅ Regular AI service response: {ai_response_dict.get('reply', '')[:100]}...")
             try:
-                cleaned_response = regex.sub(r'```json\s*|\s*```', '', ai_response_dict).strip()
+                cleaned_response = CODE_FENCE_RE.sub('', ai_response_dict).strip()
                 response_data = json.loads(cleaned_response)
             except Exception as e:
                 try:
@@ -348,7 +348,8 @@ class ConversationMemoryRepository:
 
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Deque
+from collections import deque
 import json
 
 class ConversationMemoryRawRepository_rce:
@@ -459,9 +460,9 @@ class ConversationMemoryRawRepository_rce:
     async def format_conversations_for_chatbot(
         self,
         session_id: str,
-        limit: int = 100
-    ) -> List[Dict[str, Any]]:
-        """Format conversations for chatbot using raw SQL"""
+        limit: int = 8
+    ) -> Deque[Dict[str, Any]]:
+        """Format the most recent conversations for chatbot using raw SQL, oldest first, bounded to limit"""
         sql = text("""
             SELECT 
                 CASE 
@@ -471,7 +472,7 @@ class ConversationMemoryRawRepository_rce:
                 message
             FROM conversations_rce 
             WHERE session_id = :session_id 
-            ORDER BY timestamp ASC 
+            ORDER BY timestamp DESC 
             LIMIT :limit
         """)
         
@@ -479,7 +480,8 @@ class ConversationMemoryRawRepository_rce:
             'session_id': session_id,
             'limit': limit
         })
-        return [dict(row) for row in result.mappings().all()]
+        rows = result.mappings().all()
+        return deque((dict(row) for row in reversed(rows)), maxlen=limit)
 
 
     def generate_random_string(self, length: int = 20) -> str:
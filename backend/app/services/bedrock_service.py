@@ -4,18 +4,161 @@ Replaces Google Vertex AI Gemini with AWS Bedrock models
 """
 
 import logging
+import threading
 import boto3
 import json
-from typing import Dict, List, Any, Optional
+import orjson
+from typing import Dict, List, Any, Optional, Union
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import os
 from dotenv import load_dotenv
+from .prompt_cache import build_prompt_cache
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive connections held by the shared boto3 client; callers run generate_content
+# from worker threads, so this bounds how many invocations reuse a warm connection
+MAX_POOL_CONNECTIONS = int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '16'))
+
+# Decode budgets. Bedrock reserves max_tokens up front, so keep them close to real
+# output sizes: a quiz turn is one short feedback JSON, a regular turn may carry a
+# full five-question quiz
+MAX_TOKENS_REGULAR = int(os.getenv('BEDROCK_MAX_TOKENS_REGULAR', '2048'))
+MAX_TOKENS_QUIZ = int(os.getenv('BEDROCK_MAX_TOKENS_QUIZ', '512'))
+
+# JSON schemas Claude must follow; serialized once per process and sent in the
+# cached system slot instead of being re-encoded into every message
+REGULAR_RESPONSE_SCHEMA = {
+    "$schema": "https://json-schema.org/draft/2020-12/schema",
+    "description": "Schema for quiz responses with metadata and a list of quiz questions",
+    "type": "object",
+    "properties": {
+        "answer": {
+            "type": "string",
+            "description": "The assistant's response to the user, including quiz introduction or instructions."
+        },
+        "wants_quiz": {
+            "type": "boolean",
+            "description": "Indicates if the user wants to proceed with a quiz."
+        },
+        "spoken_language": {
+            "type": "string",
+            "description": "The language in which the quiz will be presented."
+        },
+        "quiz": {
+            "type": "array",
+            "description": "A list of quiz questions.",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question_number": {
+                        "type": "integer",
+                        "description": "The number of the question in the sequence."
+                    },
+                    "difficulty": {
+                        "type": "string",
+                        "enum": [
+                            "easy",
+                            "medium",
+                            "hard"
+                        ],
+                        "description": "The difficulty level of the question."
+                    },
+                    "question_type": {
+                        "type": "string",
+                        "enum": [
+                            "true_false",
+                            "multiple_choice"
+                        ],
+                        "description": "The type of question (true/false or multiple choice)."
+                    },
+                    "question_text": {
+                        "type": "string",
+                        "description": "The text of the quiz question."
+                    },
+                    "options": {
+                        "type": "object",
+                        "description": "The answer options for the question, keyed by letter.",
+                        "patternProperties": {
+                            "^[A-Z]$": {
+                                "type": "string"
+                            }
+                        },
+                        "minProperties": 1
+                    },
+                    "expected_answer": {
+                        "type": "string",
+                        "description": "The correct answer key (e.g., 'A')."
+                    },
+                    "explanation": {
+                        "type": "string",
+                        "description": "Explanation of the correct answer."
+                    }
+                },
+                "required": [
+                    "question_number",
+                    "difficulty",
+                    "question_type",
+                    "question_text",
+                    "options",
+                    "expected_answer",
+                    "explanation"
+                ]
+            }
+        }
+    },
+    "required": [
+        "answer",
+        "wants_quiz",
+        "spoken_language",
+        "quiz"
+    ]
+}
+
+QUIZ_RESPONSE_SCHEMA = {
+    "$schema": "https://json-schema.org/draft/2020-12/schema",
+    "description": "Schema for quiz response evaluation and progression",
+    "type": "object",
+    "properties": {
+        "response": {
+            "type": "string",
+            "description": "Tutor’s feedback message. Must include correctness evaluation, explanation, and (if applicable) the next question."
+        },
+        "quiz_active": {
+            "type": "boolean",
+            "description": "True if the quiz is still ongoing with questions left. False if the quiz has ended."
+        },
+        "question_id": {
+            "type": "integer",
+            "minimum": 1,
+            "description": "The ID of the question just handled. Remains the same until moving to the next question."
+        },
+        "user_score": {
+            "type": "integer",
+            "minimum": 0,
+            "maximum": 5,
+            "description": "The user’s cumulative score so far, based on correct answers."
+        }
+    },
+    "required": [
+        "response",
+        "quiz_active",
+        "question_id",
+        "user_score"
+    ],
+    "additionalProperties": "false"
+}
+
+# Cross-region inference profile prefixes that precede the provider in a model ID
+INFERENCE_PROFILE_PREFIXES = {"us", "eu", "apac", "global"}
+
+REGULAR_SCHEMA_JSON = json.dumps(REGULAR_RESPONSE_SCHEMA)
+QUIZ_SCHEMA_JSON = json.dumps(QUIZ_RESPONSE_SCHEMA)
+
 class BedrockService:
     """AWS Bedrock service for AI interactions"""
     
@@ -35,7 +178,8 @@ class BedrockService:
             'bedrock-runtime',
             region_name=self.region_name,
             aws_access_key_id=self.aws_access_key,
-            aws_secret_access_key=self.aws_secret_key
+            aws_secret_access_key=self.aws_secret_key,
+            config=Config(max_pool_connections=MAX_POOL_CONNECTIONS, tcp_keepalive=True)
         )
         
         # Available models mapping
@@ -47,161 +191,91 @@ class BedrockService:
             # 'llama2_13b': 'meta.llama2-13b-chat-v1',
             # 'llama2_70b': 'meta.llama2-70b-chat-v1'
         }
+
+        # Generator per model provider, keyed by the provider segment of the model ID
+        self.generators = {
+            'anthropic': self._generate_claude_content,
+            # 'amazon': self._generate_titan_content,
+            # 'meta': self._generate_llama_content,
+        }
+
+        # Prompt/response cache (None when BEDROCK_CACHE_ENABLED=false)
+        self.cache = build_prompt_cache()
         
         logger.info(f"✅ Bedrock service initialized with model: {self.model_id}")
         
-    def generate_content(self, prompt: str, model_id: str = None, 
-                        max_tokens: int = 10000, temperature: float = 0.3, is_quiz_active: bool = False) -> str:
-        """Generate content using AWS Bedrock"""
+    def generate_content(self, prompt: Union[str, Dict[str, str]], model_id: str = None, 
+                        max_tokens: int = None, temperature: float = 0.3, is_quiz_active: bool = False,
+                        cache_query: str = None, cache_scope: str = None,
+                        parse: bool = False) -> Any:
+        """Generate content using AWS Bedrock
+
+        prompt is either plain text or a structured prompt {"system", "context", "query"}: the
+        static system text goes to Claude's cached system slot and context/query are sent as
+        separate user content blocks.
+
+        cache_query/cache_scope opt into the semantic cache tier: cache_query is the raw
+        student message and cache_scope identifies the course context it was asked against.
+        Quiz turns are stateful and always bypass the cache.
+
+        With parse=True the JSON reply is decoded and returned as a dict instead of text.
+        max_tokens defaults to MAX_TOKENS_QUIZ for quiz turns and MAX_TOKENS_REGULAR otherwise.
+        """
         try:
             model_id = model_id or self.model_id
+            max_tokens = max_tokens or (MAX_TOKENS_QUIZ if is_quiz_active else MAX_TOKENS_REGULAR)
+            use_cache = self.cache is not None and not is_quiz_active
+
+            if use_cache:
+                cached = self.cache.get(prompt, model_id, temperature, query=cache_query, scope=cache_scope)
+                if cached is not None:
+                    return self._parse_claude_json(cached) if parse else cached
             
-            if 'claude' in model_id:
-                return self._generate_claude_content(prompt, model_id, max_tokens, temperature, is_quiz_active)
-            # elif 'titan' in model_id:
-            #     return self._generate_titan_content(prompt, model_id, max_tokens, temperature)
-            # elif 'llama' in model_id:
-            #     return self._generate_llama_content(prompt, model_id, max_tokens, temperature)
-            else:
+            generator = self.generators.get(self._model_provider(model_id))
+            if generator is None:
                 raise ValueError(f"Unsupported model: {model_id}")
+            result = generator(prompt, model_id, max_tokens, temperature, is_quiz_active)
+
+            if use_cache:
+                self.cache.put(prompt, model_id, temperature, result, query=cache_query, scope=cache_scope)
+            return self._parse_claude_json(result) if parse else result
                 
         except Exception as e:
             logger.error(f"Error generating content with Bedrock: {e}")
             raise
     
-    def _generate_claude_content(self, prompt: str, model_id: str, 
+    def _model_provider(self, model_id: str) -> str:
+        """Provider segment of a model ID, e.g. 'anthropic' for 'us.anthropic.claude-sonnet-4-...'"""
+        segments = model_id.rsplit('/', 1)[-1].split('.', 2)
+        if len(segments) > 1 and segments[0] in INFERENCE_PROFILE_PREFIXES:
+            return segments[1]
+        return segments[0]
+
+    def _generate_claude_content(self, prompt: Union[str, Dict[str, str]], model_id: str, 
                                 max_tokens: int, temperature: float, is_quiz_active) -> str:
         """Generate content using Claude models"""
         try:
-            if not is_quiz_active:
-                schema = {
-          "$schema": "https://json-schema.org/draft/2020-12/schema",
-          "description": "Schema for quiz responses with metadata and a list of quiz questions",
-          "type": "object",
-          "properties": {
-            "answer": {
-              "type": "string",
-              "description": "The assistant's response to the user, including quiz introduction or instructions."
-            },
-            "wants_quiz": {
-              "type": "boolean",
-              "description": "Indicates if the user wants to proceed with a quiz."
-            },
-            "spoken_language": {
-              "type": "string",
-              "description": "The language in which the quiz will be presented."
-            },
-            "quiz": {
-              "type": "array",
-              "description": "A list of quiz questions.",
-              "items": {
-                "type": "object",
-                "properties": {
-                  "question_number": {
-                    "type": "integer",
-                    "description": "The number of the question in the sequence."
-                  },
-                  "difficulty": {
-                    "type": "string",
-                    "enum": ["easy", "medium", "hard"],
-                    "description": "The difficulty level of the question."
-                  },
-                  "question_type": {
-                    "type": "string",
-                    "enum": ["true_false", "multiple_choice"],
-                    "description": "The type of question (true/false or multiple choice)."
-                  },
-                  "question_text": {
-                    "type": "string",
-                    "description": "The text of the quiz question."
-                  },
-                  "options": {
-                    "type": "object",
-                    "description": "The answer options for the question, keyed by letter.",
-                    "patternProperties": {
-                      "^[A-Z]$": {
-                        "type": "string"
-                      }
-                    },
-                    "minProperties": 1
-                  },
-                  "expected_answer": {
-                    "type": "string",
-                    "description": "The correct answer key (e.g., 'A')."
-                  },
-                  "explanation": {
-                    "type": "string",
-                    "description": "Explanation of the correct answer."
-                  }
-                },
-                "required": [
-                  "question_number",
-                  "difficulty",
-                  "question_type",
-                  "question_text",
-                  "options",
-                  "expected_answer",
-                  "explanation"
-                ]
-              }
-            }
-          },
-          "required": ["answer", "wants_quiz", "spoken_language", "quiz"]
-        }
-            else:   
-                schema = {
-  "$schema": "https://json-schema.org/draft/2020-12/schema",
-  "description": "Schema for quiz response evaluation and progression",
-  "type": "object",
-  "properties": {
-    "response": {
-      "type": "string",
-      "description": "Tutor’s feedback message. Must include correctness evaluation, explanation, and (if applicable) the next question."
-    },
-    "quiz_active": {
-      "type": "boolean",
-      "description": "True if the quiz is still ongoing with questions left. False if the quiz has ended."
-    },
-    "question_id": {
-      "type": "integer",
-      "minimum": 1,
-      "description": "The ID of the question just handled. Remains the same until moving to the next question."
-    },
-    "user_score": {
-      "type": "integer",
-      "minimum": 0,
-      "maximum": 5,
-      "description": "The user’s cumulative score so far, based on correct answers."
-    }
-  },
-  "required": ["response", "quiz_active", "question_id", "user_score"],
-  "additionalProperties": 'false'
-}
-
-
-            input_data = {
-  "message": "Can you quiz me on design principles?",
-  "summary": "We’ve been learning about Design Thinking stages.",
-  "similar_past_convo": "Previously, the student asked about prototyping vs testing.",
-  "history": "Student asked: 'What is empathy in design?' — Tutor explained empathy in user research.",
-  "language": "english",
-  "difficulty": "medium",
-  "context_docs": "Design Thinking has 5 stages: Empathize, Define, Ideate, Prototype, Test."
-            }
+            schema_json = QUIZ_SCHEMA_JSON if is_quiz_active else REGULAR_SCHEMA_JSON
             
+            system = []
+            if isinstance(prompt, dict):
+                # Static instructions live in the system slot, cached together with the schema
+                system.append({"type": "text", "text": prompt["system"]})
+                prompt_blocks = [{"type": "text", "text": prompt[key]} for key in ("context", "query") if prompt.get(key)]
+            else:
+                prompt_blocks = [{"type": "text", "text": prompt}]
+            system.append({"type": "text", "text": schema_json, "cache_control": {"type": "ephemeral"}})
+
             body = {
                 "anthropic_version": "bedrock-2023-05-31",
                 "max_tokens": max_tokens,
                 "temperature": temperature,
                 # "response_format": {"type": "json"},
+                "system": system,
                 "messages": [
                     {
                         "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "text", "text": json.dumps(schema)}
-                            # {"type": "text", "text": json.dumps(input_data)}
-                        ]
+                        "content": prompt_blocks
                     }
                 ],
             }
@@ -212,13 +286,19 @@ class BedrockService:
             )
             
             response_body = json.loads(response['body'].read())
-            logger.info(f"Response body: {response_body}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response body: %s", response_body)
             return response_body['content'][0]['text']
             
         except ClientError as e:
             logger.error(f"Claude generation error: {e}")
             raise
     
+    def _parse_claude_json(self, text: str) -> Dict[str, Any]:
+        """Decode Claude's JSON reply, stripping the code fences it sometimes adds despite the prompt"""
+        text = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+        return orjson.loads(text)
+    
     # def _generate_titan_content(self, prompt: str, model_id: str, 
     #                            max_tokens: int, temperature: float) -> str:
     #     """Generate content using Amazon Titan models"""
@@ -277,5 +357,24 @@ class BedrockService:
     #     """Get model ID by name"""
     #     return self.available_models.get(model_name, self.model_id)
 
-# Global instance
-bedrock_service = BedrockService()
+# Lazily created global instance: building the client loads boto3 service models and
+# fails without AWS credentials, so it must not happen at import time
+_bedrock_service: Optional[BedrockService] = None
+_bedrock_service_lock = threading.Lock()
+
+
+def get_bedrock_service() -> BedrockService:
+    """Return the shared Bedrock service, creating it on first use"""
+    global _bedrock_service
+    if _bedrock_service is None:
+        with _bedrock_service_lock:
+            if _bedrock_service is None:
+                _bedrock_service = BedrockService()
+    return _bedrock_service
+
+
+def __getattr__(name: str) -> Any:
+    # Keeps `from .bedrock_service import bedrock_service` working for older callers
+    if name == "bedrock_service":
+        return get_bedrock_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,22 +2,167 @@
 Canvas API Service for LTI Integration
 Handles Canvas API calls for course modules, user progress, and completion tracking
 """
+import asyncio
+import functools
 import logging
-import requests
-from typing import Dict, List, Any, Optional
+import random
+import time
+import httpx
+import ijson
+import orjson
+from collections import OrderedDict, defaultdict
+from typing import AsyncIterator, Dict, List, Any, Optional
 from datetime import datetime
-import json
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 logger = logging.getLogger(__name__)
 
+# Course structure barely changes within an LTI session; progress moves faster
+MODULES_CACHE_TTL = 60
+PROGRESS_CACHE_TTL = 15
+CACHE_MAX_ENTRIES = 1024
+
+# Throttled (403 with an exhausted rate-limit bucket, 429) and transient 5xx responses are retried
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_STATUSES = {500, 502, 503, 504}
+
+# Canvas defaults to 10 items per page; 100 is the maximum it honours
+PAGE_SIZE = 100
+
+SUPPORTED_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+
+# REST endpoint templates, bound once so each call is a single format
+_MODULES_EP = "/api/v1/courses/{}/modules".format
+_MODULE_EP = "/api/v1/courses/{}/modules/{}".format
+_MODULE_ITEMS_EP = "/api/v1/courses/{}/modules/{}/items".format
+_MODULE_ITEM_EP = "/api/v1/courses/{}/modules/{}/items/{}".format
+_PROGRESS_EP = "/api/v1/courses/{}/users/{}/progress".format
+_ANALYTICS_EP = "/api/v1/courses/{}/analytics/users/{}/assignments".format
+
+# Static query strings. Repeated include[] keys need a list of pairs; a dict would keep only the last one
+_MODULES_QS = "?" + urlencode([("include[]", "items"), ("include[]", "content_details")])
+_CONTENT_DETAILS_QS = "?" + urlencode([("include[]", "content_details")])
+_COMPLETION_QS = "?" + urlencode([("include[]", "completion")])
+_PER_PAGE_QS = f"&per_page={PAGE_SIZE}"
+
+# One keep-alive HTTP/2 pool shared by every Canvas call in the process, so the
+# TLS handshake is paid once per Canvas host rather than once per request
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared Canvas HTTP client, creating it on first use"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared Canvas HTTP client"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# Response cache and in-flight fetches are process-wide so they outlive the
+# request-scoped CanvasAPIService instances
+_response_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+
+def cached_async(ttl: float):
+    """Cache a CanvasAPIService coroutine per Canvas host, course, user and arguments for ttl seconds.
+    
+    Misses are single-flight: concurrent callers for the same key await the one in-flight fetch
+    and share its result, even when that result is not cacheable.
+    Empty results and fallback payloads carrying an "error" are not cached.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            key = (self.base_url, self.course_id, self.user_id, func.__name__, args, tuple(sorted(kwargs.items())))
+            
+            cached = _response_cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            
+            inflight = _inflight.get(key)
+            if inflight is not None:
+                # shield: a cancelled follower must not cancel the leader's fetch
+                return await asyncio.shield(inflight)
+            
+            future = asyncio.get_running_loop().create_future()
+            _inflight[key] = future
+            try:
+                result = await func(self, *args, **kwargs)
+                if result and not (isinstance(result, dict) and result.get("error")):
+                    _response_cache[key] = (time.monotonic() + ttl, result)
+                    _response_cache.move_to_end(key)
+                    if len(_response_cache) > CACHE_MAX_ENTRIES:
+                        _response_cache.popitem(last=False)
+                future.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Mark the exception retrieved in case no follower was waiting
+                future.exception()
+                raise
+            finally:
+                _inflight.pop(key, None)
+        return wrapper
+    return decorator
+
 class CanvasAPIService:
     """Service for interacting with Canvas APIs via LTI Advantage"""
     
-    def __init__(self):
+    # Recommendation order by item type; unknown types sort last
+    _PRIORITY_ORDER = defaultdict(lambda: 999, {
+        "Assignment": 1,
+        "Quiz": 2,
+        "Discussion": 3,
+        "Page": 4,
+        "File": 5,
+        "ExternalUrl": 6
+    })
+    
+    # Fields copied from Canvas module payloads, with defaults for missing keys.
+    # Mutable defaults (lists/dicts) are filled in per call so entries never share them
+    _MODULE_FIELDS = (
+        ("id", None), ("name", None), ("position", None), ("state", None), ("published", True),
+        ("unlock_at", None), ("require_sequential_progress", False)
+    )
+    _ITEM_FIELDS = (
+        ("id", None), ("title", None), ("type", None), ("content_id", None), ("published", True),
+        ("indent", 0), ("url", None), ("page_url", None), ("external_url", None), ("new_tab", False)
+    )
+    _CONTENT_DETAIL_FIELDS = (
+        ("points_possible", None), ("due_at", None), ("unlock_at", None), ("lock_at", None),
+        ("locked", False), ("hidden", False), ("lock_explanation", None)
+    )
+    
+    def __init__(self, base_url: str = None, access_token: str = None, course_id: str = None, user_id: str = None):
+        """Create a service bound to one LTI request's Canvas context.
+        
+        Instances are cheap and request-scoped; the HTTP pool and response cache live at module level.
+        """
         self.base_url = None
         self.access_token = None
         self.course_id = None
         self.user_id = None
+        self._headers: Dict[str, str] = {}
+        
+        if base_url and access_token:
+            self.set_lti_context(base_url, access_token, course_id, user_id)
         
     def set_lti_context(self, base_url: str, access_token: str, course_id: str, user_id: str):
         """Set LTI context for Canvas API calls"""
@@ -26,6 +171,13 @@ class CanvasAPIService:
         self.course_id = course_id
         self.user_id = user_id
         
+        # Built once per context; the shared HTTP client serves many tokens, so these go on each request
+        self._headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        
         # Validate course_id
         if not course_id or course_id == 'None':
             logger.warning(f"Invalid course_id provided: {course_id}")
@@ -42,34 +194,99 @@ class CanvasAPIService:
         else:
             logger.error(f"Invalid course_id provided: {course_id}")
     
-    def _make_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Optional[Dict]:
-        """Make authenticated request to Canvas API"""
+    def invalidate(self, course_id: str = None):
+        """Drop cached Canvas responses for a course (or all courses) after a write"""
+        if course_id is None:
+            for key in [key for key in _response_cache if key[0] == self.base_url]:
+                del _response_cache[key]
+            return
+        for key in [key for key in _response_cache if key[0] == self.base_url and key[1] == course_id]:
+            del _response_cache[key]
+    
+    @staticmethod
+    def _backoff_delay(attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, RETRY_BASE_DELAY * (2 ** attempt))
+    
+    def _retry_delay(self, response: httpx.Response, attempt: int, method: str = "GET") -> Optional[float]:
+        """Seconds to wait before retrying this response, or None if it should not be retried.
+        
+        Canvas signals throttling with 403 and X-Rate-Limit-Remaining below 1 (or 429);
+        transient 5xx responses are retried with backoff as well. Writes may already have been
+        applied when they fail, so they are only resent on a 429 or 503 carrying Retry-After.
+        """
+        status = response.status_code
+        
+        if method != "GET":
+            if status not in (429, 503):
+                return None
+            try:
+                return float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                return None
+        
+        if status == 403:
+            try:
+                throttled = float(response.headers.get("X-Rate-Limit-Remaining", 1)) < 1
+            except ValueError:
+                throttled = False
+            if not throttled:
+                return None
+            try:
+                return float(response.headers.get("X-Rate-Limit-Reset", 1))
+            except ValueError:
+                return self._backoff_delay(attempt)
+        
+        if status == 429:
+            try:
+                return float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                return self._backoff_delay(attempt)
+        
+        if status in RETRY_STATUSES:
+            return self._backoff_delay(attempt)
+        
+        return None
+    
+    async def _make_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None,
+                            links: Optional[Dict] = None) -> Optional[Dict]:
+        """Make authenticated request to Canvas API.
+        
+        The endpoint may be a path or an absolute Canvas URL (as found in Link headers).
+        When a links dict is passed it is filled with the parsed Link header, keyed by rel.
+        """
         if not all([self.base_url, self.access_token, self.course_id]):
             logger.error("Canvas API context not properly set")
             return None
             
-        url = f"{self.base_url}{endpoint}"
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
+        url = endpoint if endpoint.startswith("http") else f"{self.base_url}{endpoint}"
+        logger.debug("Canvas API %s %s", method, url)
         
-        logger.info(f"Making Canvas API request: {method} {url}")
-        logger.info(f"Headers: {headers}")
+        method = method.upper()
+        if method not in SUPPORTED_METHODS:
+            logger.error(f"Unsupported HTTP method: {method}")
+            return None
         
+        client = get_http_client()
+        body = orjson.dumps(data) if data is not None else None
         try:
-            if method == "GET":
-                response = requests.get(url, headers=headers, timeout=10)
-            elif method == "POST":
-                response = requests.post(url, headers=headers, json=data, timeout=10)
-            elif method == "PUT":
-                response = requests.put(url, headers=headers, json=data, timeout=10)
-            else:
-                logger.error(f"Unsupported HTTP method: {method}")
-                return None
-            
-            logger.info(f"Canvas API response status: {response.status_code}")
-            logger.info(f"Canvas API response headers: {dict(response.headers)}")
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    response = await client.request(method, url, headers=self._headers, content=body)
+                except httpx.TransportError:
+                    # Only reads are safe to resend after a dropped connection
+                    if method != "GET" or attempt == MAX_RETRIES:
+                        raise
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    continue
+                
+                logger.debug("Canvas API status=%d", response.status_code)
+                
+                delay = self._retry_delay(response, attempt, method)
+                if delay is None or attempt == MAX_RETRIES:
+                    break
+                logger.warning(f"Canvas API throttled or unavailable ({response.status_code}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
             
             if response.status_code == 401:
                 logger.error("Canvas API authentication failed - token may be invalid")
@@ -83,17 +300,24 @@ class CanvasAPIService:
             
             response.raise_for_status()
             
+            # Writes can change module state, so cached reads for this course are stale
+            if method != "GET":
+                self.invalidate(self.course_id)
+            
+            if links is not None:
+                links.update({rel: link["url"] for rel, link in response.links.items()})
+            
             # Try to parse JSON response
             try:
-                return response.json()
-            except json.JSONDecodeError as e:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError as e:
                 logger.error(f"Failed to parse JSON response: {e}")
                 logger.error(f"Response content: {response.text[:500]}")
                 return None
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Canvas API request failed: {e}")
-            if hasattr(e, 'response') and e.response is not None:
+            if getattr(e, 'response', None) is not None:
                 logger.error(f"Response status: {e.response.status_code}")
                 logger.error(f"Response content: {e.response.text[:500]}")
             return None
@@ -101,32 +325,121 @@ class CanvasAPIService:
             logger.error(f"Unexpected error in Canvas API call: {e}")
             return None
     
-    def get_course_modules(self) -> List[Dict[str, Any]]:
-        """Get course modules with items and content details"""
-        try:
-            endpoint = f"/api/v1/courses/{self.course_id}/modules"
-            params = {
-                "include[]": "items",
-                "include[]": "content_details"
-            }
-            
-            # Build query string for parameters
-            query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-            full_endpoint = f"{endpoint}?{query_string}"
+    async def _paginate(self, endpoint: str) -> Optional[List[Dict[str, Any]]]:
+        """Fetch every page of a Canvas list endpoint and concatenate the results.
+        
+        Pages are requested at per_page=100. When Canvas advertises a numbered last page,
+        the remaining pages are fetched concurrently; otherwise rel="next" is followed.
+        Returns None if any page fails, so a partial list is never cached as the whole one.
+        """
+        separator = "&" if "?" in endpoint else "?"
+        links: Dict[str, str] = {}
+        first_page = await self._make_request(f"{endpoint}{separator}per_page={PAGE_SIZE}", links=links)
+        if not isinstance(first_page, list) or "next" not in links:
+            return first_page
+        
+        results = list(first_page)
+        last_url = urlsplit(links.get("last", ""))
+        last_page = dict(parse_qsl(last_url.query)).get("page", "")
+        
+        if last_page.isdigit():
+            query = parse_qsl(last_url.query)
+            page_urls = [
+                urlunsplit(last_url._replace(query=urlencode([(k, page if k == "page" else v) for k, v in query])))
+                for page in range(2, int(last_page) + 1)
+            ]
+            pages = await asyncio.gather(*[self._make_request(url) for url in page_urls])
+            for page in pages:
+                if not isinstance(page, list):
+                    logger.warning(f"Incomplete pagination for {endpoint}")
+                    return None
+                results.extend(page)
+            return results
+        
+        # Bookmark-style pagination: pages can only be walked in order
+        next_url = links.get("next")
+        while next_url:
+            links = {}
+            page = await self._make_request(next_url, links=links)
+            if not isinstance(page, list):
+                logger.warning(f"Incomplete pagination for {endpoint}")
+                return None
+            results.extend(page)
+            next_url = links.get("next")
+        return results
+    
+    async def _stream_request(self, endpoint: str, links: Optional[Dict] = None) -> AsyncIterator[Any]:
+        """Stream a Canvas JSON array response, yielding each element as soon as it is parsed.
+        
+        Keeps peak memory to the parsed elements rather than the raw body plus the full tree,
+        and lets callers process entries while the rest of the response is still arriving.
+        Throttled and transient failures are retried like _make_request while nothing has been
+        yielded yet; any other failure raises, so callers never mistake a cut-off stream for
+        a complete one.
+        """
+        if not all([self.base_url, self.access_token, self.course_id]):
+            logger.error("Canvas API context not properly set")
+            return
+        
+        url = endpoint if endpoint.startswith("http") else f"{self.base_url}{endpoint}"
+        logger.debug("Canvas API stream GET %s", url)
+        
+        yielded = False
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                async with get_http_client().stream("GET", url, headers=self._headers) as response:
+                    if response.status_code >= 400:
+                        delay = self._retry_delay(response, attempt)
+                        if delay is None or attempt == MAX_RETRIES:
+                            logger.error(f"Canvas API stream failed with status {response.status_code}")
+                            response.raise_for_status()
+                    else:
+                        if links is not None:
+                            links.update({rel: link["url"] for rel, link in response.links.items()})
+                        
+                        elements = ijson.sendable_list()
+                        parser = ijson.items_coro(elements, "item", use_float=True)
+                        async for chunk in response.aiter_bytes():
+                            parser.send(chunk)
+                            for element in elements:
+                                yielded = True
+                                yield element
+                            del elements[:]
+                        parser.close()
+                        for element in elements:
+                            yield element
+                        return
+            except httpx.TransportError:
+                # Elements already handed out cannot be taken back, so only a clean start is retried
+                if yielded or attempt == MAX_RETRIES:
+                    raise
+                delay = self._backoff_delay(attempt)
             
-            logger.info(f"Fetching course modules from Canvas REST API: {full_endpoint}")
-            modules_data = self._make_request(full_endpoint)
+            logger.warning(f"Canvas API stream throttled or unavailable, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+    
+    async def iter_course_modules(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield processed course modules (with items and content details) as they are received"""
+        next_url = _MODULES_EP(self.course_id) + _MODULES_QS + _PER_PAGE_QS
+        
+        logger.debug("Streaming course modules from Canvas REST API: %s", next_url)
+        while next_url:
+            links: Dict[str, str] = {}
+            async for module in self._stream_request(next_url, links=links):
+                yield self._process_module_data(module)
+            next_url = links.get("next")
+    
+    @cached_async(ttl=MODULES_CACHE_TTL)
+    async def get_course_modules(self) -> List[Dict[str, Any]]:
+        """Get course modules with items and content details.
+        
+        A stream that fails part way returns [] (which is not cached) rather than a partial list.
+        """
+        try:
+            processed_modules = [module async for module in self.iter_course_modules()]
             
-            if modules_data:
-                logger.info(f"Modules data received: {len(modules_data)} modules")
-                
-                # Process modules to add additional metadata
-                processed_modules = []
-                for module in modules_data:
-                    processed_module = self._process_module_data(module)
-                    processed_modules.append(processed_module)
-                
-                logger.info(f"Processed {len(processed_modules)} modules for course {self.course_id}")
+            if processed_modules:
+                logger.debug("Processed %d modules for course %s", len(processed_modules), self.course_id)
                 return processed_modules
             else:
                 logger.warning("Failed to get modules: No response data")
@@ -136,27 +449,19 @@ class CanvasAPIService:
             logger.error(f"Error getting course modules: {e}")
             return []
     
-    def get_module_details(self, module_id: str, student_id: str = None) -> Dict[str, Any]:
+    @cached_async(ttl=MODULES_CACHE_TTL)
+    async def get_module_details(self, module_id: str, student_id: str = None) -> Dict[str, Any]:
         """Get detailed information about a specific module using GET /api/v1/courses/:course_id/modules/:id"""
         try:
-            endpoint = f"/api/v1/courses/{self.course_id}/modules/{module_id}"
-            params = {
-                "include[]": "items",
-                "include[]": "content_details"
-            }
-            
+            full_endpoint = _MODULE_EP(self.course_id, module_id) + _MODULES_QS
             if student_id:
-                params["student_id"] = student_id
-            
-            # Build query string for parameters
-            query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-            full_endpoint = f"{endpoint}?{query_string}"
+                full_endpoint += "&" + urlencode({"student_id": student_id})
             
-            logger.info(f"Fetching detailed module information: {full_endpoint}")
-            module_data = self._make_request(full_endpoint)
+            logger.debug("Fetching detailed module information: %s", full_endpoint)
+            module_data = await self._make_request(full_endpoint)
             
             if module_data:
-                logger.info(f"Module details received for module {module_id}")
+                logger.debug("Module details received for module %s", module_id)
                 return self._process_module_data(module_data)
             else:
                 logger.warning("Failed to get module details: No response data")
@@ -166,29 +471,24 @@ class CanvasAPIService:
             logger.error(f"Error getting module details: {e}")
             return {}
     
-    def get_module_items(self, module_id: str, student_id: str = None, search_term: str = None) -> List[Dict[str, Any]]:
+    async def get_module_items(self, module_id: str, student_id: str = None, search_term: str = None) -> List[Dict[str, Any]]:
         """Get detailed list of items in a module using GET /api/v1/courses/:course_id/modules/:module_id/items"""
         try:
-            endpoint = f"/api/v1/courses/{self.course_id}/modules/{module_id}/items"
-            params = {
-                "include[]": "content_details"
-            }
+            full_endpoint = _MODULE_ITEMS_EP(self.course_id, module_id) + _CONTENT_DETAILS_QS
             
+            extra_params = {}
             if student_id:
-                params["student_id"] = student_id
-            
+                extra_params["student_id"] = student_id
             if search_term:
-                params["search_term"] = search_term
-            
-            # Build query string for parameters
-            query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-            full_endpoint = f"{endpoint}?{query_string}"
+                extra_params["search_term"] = search_term
+            if extra_params:
+                full_endpoint += "&" + urlencode(extra_params)
             
-            logger.info(f"Fetching module items: {full_endpoint}")
-            items_data = self._make_request(full_endpoint)
+            logger.debug("Fetching module items: %s", full_endpoint)
+            items_data = await self._paginate(full_endpoint)
             
             if items_data:
-                logger.info(f"Module items received: {len(items_data)} items for module {module_id}")
+                logger.debug("Module items received: %d items for module %s", len(items_data), module_id)
                 return items_data
             else:
                 logger.warning("Failed to get module items: No response data")
@@ -198,26 +498,18 @@ class CanvasAPIService:
             logger.error(f"Error getting module items: {e}")
             return []
     
-    def get_module_item_details(self, module_id: str, item_id: str, student_id: str = None) -> Dict[str, Any]:
+    async def get_module_item_details(self, module_id: str, item_id: str, student_id: str = None) -> Dict[str, Any]:
         """Get detailed information about a specific module item using GET /api/v1/courses/:course_id/modules/:module_id/items/:id"""
         try:
-            endpoint = f"/api/v1/courses/{self.course_id}/modules/{module_id}/items/{item_id}"
-            params = {
-                "include[]": "content_details"
-            }
-            
+            full_endpoint = _MODULE_ITEM_EP(self.course_id, module_id, item_id) + _CONTENT_DETAILS_QS
             if student_id:
-                params["student_id"] = student_id
-            
-            # Build query string for parameters
-            query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-            full_endpoint = f"{endpoint}?{query_string}"
+                full_endpoint += "&" + urlencode({"student_id": student_id})
             
-            logger.info(f"Fetching module item details: {full_endpoint}")
-            item_data = self._make_request(full_endpoint)
+            logger.debug("Fetching module item details: %s", full_endpoint)
+            item_data = await self._make_request(full_endpoint)
             
             if item_data:
-                logger.info(f"Module item details received for item {item_id}")
+                logger.debug("Module item details received for item %s", item_id)
                 return item_data
             else:
                 logger.warning("Failed to get module item details: No response data")
@@ -230,49 +522,22 @@ class CanvasAPIService:
     def _process_module_data(self, module: Dict[str, Any]) -> Dict[str, Any]:
         """Process and enhance module data with additional metadata"""
         try:
-            processed_module = {
-                "id": module.get("id"),
-                "name": module.get("name"),
-                "position": module.get("position"),
-                "state": module.get("state"),
-                "published": module.get("published", True),
-                "unlock_at": module.get("unlock_at"),
-                "require_sequential_progress": module.get("require_sequential_progress", False),
-                "prerequisite_module_ids": module.get("prerequisite_module_ids", []),
-                "items": []
-            }
+            processed_module = {key: module.get(key, default) for key, default in self._MODULE_FIELDS}
+            processed_module["prerequisite_module_ids"] = module.get("prerequisite_module_ids", [])
+            processed_module["items"] = []
             
             # Process module items with enhanced details
             if "items" in module:
                 for item in module["items"]:
-                    item_info = {
-                        "id": item.get("id"),
-                        "title": item.get("title"),
-                        "type": item.get("type"),
-                        "content_id": item.get("content_id"),
-                        "completion_requirement": item.get("completion_requirement"),
-                        "published": item.get("published", True),
-                        "indent": item.get("indent", 0),
-                        "url": item.get("url"),
-                        "page_url": item.get("page_url"),
-                        "external_url": item.get("external_url"),
-                        "new_tab": item.get("new_tab", False),
-                        "completion_requirement": item.get("completion_requirement", {})
-                    }
+                    item_info = {key: item.get(key, default) for key, default in self._ITEM_FIELDS}
+                    item_info["completion_requirement"] = item.get("completion_requirement", {})
                     
                     # Add content details if available
                     if "content_details" in item:
                         content_details = item["content_details"]
-                        item_info["content_details"] = {
-                            "points_possible": content_details.get("points_possible"),
-                            "due_at": content_details.get("due_at"),
-                            "unlock_at": content_details.get("unlock_at"),
-                            "lock_at": content_details.get("lock_at"),
-                            "locked": content_details.get("locked", False),
-                            "hidden": content_details.get("hidden", False),
-                            "lock_info": content_details.get("lock_info", {}),
-                            "lock_explanation": content_details.get("lock_explanation")
-                        }
+                        details = {key: content_details.get(key, default) for key, default in self._CONTENT_DETAIL_FIELDS}
+                        details["lock_info"] = content_details.get("lock_info", {})
+                        item_info["content_details"] = details
                     
                     processed_module["items"].append(item_info)
             
@@ -282,13 +547,14 @@ class CanvasAPIService:
             logger.error(f"Error processing module data: {e}")
             return module
     
-    def get_user_progress(self) -> Dict[str, Any]:
+    @cached_async(ttl=PROGRESS_CACHE_TTL)
+    async def get_user_progress(self) -> Dict[str, Any]:
         """Get user's progress through the course using Canvas REST API"""
         # Use the proper Canvas REST API endpoint for user progress
-        endpoint = f"/api/v1/courses/{self.course_id}/users/{self.user_id}/progress"
+        endpoint = _PROGRESS_EP(self.course_id, self.user_id)
         
-        logger.info(f"Fetching user progress from Canvas REST API: {endpoint}")
-        progress_data = self._make_request(endpoint)
+        logger.debug("Fetching user progress from Canvas REST API: %s", endpoint)
+        progress_data = await self._make_request(endpoint)
         
         if not progress_data:
             logger.warning("No progress data returned from Canvas API")
@@ -303,7 +569,7 @@ class CanvasAPIService:
                 "error": "Could not fetch progress from Canvas API"
             }
         
-        logger.info(f"Progress data received: {progress_data.keys()}")
+        logger.debug("Progress data received: %s", progress_data.keys())
         
         return {
             "completion": progress_data.get("completion", 0),
@@ -315,12 +581,10 @@ class CanvasAPIService:
             "canvas_response": progress_data
         }
     
-    def get_module_completion(self, module_id: str) -> Dict[str, Any]:
+    @cached_async(ttl=PROGRESS_CACHE_TTL)
+    async def get_module_completion(self, module_id: str) -> Dict[str, Any]:
         """Get completion status for a specific module"""
-        endpoint = f"/api/v1/courses/{self.course_id}/modules/{module_id}/items"
-        params = "?include[]=completion"
-        
-        items_data = self._make_request(endpoint + params)
+        items_data = await self._paginate(_MODULE_ITEMS_EP(self.course_id, module_id) + _COMPLETION_QS)
         if not items_data:
             return {}
         
@@ -351,29 +615,39 @@ class CanvasAPIService:
             
             completion_summary["items"].append(item_status)
         
-        logger.info(f"Module {module_id} completion: {completion_summary['completed_items']}/{completion_summary['total_items']}")
+        logger.debug("Module %s completion: %d/%d", module_id, completion_summary["completed_items"], completion_summary["total_items"])
         return completion_summary
     
-    def get_current_module_context(self) -> Dict[str, Any]:
+    async def get_current_module_context(self) -> Dict[str, Any]:
         """Get the current module context based on user progress"""
-        modules = self.get_course_modules()
+        modules = await self.get_course_modules()
         if not modules:
             return {}
         
-        # Find the first incomplete module
-        current_module = None
-        next_module = None
+        # Fetch completion for every incomplete module at once; the shared client
+        # multiplexes these over a single HTTP/2 connection
+        pending = [module for module in modules if module.get("state") != "completed"]
+        results = await asyncio.gather(
+            *[self.get_module_completion(str(module["id"])) for module in pending],
+            return_exceptions=True
+        )
         
-        for i, module in enumerate(modules):
-            if module["state"] != "completed":
-                if current_module is None:
-                    current_module = module
-                    # Get next module if available
-                    if i + 1 < len(modules):
-                        next_module = modules[i + 1]
-                break
+        module_completions = {}
+        for module, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not get completion for module {module['id']}: {result}")
+                result = {}
+            module_completions[str(module["id"])] = result
         
-        if not current_module:
+        return self._build_module_context(modules, module_completions)
+    
+    def _build_module_context(self, modules: List[Dict[str, Any]],
+                              module_completions: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Pick the current and next module and attach their completion details"""
+        # The first incomplete module is the current one
+        current_index = next((i for i, module in enumerate(modules) if module.get("state") != "completed"), None)
+        
+        if current_index is None:
             # All modules completed
             return {
                 "status": "completed",
@@ -382,20 +656,23 @@ class CanvasAPIService:
                 "next_module": None
             }
         
-        # Get completion details for current module
-        completion = self.get_module_completion(str(current_module["id"]))
+        current_module = modules[current_index]
+        next_module = modules[current_index + 1] if current_index + 1 < len(modules) else None
+        completion = module_completions.get(str(current_module["id"])) or {}
         
         return {
             "status": "in_progress",
             "current_module": current_module,
             "next_module": next_module,
             "completion": completion,
+            "module_completions": module_completions,
             "progress_percentage": (completion.get("completed_items", 0) / completion.get("total_items", 1)) * 100
         }
     
-    def get_recommended_content(self) -> List[Dict[str, Any]]:
-        """Get recommended content based on user progress"""
-        context = self.get_current_module_context()
+    async def get_recommended_content(self, context: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Get recommended content based on user progress; pass an existing module context to skip refetching it"""
+        if context is None:
+            context = await self.get_current_module_context()
         if not context or context.get("status") == "completed":
             return []
         
@@ -411,33 +688,33 @@ class CanvasAPIService:
         ]
         
         # Sort by priority (assignments first, then readings, etc.)
-        priority_order = {
-            "Assignment": 1,
-            "Quiz": 2,
-            "Discussion": 3,
-            "Page": 4,
-            "File": 5,
-            "ExternalUrl": 6
-        }
-        
-        incomplete_items.sort(key=lambda x: priority_order.get(x.get("type", ""), 999))
+        incomplete_items.sort(key=lambda x: self._PRIORITY_ORDER[x.get("type", "")])
         
         return incomplete_items[:5]  # Return top 5 recommendations
     
-    def get_course_analytics(self) -> Dict[str, Any]:
+    async def get_course_analytics(self) -> Dict[str, Any]:
         """Get course analytics for the user"""
-        endpoint = f"/api/v1/courses/{self.course_id}/analytics/users/{self.user_id}/assignments"
+        endpoint = _ANALYTICS_EP(self.course_id, self.user_id)
         
-        analytics_data = self._make_request(endpoint)
+        analytics_data = await self._make_request(endpoint)
         if not analytics_data:
             return {}
         
+        # Single pass over the assignments for every aggregate
+        total = completed = score_count = 0
+        score_sum = 0.0
+        for assignment in analytics_data:
+            total += 1
+            if (assignment.get("submission") or {}).get("submitted_at"):
+                completed += 1
+            score = assignment.get("score")
+            if score is not None:
+                score_sum += score
+                score_count += 1
+        
         return {
             "assignments": analytics_data,
-            "total_assignments": len(analytics_data),
-            "completed_assignments": len([a for a in analytics_data if a.get("submission", {}).get("submitted_at")]),
-            "average_score": sum(a.get("score", 0) for a in analytics_data if a.get("score")) / max(len([a for a in analytics_data if a.get("score")]), 1)
+            "total_assignments": total,
+            "completed_assignments": completed,
+            "average_score": score_sum / max(score_count, 1)
         }
-
-# Global instance
-canvas_api_service = CanvasAPIService() 
\ No newline at end of file
@@ -3,15 +3,96 @@ Enhanced Database Service for Iframe Widget Flow
 Handles database operations and course content retrieval
 """
 
+import asyncio
+import heapq
+import html as html_lib
 import logging
-from typing import Dict, List, Optional, Any
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Set, Tuple
 from datetime import datetime
-import requests
+import httpx
+import ijson
+import orjson
+
+try:
+    from selectolax.parser import HTMLParser
+    HAS_SELECTOLAX = True
+except ImportError:
+    HAS_SELECTOLAX = False
 
 logger = logging.getLogger(__name__)
 
 from app.core.config import settings
 
+# Canvas fan-out limits: at most this many requests in flight per service, 429s retried with backoff
+CANVAS_CONCURRENCY = 10
+CANVAS_MAX_RETRIES = 3
+CANVAS_TIMEOUT = 10
+CANVAS_RETRY_STATUSES = {429, 502, 503, 504}
+
+# Canvas list endpoints default to 10 items per page; 100 is the documented maximum
+CANVAS_PAGE_SIZE = 100
+
+# List bodies larger than this (or without a Content-Length) are stream-parsed
+CANVAS_STREAM_THRESHOLD = 64 * 1024
+
+# Keep-alive pool shared by every Canvas call, so TLS handshakes are paid once per connection
+CANVAS_POOL_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+
+# Course structure changes over hours, so Canvas responses are reused for a few minutes
+CANVAS_CACHE_SIZE = 2048
+CANVAS_REDIS_PREFIX = "canvas:"
+
+# Modules with their items in one GraphQL request, instead of one REST items call per module.
+# Module items expose their title and publish state on the linked content, whose type varies
+COURSE_MODULES_QUERY = """
+query CourseModules($courseId: ID!) {
+  course(id: $courseId) {
+    modulesConnection {
+      nodes {
+        _id
+        name
+        published
+        moduleItems {
+          _id
+          content {
+            __typename
+            ... on Assignment { title: name published }
+            ... on Discussion { title published }
+            ... on Page { title published }
+            ... on Quiz { title }
+            ... on File { title: displayName }
+            ... on ExternalUrl { title }
+            ... on SubHeader { title }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# A Canvas that rejects the modules query is not asked again for this long; REST is used instead
+CANVAS_GRAPHQL_RETRY_AFTER = 3600
+
+# Course documents added alongside a specific page in get_page_context
+PAGE_CONTEXT_COURSE_DOCS = 5
+
+# Page bodies are reduced to this many characters of plain text
+CLEAN_TEXT_LIMIT = 500
+
+# Raw HTML scanned per cleaning attempt; enough markup for CLEAN_TEXT_LIMIT characters of text on typical pages
+CLEAN_HTML_SCAN_LIMIT = 4000
+
+# Tag stripping fallback when selectolax is not installed
+_TAG_RE = re.compile(r"<[^>]+>")
+
+# search_context keeps an inverted index for the most recently searched context lists
+_WORD_RE = re.compile(r"\w+")
+SEARCH_INDEX_CACHE_SIZE = 32
+
 class DatabaseService:
     """Enhanced database service with course content retrieval"""
     
@@ -27,6 +108,81 @@ class DatabaseService:
             'Authorization': f'Bearer {self.canvas_token}',
             'Content-Type': 'application/json'
         }
+        self._canvas_semaphore = asyncio.Semaphore(CANVAS_CONCURRENCY)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._graphql_disabled_until = 0.0
+        
+        # Process-local TTL cache keyed by endpoint, with Redis as an optional shared tier;
+        # misses are single-flight through _inflight
+        self._canvas_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._redis = None
+        self._redis_enabled = bool(settings.redis_url)
+        
+        # id(context_docs) -> (context_docs, lowercased titles, lowercased contents, token -> doc indexes,
+        # base relevance scores)
+        self._search_indexes: "OrderedDict[int, tuple]" = OrderedDict()
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled Canvas client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=CANVAS_TIMEOUT,
+                # Transport-level retries cover connection failures; HTTP status retries live in _get_canvas_data
+                transport=httpx.AsyncHTTPTransport(retries=CANVAS_MAX_RETRIES, limits=CANVAS_POOL_LIMITS)
+            )
+        return self._client
+    
+    async def close(self):
+        """Release pooled Canvas connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _get_redis(self):
+        """Return the shared Redis client, or None if Redis is not configured or unavailable"""
+        if self._redis is None and self._redis_enabled:
+            try:
+                import redis.asyncio as redis
+                self._redis = redis.from_url(settings.redis_url)
+                logger.info("✅ Redis Canvas cache enabled")
+            except Exception as e:
+                logger.warning(f"⚠️ Redis Canvas cache disabled: {e}")
+                self._redis_enabled = False
+        return self._redis
+    
+    def _cache_get(self, endpoint: str) -> Optional[Any]:
+        cached = self._canvas_cache.get(endpoint)
+        if cached is None:
+            return None
+        if cached[0] <= time.monotonic():
+            del self._canvas_cache[endpoint]
+            return None
+        self._canvas_cache.move_to_end(endpoint)
+        return cached[1]
+    
+    def _cache_put(self, endpoint: str, data: Any):
+        self._canvas_cache[endpoint] = (time.monotonic() + settings.canvas_cache_ttl, data)
+        self._canvas_cache.move_to_end(endpoint)
+        if len(self._canvas_cache) > CANVAS_CACHE_SIZE:
+            self._canvas_cache.popitem(last=False)
+    
+    async def invalidate(self, course_id: str):
+        """Drop cached Canvas responses for a course from both cache tiers"""
+        prefix = f"/courses/{course_id}"
+        for endpoint in [ep for ep in self._canvas_cache if ep == prefix or ep.startswith(prefix + "/")]:
+            del self._canvas_cache[endpoint]
+        
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                keys = [key async for key in redis.scan_iter(match=f"{CANVAS_REDIS_PREFIX}{prefix}*")]
+                keys = [key for key in keys if key.decode().split(prefix, 1)[1][:1] in ("", "/")]
+                if keys:
+                    await redis.delete(*keys)
+            except Exception as e:
+                logger.warning(f"Redis Canvas cache invalidation failed: {e}")
     
     def health_check(self) -> Dict[str, Any]:
         """Basic health check for database service"""
@@ -50,102 +206,182 @@ class DatabaseService:
                 "timestamp": datetime.now().isoformat()
             }
     
-    def get_course_context(self, course_id: str) -> List[Dict[str, Any]]:
-        """Get comprehensive course context from Canvas API"""
+    async def get_course_context(self, course_id: str, include_module_items: bool = True,
+                                 page_limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get comprehensive course context from Canvas API.
+        
+        include_module_items=False skips the per-module item requests, and page_limit caps
+        each list endpoint to one page of that size, for callers that only need a summary.
+        """
         try:
             logger.info(f"Getting course context for course {course_id} from Canvas API")
             
-            # Use Canvas API directly for course context
-            logger.info(f"Using Canvas API for course {course_id}")
+            return await self._get_course_context(course_id, include_module_items, page_limit)
             
-            context_docs = []
+        except Exception as e:
+            logger.error(f"Error getting course context: {e}")
+            return []
+    
+    async def _get_course_context(self, course_id: str, include_module_items: bool = True,
+                                  page_limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Fetch and format the course context, fanning independent Canvas calls out concurrently"""
+        context_docs = []
+        
+        # A page_limit reads only the first page of that size; otherwise every page is collected
+        list_query = f"?per_page={page_limit}" if page_limit else ""
+        paginate = not page_limit
+        
+        modules_endpoint = f"/courses/{course_id}/modules{list_query}"
+        
+        # Phase 1: course info, modules, pages and assignments don't depend on each other;
+        # with items wanted, modules and their items come from a single GraphQL query
+        course_info, modules, pages, assignments = await asyncio.gather(
+            self._get_canvas_data(f"/courses/{course_id}"),
+            self._get_modules_graphql(course_id) if include_module_items
+            else self._get_canvas_data(modules_endpoint, paginate=paginate, published_only=True),
+            self._get_canvas_data(f"/courses/{course_id}/pages{list_query}", paginate=paginate, published_only=True),
+            self._get_canvas_data(f"/courses/{course_id}/assignments{list_query}", paginate=paginate, published_only=True)
+        )
+        
+        items_by_module = {}
+        if include_module_items and modules is not None:
+            items_by_module = {module["id"]: module["items"] for module in modules}
+        elif include_module_items:
+            # Phase 2 (REST fallback): items for every published module, once the module IDs are known
+            modules = await self._get_canvas_data(modules_endpoint, paginate=paginate, published_only=True)
+            item_modules = [module for module in modules or [] if module.get("published", False) and module.get("id")]
+            module_items = await asyncio.gather(*[
+                self._get_canvas_data(f"/courses/{course_id}/modules/{module['id']}/items", paginate=True, published_only=True)
+                for module in item_modules
+            ])
+            items_by_module = {module["id"]: items for module, items in zip(item_modules, module_items)}
+        
+        published_modules = [module for module in modules or [] if module.get("published", False)]
+        
+        # Get course information
+        if course_info:
+            context_docs.append({
+                "type": "course_info",
+                "title": course_info.get("name", f"Course {course_id}"),
+                "content": f"Course: {course_info.get('name', 'Unknown')}\nDescription: {course_info.get('description', 'No description available')}",
+                "source": "canvas_course",
+                "relevance_score": 1.0
+            })
+        
+        # Get course modules
+        for module in published_modules:
+            context_docs.append({
+                "type": "module",
+                "title": module.get("name", "Unknown Module"),
+                "content": f"Module: {module.get('name', 'Unknown')}\nDescription: {module.get('description', 'No description')}",
+                "source": "canvas_module",
+                "relevance_score": 0.9
+            })
             
-            # Get course information
-            course_info = self._get_canvas_data(f"/courses/{course_id}")
-            if course_info:
+            # Get module items
+            for item in items_by_module.get(module.get("id")) or []:
+                if item.get("published", False):
+                    context_docs.append({
+                        "type": "module_item",
+                        "title": item.get("title", "Unknown Item"),
+                        "content": f"Item: {item.get('title', 'Unknown')}\nType: {item.get('type', 'Unknown')}",
+                        "source": "canvas_module_item",
+                        "relevance_score": 0.8
+                    })
+        
+        # Get course pages
+        for page in pages or []:
+            if page.get("published", False):
+                # Clean HTML content
+                clean_body = self._clean_html_content(page.get("body", "No content"))
                 context_docs.append({
-                    "type": "course_info",
-                    "title": course_info.get("name", f"Course {course_id}"),
-                    "content": f"Course: {course_info.get('name', 'Unknown')}\nDescription: {course_info.get('description', 'No description available')}",
-                    "source": "canvas_course",
-                    "relevance_score": 1.0
+                    "type": "page",
+                    "title": page.get("title", "Unknown Page"),
+                    "content": f"Page: {page.get('title', 'Unknown')}\nContent: {clean_body}",
+                    "source": "canvas_page",
+                    "relevance_score": 0.8
                 })
+        
+        # Get course assignments
+        for assignment in assignments or []:
+            if assignment.get("published", False):
+                context_docs.append({
+                    "type": "assignment",
+                    "title": assignment.get("name", "Unknown Assignment"),
+                    "content": f"Assignment: {assignment.get('name', 'Unknown')}\nDescription: {assignment.get('description', 'No description')}",
+                    "source": "canvas_assignment",
+                    "relevance_score": 0.7
+                })
+        
+        self._add_search_fields(context_docs)
+        logger.info(f"Retrieved {len(context_docs)} context documents from Canvas API for course {course_id}")
+        return context_docs
+    
+    async def _get_modules_graphql(self, course_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Fetch modules with their items in one GraphQL request, shaped like the REST responses.
+        
+        Returns None when GraphQL is unavailable or errors, so the caller falls back to REST.
+        """
+        cache_key = f"/courses/{course_id}/modules#graphql"
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        if self._graphql_disabled_until > time.monotonic():
+            return None
+        
+        try:
+            body = {"query": COURSE_MODULES_QUERY, "variables": {"courseId": str(course_id)}}
+            response, data = await self._fetch_canvas(f"{self.canvas_url}/api/graphql", json_body=body)
+            if data is None or data.get("errors"):
+                logger.warning(f"Canvas GraphQL modules query failed for course {course_id}, using REST: "
+                               f"{response.status_code} {(data or {}).get('errors')}")
+                self._graphql_disabled_until = time.monotonic() + CANVAS_GRAPHQL_RETRY_AFTER
+                return None
             
-            # Get course modules
-            modules = self._get_canvas_data(f"/courses/{course_id}/modules")
-            if modules:
-                for module in modules:
-                    if module.get("published", False):
-                        context_docs.append({
-                            "type": "module",
-                            "title": module.get("name", "Unknown Module"),
-                            "content": f"Module: {module.get('name', 'Unknown')}\nDescription: {module.get('description', 'No description')}",
-                            "source": "canvas_module",
-                            "relevance_score": 0.9
-                        })
-                        
-                        # Get module items
-                        module_id = module.get("id")
-                        if module_id:
-                            items = self._get_canvas_data(f"/courses/{course_id}/modules/{module_id}/items")
-                            if items:
-                                for item in items:
-                                    if item.get("published", False):
-                                        context_docs.append({
-                                            "type": "module_item",
-                                            "title": item.get("title", "Unknown Item"),
-                                            "content": f"Item: {item.get('title', 'Unknown')}\nType: {item.get('type', 'Unknown')}",
-                                            "source": "canvas_module_item",
-                                            "relevance_score": 0.8
-                                        })
-            
-            # Get course pages
-            pages = self._get_canvas_data(f"/courses/{course_id}/pages")
-            if pages:
-                for page in pages:
-                    if page.get("published", False):
-                        # Clean HTML content
-                        clean_body = self._clean_html_content(page.get("body", "No content"))
-                        context_docs.append({
-                            "type": "page",
-                            "title": page.get("title", "Unknown Page"),
-                            "content": f"Page: {page.get('title', 'Unknown')}\nContent: {clean_body}",
-                            "source": "canvas_page",
-                            "relevance_score": 0.8
-                        })
-            
-            # Get course assignments
-            assignments = self._get_canvas_data(f"/courses/{course_id}/assignments")
-            if assignments:
-                for assignment in assignments:
-                    if assignment.get("published", False):
-                        context_docs.append({
-                            "type": "assignment",
-                            "title": assignment.get("name", "Unknown Assignment"),
-                            "content": f"Assignment: {assignment.get('name', 'Unknown')}\nDescription: {assignment.get('description', 'No description')}",
-                            "source": "canvas_assignment",
-                            "relevance_score": 0.7
-                        })
+            course = (data.get("data") or {}).get("course") or {}
+            nodes = (course.get("modulesConnection") or {}).get("nodes")
+            if nodes is None:
+                return None
             
-            logger.info(f"Retrieved {len(context_docs)} context documents from Canvas API for course {course_id}")
-            return context_docs
+            modules = [{
+                "id": node.get("_id"),
+                "name": node.get("name"),
+                "published": node.get("published", False),
+                "items": [self._graphql_module_item(item) for item in node.get("moduleItems") or []]
+            } for node in nodes]
+            self._cache_put(cache_key, modules)
+            return modules
             
         except Exception as e:
-            logger.error(f"Error getting course context: {e}")
-            return []
+            logger.warning(f"Canvas GraphQL modules query failed for course {course_id}, using REST: {e}")
+            return None
     
-    def get_page_context(self, course_id: str, page_slug: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _graphql_module_item(item: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape a GraphQL module item like the REST one; content without a publish flag counts as published"""
+        content = item.get("content") or {}
+        return {
+            "id": item.get("_id"),
+            "title": content.get("title") or "Unknown Item",
+            "type": content.get("__typename", "Unknown"),
+            "published": content.get("published", True)
+        }
+    
+    async def get_page_context(self, course_id: str, page_slug: str) -> List[Dict[str, Any]]:
         """Get specific page context from Canvas API"""
         try:
             logger.info(f"Getting page context for course {course_id}, page {page_slug} from Canvas API")
             
-            # Use Canvas API directly for page context
-            logger.info(f"Using Canvas API for page {page_slug}")
-            
             context_docs = []
             
-            # Get the specific page
-            page_data = self._get_canvas_data(f"/courses/{course_id}/pages/{page_slug}")
+            # The page and a shallow course summary (no module items, first page of each
+            # list) are fetched together; only the first few course documents are kept
+            page_data, course_context = await asyncio.gather(
+                self._get_canvas_data(f"/courses/{course_id}/pages/{page_slug}"),
+                self._get_course_context(course_id, include_module_items=False,
+                                         page_limit=PAGE_CONTEXT_COURSE_DOCS)
+            )
+            
             if page_data:
                 # Clean HTML content from page body
                 clean_body = self._clean_html_content(page_data.get("body", "No content"))
@@ -157,9 +393,9 @@ class DatabaseService:
                     "relevance_score": 1.0
                 })
             
-            # Also get general course context for broader understanding
-            course_context = self.get_course_context(course_id)
-            context_docs.extend(course_context[:5])  # Add top 5 course documents
+            # Also add general course context for broader understanding
+            context_docs.extend(course_context[:PAGE_CONTEXT_COURSE_DOCS])
+            self._add_search_fields(context_docs)
             
             logger.info(f"Retrieved {len(context_docs)} context documents from Canvas API for page {page_slug}")
             return context_docs
@@ -170,19 +406,30 @@ class DatabaseService:
     
     def search_context(self, query: str, context_docs: List[Dict[str, Any]], 
                       max_results: int = 5) -> List[Dict[str, Any]]:
-        """Search through context documents for relevance to query"""
+        """Search through in-memory context documents for relevance to query.
+        
+        Chunks stored in Postgres are searched server-side with db_config_rce.search_course_chunks.
+        """
         try:
             if not context_docs:
                 return []
             
             # Simple keyword-based search
             query_lower = query.lower()
-            scored_docs = []
+            query_words = query_lower.split()
+            _, titles, contents, index, base_scores = self._get_search_index(context_docs)
+            
+            # Only documents containing a query word as a whole token are scored; the rest keep their
+            # base relevance. Substring matching still applies to the scoring of those candidates
+            candidates: Set[int] = set()
+            for word in set(_WORD_RE.findall(query_lower)):
+                candidates |= index.get(word, set())
             
-            for doc in context_docs:
+            scores = list(base_scores)
+            for i in candidates:
+                title = titles[i]
+                content = contents[i]
                 score = 0
-                title = doc.get("title", "").lower()
-                content = doc.get("content", "").lower()
                 
                 # Score based on title matches
                 if query_lower in title:
@@ -193,21 +440,15 @@ class DatabaseService:
                     score += 2
                 
                 # Score based on word matches
-                query_words = query_lower.split()
                 for word in query_words:
                     if word in title:
                         score += 1
                     if word in content:
                         score += 0.5
                 
-                # Add base relevance score
-                score += doc.get("relevance_score", 0)
-                
-                scored_docs.append((doc, score))
+                scores[i] += score
             
-            # Sort by score and return top results
-            scored_docs.sort(key=lambda x: x[1], reverse=True)
-            top_docs = [doc for doc, score in scored_docs[:max_results] if score > 0]
+            top_docs = [context_docs[i] for i in self._top_indices(scores, max_results) if scores[i] > 0]
             
             logger.info(f"Search returned {len(top_docs)} relevant documents for query: {query}")
             return top_docs
@@ -216,14 +457,112 @@ class DatabaseService:
             logger.error(f"Error searching context: {e}")
             return []
     
-    def _get_canvas_data(self, endpoint: str) -> Optional[Any]:
-        """Make request to Canvas API"""
+    @staticmethod
+    def _add_search_fields(context_docs: List[Dict[str, Any]]):
+        """Store lowercased title/content on each document once, for every later search over it"""
+        for doc in context_docs:
+            if "_title_lc" not in doc:
+                doc["_title_lc"] = doc.get("title", "").lower()
+                doc["_content_lc"] = doc.get("content", "").lower()
+    
+    @staticmethod
+    def _top_indices(scores: List[float], k: int) -> List[int]:
+        """Indices of the k highest scores, best first, ties in document order (as a stable sort gives)"""
+        return heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
+    
+    def _get_search_index(self, context_docs: List[Dict[str, Any]]) -> tuple:
+        """Return the lowercased fields and token index for a context list, building them once per list"""
+        key = id(context_docs)
+        entry = self._search_indexes.get(key)
+        if entry is not None and entry[0] is context_docs and len(entry[1]) == len(context_docs):
+            self._search_indexes.move_to_end(key)
+            return entry
+        
+        self._add_search_fields(context_docs)
+        titles = [doc["_title_lc"] for doc in context_docs]
+        contents = [doc["_content_lc"] for doc in context_docs]
+        index: Dict[str, Set[int]] = {}
+        for i, (title, content) in enumerate(zip(titles, contents)):
+            for token in _WORD_RE.findall(title) + _WORD_RE.findall(content):
+                index.setdefault(token, set()).add(i)
+        base_scores = [doc.get("relevance_score", 0) for doc in context_docs]
+        
+        entry = (context_docs, titles, contents, index, base_scores)
+        self._search_indexes[key] = entry
+        if len(self._search_indexes) > SEARCH_INDEX_CACHE_SIZE:
+            self._search_indexes.popitem(last=False)
+        return entry
+    
+    async def _get_canvas_data(self, endpoint: str, paginate: bool = False,
+                               published_only: bool = False) -> Optional[Any]:
+        """Make request to Canvas API, bounded to CANVAS_CONCURRENCY in flight and backing off on 429/5xx.
+        
+        With paginate=True the endpoint is a list: pages of CANVAS_PAGE_SIZE are requested and
+        every page advertised by the Link header is collected into one list. With published_only=True
+        unpublished list entries are dropped while parsing, so they are never cached.
+        """
         try:
-            url = f"{self.canvas_url}/api/v1{endpoint}"
-            response = requests.get(url, headers=self.headers, timeout=10)
+            if paginate:
+                separator = "&" if "?" in endpoint else "?"
+                endpoint = f"{endpoint}{separator}per_page={CANVAS_PAGE_SIZE}"
+            cache_key = f"{endpoint}#published" if published_only else endpoint
+            
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+            
+            inflight = self._inflight.get(cache_key)
+            if inflight is not None:
+                # shield: a cancelled follower must not cancel the leader's fetch
+                return await asyncio.shield(inflight)
+            
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[cache_key] = future
+            try:
+                data = await self._load_canvas_data(endpoint, cache_key, paginate, published_only)
+                future.set_result(data)
+                return data
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            finally:
+                self._inflight.pop(cache_key, None)
+                
+        except Exception as e:
+            logger.error(f"Error making Canvas API request: {e}")
+            return None
+    
+    async def _load_canvas_data(self, endpoint: str, cache_key: str, paginate: bool,
+                                published_only: bool) -> Optional[Any]:
+        """Read an endpoint through the Redis tier or from Canvas, filling both cache tiers"""
+        try:
+            redis = self._get_redis()
+            if redis is not None:
+                try:
+                    raw = await redis.get(CANVAS_REDIS_PREFIX + cache_key)
+                    if raw is not None:
+                        data = orjson.loads(raw)
+                        self._cache_put(cache_key, data)
+                        return data
+                except Exception as e:
+                    logger.warning(f"Redis Canvas cache read failed: {e}")
+            
+            response, data = await self._fetch_canvas(f"{self.canvas_url}/api/v1{endpoint}", published_only)
             
             if response.status_code == 200:
-                return response.json()
+                if paginate and isinstance(data, list):
+                    remaining = await self._fetch_remaining_pages(response, published_only)
+                    if remaining is None:
+                        # A partial list must not be cached as if it were the whole collection
+                        return None
+                    data.extend(remaining)
+                self._cache_put(cache_key, data)
+                if redis is not None:
+                    try:
+                        await redis.setex(CANVAS_REDIS_PREFIX + cache_key, settings.canvas_cache_ttl, orjson.dumps(data))
+                    except Exception as e:
+                        logger.warning(f"Redis Canvas cache write failed: {e}")
+                return data
             else:
                 logger.warning(f"Canvas API request failed: {response.status_code} for {endpoint}")
                 return None
@@ -232,32 +571,125 @@ class DatabaseService:
             logger.error(f"Error making Canvas API request: {e}")
             return None
     
+    async def _fetch_canvas(self, url: str, published_only: bool = False,
+                            json_body: Optional[Dict[str, Any]] = None) -> Tuple[httpx.Response, Optional[Any]]:
+        """GET a Canvas URL (or POST json_body to it) under the concurrency limit, retrying rate limits
+        and gateway errors.
+        
+        Returns the response and its decoded body (None unless the status is 200).
+        """
+        client = self._get_client()
+        method = "GET" if json_body is None else "POST"
+        async with self._canvas_semaphore:
+            for attempt in range(CANVAS_MAX_RETRIES + 1):
+                async with client.stream(method, url, json=json_body) as response:
+                    if response.status_code not in CANVAS_RETRY_STATUSES or attempt == CANVAS_MAX_RETRIES:
+                        if response.status_code != 200:
+                            return response, None
+                        return response, await self._read_canvas_json(response, published_only)
+                try:
+                    delay = float(response.headers.get("Retry-After"))
+                except (TypeError, ValueError):
+                    delay = 0.3 * (2 ** attempt)
+                logger.warning(f"Canvas API returned {response.status_code} for {url}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    async def _read_canvas_json(self, response: httpx.Response, published_only: bool) -> Any:
+        """Decode a Canvas response body.
+        
+        Large (or unsized) list bodies read with published_only are parsed incrementally with ijson,
+        so unpublished entries and their HTML bodies are discarded as soon as each one is parsed
+        instead of after the whole array has been built.
+        """
+        length = response.headers.get("Content-Length")
+        if published_only and (length is None or int(length) > CANVAS_STREAM_THRESHOLD):
+            data = []
+            parsed = ijson.sendable_list()
+            parser = ijson.items_coro(parsed, "item", use_float=True)
+            async for chunk in response.aiter_bytes():
+                parser.send(chunk)
+                data.extend(item for item in parsed if item.get("published", False))
+                del parsed[:]
+            parser.close()
+            data.extend(item for item in parsed if item.get("published", False))
+            return data
+        
+        data = orjson.loads(await response.aread())
+        if published_only and isinstance(data, list):
+            data = [item for item in data if item.get("published", False)]
+        return data
+    
+    async def _fetch_remaining_pages(self, first: httpx.Response, published_only: bool = False) -> Optional[List[Any]]:
+        """Collect the pages after the first one of a paginated Canvas list.
+        
+        When the Link header names a numbered last page, pages 2..N are requested concurrently;
+        otherwise (bookmark-style pagination) the next links are followed one at a time.
+        Returns None if any page fails.
+        """
+        next_link = first.links.get("next", {}).get("url")
+        if not next_link:
+            return []
+        
+        last_url = httpx.URL(first.links.get("last", {}).get("url", ""))
+        last_page = last_url.params.get("page", "")
+        if last_page.isdigit():
+            page_urls = [str(last_url.copy_set_param("page", page)) for page in range(2, int(last_page) + 1)]
+            pages = await asyncio.gather(*[self._fetch_canvas(url, published_only) for url in page_urls])
+            results = []
+            for response, data in pages:
+                if data is None:
+                    logger.warning(f"Canvas API page request failed: {response.status_code} for {response.url}")
+                    return None
+                results.extend(data)
+            return results
+        
+        results = []
+        while next_link:
+            response, data = await self._fetch_canvas(next_link, published_only)
+            if data is None:
+                logger.warning(f"Canvas API page request failed: {response.status_code} for {next_link}")
+                return None
+            results.extend(data)
+            next_link = response.links.get("next", {}).get("url")
+        return results
+    
+    @staticmethod
+    def _html_to_text(html_content: str) -> str:
+        """Strip tags and decode entities"""
+        if "<" not in html_content:
+            # Plain text, only entities to decode
+            return html_lib.unescape(html_content)
+        if HAS_SELECTOLAX:
+            # Single C-level DOM walk; entities come back already decoded
+            return HTMLParser(html_content).text(separator=" ", strip=True)
+        return html_lib.unescape(_TAG_RE.sub("", html_content))
+    
     def _clean_html_content(self, html_content: str) -> str:
         """Clean HTML content and extract readable text"""
         try:
             if not html_content or html_content == "No content":
                 return "No content available"
             
-            # Simple HTML tag removal (can be enhanced with BeautifulSoup later)
-            import re
-            
-            # Remove HTML tags
-            clean_text = re.sub(r'<[^>]+>', '', html_content)
-            
-            # Remove extra whitespace
-            clean_text = re.sub(r'\s+', ' ', clean_text)
-            
-            # Remove HTML entities
-            clean_text = clean_text.replace('&nbsp;', ' ')
-            clean_text = clean_text.replace('&amp;', '&')
-            clean_text = clean_text.replace('&lt;', '<')
-            clean_text = clean_text.replace('&gt;', '>')
-            clean_text = clean_text.replace('&quot;', '"')
+            # Only a prefix of the body is cleaned: it is widened (x4) only while the text it
+            # yields could still be shorter than CLEAN_TEXT_LIMIT
+            scan_limit = CLEAN_HTML_SCAN_LIMIT
+            while True:
+                if len(html_content) <= scan_limit:
+                    chunk = html_content
+                else:
+                    # Cut after the last complete tag so no half tag leaks into the text
+                    cut = html_content.rfind(">", 0, scan_limit) + 1
+                    chunk = html_content[:cut or scan_limit]
+                
+                # Collapse whitespace (str.split also treats decoded &nbsp; as whitespace)
+                clean_text = " ".join(self._html_to_text(chunk).split())
+                if len(clean_text) > CLEAN_TEXT_LIMIT or chunk is html_content:
+                    break
+                scan_limit *= 4
             
-            # Clean up and limit length
-            clean_text = clean_text.strip()
-            if len(clean_text) > 500:
-                clean_text = clean_text[:500] + "..."
+            # Limit length
+            if len(clean_text) > CLEAN_TEXT_LIMIT:
+                clean_text = clean_text[:CLEAN_TEXT_LIMIT] + "..."
             
             return clean_text if clean_text else "Content available but no readable text found"
             
@@ -4,22 +4,52 @@ Handles PostgreSQL connections with pgvector extension support
 """
 
 import os
+import asyncio
 import logging
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Pooled connections replace a TCP + auth handshake per helper call with a checkout
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 20
+
+# Embeddings are stored as FP16 halfvec (pgvector >= 0.7), half the bytes of vector per row and index entry
+EMBEDDING_DIM = 112
+
+# HNSW graph parameters for course_chunks.embedding, and the per-session search breadth
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 40
+
+# Hybrid search: candidates from each index, then a weighted blend of text rank and cosine similarity
+HYBRID_CANDIDATES = 50
+HYBRID_TEXT_WEIGHT = 0.5
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+
+# ThreadedConnectionPool raises PoolError instead of waiting when every connection is out, so
+# checkouts from asyncio.to_thread workers queue here for a free slot
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+
 
 def get_connection_string() -> str:
     """Get PostgreSQL connection string from environment variables"""
     return f"postgresql://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
 
 
-def get_database_connection() -> Optional[psycopg2.extensions.connection]:
-    """Get a database connection with pgvector support"""
+def get_database_connection(cursor_factory=RealDictCursor) -> Optional[psycopg2.extensions.connection]:
+    """Get a standalone database connection (cursor_factory=None gives plain tuple rows).
+    
+    Prefer db_conn(), which borrows from the shared pool; the pgvector extension is created once by init_db().
+    """
     try:
         connection = psycopg2.connect(
             host=settings.db_host,
@@ -27,15 +57,10 @@ def get_database_connection() -> Optional[psycopg2.extensions.connection]:
             database=settings.db_name,
             user=settings.db_user,
             password=settings.db_password,
-            cursor_factory=RealDictCursor
+            cursor_factory=cursor_factory
         )
         
-        # Enable pgvector extension
-        with connection.cursor() as cursor:
-            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-            connection.commit()
-            
-        logger.info("✅ Database connection established with pgvector support")
+        logger.info("✅ Database connection established")
         return connection
         
     except Exception as e:
@@ -43,11 +68,75 @@ def get_database_connection() -> Optional[psycopg2.extensions.connection]:
         return None
 
 
+def get_pool() -> ThreadedConnectionPool:
+    """Return the shared connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    DB_POOL_MIN_CONNECTIONS,
+                    DB_POOL_MAX_CONNECTIONS,
+                    host=settings.db_host,
+                    port=settings.db_port,
+                    database=settings.db_name,
+                    user=settings.db_user,
+                    password=settings.db_password,
+                    cursor_factory=RealDictCursor,
+                    options=f"-c hnsw.ef_search={HNSW_EF_SEARCH}"
+                )
+                logger.info("✅ Database connection pool created")
+    return _pool
+
+
+@contextmanager
+def db_conn() -> Iterator[psycopg2.extensions.connection]:
+    """Borrow a pooled connection (RealDictCursor rows by default), rolling back anything left uncommitted.
+    
+    Blocks while all DB_POOL_MAX_CONNECTIONS connections are checked out.
+    """
+    pool = get_pool()
+    with _pool_slots:
+        connection = pool.getconn()
+        try:
+            yield connection
+        finally:
+            broken = connection.closed != 0
+            if not broken:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    broken = True
+            pool.putconn(connection, close=broken)
+
+
+def close_pool():
+    """Close every pooled connection"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def init_db() -> bool:
+    """One-time startup setup: create the pool and enable the pgvector extension"""
+    try:
+        with db_conn() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            connection.commit()
+        logger.info("✅ Database pool ready with pgvector support")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Database initialization failed: {e}")
+        return False
+
+
 def test_connection() -> bool:
     """Test database connection and pgvector extension"""
     try:
-        connection = get_database_connection()
-        if connection:
+        with db_conn() as connection:
             with connection.cursor() as cursor:
                 # Test basic connection
                 cursor.execute("SELECT version();")
@@ -75,36 +164,29 @@ def test_connection() -> bool:
                 else:
                     logger.warning("⚠️ course_chunks table not found")
                 
-            connection.close()
             return True
             
     except Exception as e:
         logger.error(f"❌ Connection test failed: {e}")
         return False
-    
-    return False
 
 
 def create_course_chunks_table():
     """Create the course_chunks table if it doesn't exist"""
     try:
-        connection = get_database_connection()
-        if not connection:
-            return False
-            
-        with connection.cursor() as cursor:
-            cursor.execute("""
+        with db_conn() as connection, connection.cursor() as cursor:
+            cursor.execute(f"""
                 CREATE TABLE IF NOT EXISTS course_chunks (
                     id SERIAL PRIMARY KEY,
                     course_id VARCHAR(50) NOT NULL,
                     content TEXT NOT NULL,
-                    metadata JSONB DEFAULT '{}',
+                    metadata JSONB DEFAULT '{{}}',
                     chunk_type VARCHAR(50),
                     topic VARCHAR(100),
                     module VARCHAR(100),
                     module_item_id VARCHAR(50),
                     page_slug VARCHAR(100),
-                    embedding vector(112),
+                    embedding halfvec({EMBEDDING_DIM}),
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
@@ -126,9 +208,41 @@ def create_course_chunks_table():
                 ON course_chunks(topic);
             """)
             
+            # Full-text vector maintained by Postgres, for the text half of search_course_chunks
             cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_course_chunks_embedding 
-                ON course_chunks USING ivfflat (embedding vector_cosine_ops);
+                ALTER TABLE course_chunks
+                ADD COLUMN IF NOT EXISTS content_tsv tsvector
+                GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+            """)
+            
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_course_chunks_content_tsv 
+                ON course_chunks USING gin(content_tsv);
+            """)
+            
+            # HNSW gives logarithmic ANN search without list/probe tuning; it replaces the
+            # untuned ivfflat index that earlier versions created
+            cursor.execute("DROP INDEX IF EXISTS idx_course_chunks_embedding;")
+            
+            # Tables created with a float32 vector column are converted in place
+            cursor.execute("""
+                SELECT format_type(atttypid, atttypmod) AS embedding_type
+                FROM pg_attribute
+                WHERE attrelid = 'course_chunks'::regclass AND attname = 'embedding';
+            """)
+            column = cursor.fetchone()
+            if column and column['embedding_type'].startswith('vector'):
+                cursor.execute("DROP INDEX IF EXISTS idx_course_chunks_embedding_hnsw;")
+                cursor.execute(f"""
+                    ALTER TABLE course_chunks
+                    ALTER COLUMN embedding TYPE halfvec({EMBEDDING_DIM})
+                    USING embedding::halfvec({EMBEDDING_DIM});
+                """)
+            
+            cursor.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_course_chunks_embedding_hnsw 
+                ON course_chunks USING hnsw (embedding halfvec_cosine_ops)
+                WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION});
             """)
             
             connection.commit()
@@ -138,19 +252,12 @@ def create_course_chunks_table():
     except Exception as e:
         logger.error(f"❌ Failed to create course_chunks table: {e}")
         return False
-    finally:
-        if connection:
-            connection.close()
 
 
 def get_course_chunks_count(course_id: str) -> int:
     """Get the count of chunks for a specific course"""
     try:
-        connection = get_database_connection()
-        if not connection:
-            return 0
-            
-        with connection.cursor() as cursor:
+        with db_conn() as connection, connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
             cursor.execute("""
                 SELECT COUNT(*) as count 
                 FROM course_chunks 
@@ -158,9 +265,8 @@ def get_course_chunks_count(course_id: str) -> int:
             """, (course_id,))
             
             result = cursor.fetchone()
-            count = result['count'] if result else 0
+            count = result[0] if result else 0
             
-        connection.close()
         return count
         
     except Exception as e:
@@ -171,11 +277,7 @@ def get_course_chunks_count(course_id: str) -> int:
 def get_course_chunks_metadata(course_id: str) -> list:
     """Get metadata about chunks for a specific course"""
     try:
-        connection = get_database_connection()
-        if not connection:
-            return []
-            
-        with connection.cursor() as cursor:
+        with db_conn() as connection, connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
             cursor.execute("""
                 SELECT 
                     chunk_type,
@@ -188,12 +290,85 @@ def get_course_chunks_metadata(course_id: str) -> list:
                 ORDER BY chunk_type, topic, module
             """, (course_id,))
             
-            results = cursor.fetchall()
-            metadata = [dict(row) for row in results]
+            # Tuple rows zipped with the column names once, instead of a dict row per fetch plus a copy
+            columns = [column.name for column in cursor.description]
+            metadata = [dict(zip(columns, row)) for row in cursor.fetchall()]
             
-        connection.close()
         return metadata
         
     except Exception as e:
         logger.error(f"❌ Failed to get course chunks metadata: {e}")
-        return [] 
\ No newline at end of file
+        return [] 
+
+
+
+def search_course_chunks(course_id: str, query: str, query_embedding: Sequence[float], limit: int = 5) -> List[dict]:
+    """Hybrid full-text + vector search over a course's chunks, scored inside Postgres.
+    
+    Each side takes its top HYBRID_CANDIDATES through its own index (GIN for text, HNSW for
+    vectors); only that union is blended and ranked, so neither index is bypassed by the final sort.
+    """
+    embedding = "[" + ",".join(str(x) for x in query_embedding) + "]"
+    try:
+        with db_conn() as connection, connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH q AS (
+                    SELECT plainto_tsquery('english', %(query)s) AS tsq,
+                           %(embedding)s::halfvec({EMBEDDING_DIM}) AS emb
+                ),
+                text_hits AS (
+                    SELECT c.id
+                    FROM course_chunks c, q
+                    WHERE c.course_id = %(course_id)s AND c.content_tsv @@ q.tsq
+                    ORDER BY ts_rank_cd(c.content_tsv, q.tsq) DESC
+                    LIMIT %(candidates)s
+                ),
+                vector_hits AS (
+                    SELECT c.id
+                    FROM course_chunks c, q
+                    WHERE c.course_id = %(course_id)s
+                    ORDER BY c.embedding <=> q.emb
+                    LIMIT %(candidates)s
+                )
+                SELECT c.id, c.content, c.chunk_type, c.topic, c.module, c.module_item_id, c.page_slug,
+                       ts_rank_cd(c.content_tsv, q.tsq) AS txt_score,
+                       1 - (c.embedding <=> q.emb) AS vec_score
+                FROM course_chunks c, q
+                WHERE c.id IN (SELECT id FROM text_hits UNION SELECT id FROM vector_hits)
+                ORDER BY %(text_weight)s * ts_rank_cd(c.content_tsv, q.tsq)
+                         + (1 - %(text_weight)s) * (1 - (c.embedding <=> q.emb)) DESC
+                LIMIT %(limit)s
+            """, {
+                "query": query,
+                "embedding": embedding,
+                "course_id": course_id,
+                "candidates": HYBRID_CANDIDATES,
+                "text_weight": HYBRID_TEXT_WEIGHT,
+                "limit": limit,
+            })
+            return [dict(row) for row in cursor.fetchall()]
+            
+    except Exception as e:
+        logger.error(f"❌ Hybrid course chunk search failed: {e}")
+        return []
+
+
+# Async shims: psycopg2 blocks, so coroutine callers run the helpers on the default thread pool
+async def ainit_db() -> bool:
+    return await asyncio.to_thread(init_db)
+
+
+async def atest_connection() -> bool:
+    return await asyncio.to_thread(test_connection)
+
+
+async def aget_course_chunks_count(course_id: str) -> int:
+    return await asyncio.to_thread(get_course_chunks_count, course_id)
+
+
+async def aget_course_chunks_metadata(course_id: str) -> list:
+    return await asyncio.to_thread(get_course_chunks_metadata, course_id)
+
+
+async def asearch_course_chunks(course_id: str, query: str, query_embedding: Sequence[float], limit: int = 5) -> List[dict]:
+    return await asyncio.to_thread(search_course_chunks, course_id, query, query_embedding, limit)
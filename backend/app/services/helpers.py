@@ -1,17 +1,77 @@
 import numpy as np
-import warnings
 
-# def patched_array(obj, copy=None, **kwargs):
-#     if copy is False:
-#         warnings.warn("copy=False is deprecated in NumPy 2.0, using np.asarray instead")
-#         return np.asarray(obj, **kwargs)
-#     return original_array(obj, copy=copy, **kwargs)
+import functools
+import logging
+import re
+import threading
+
+from underthesea_core import FastText
+
+logger = logging.getLogger(__name__)
+
+# Product-quantized language ID model (~1MB instead of the 126MB lid.176.bin), fetched at image build.
+# Loaded on first use so workers that never detect a language don't pay for it.
+_model = None
+_model_lock = threading.Lock()
+
+_IGNORE_WORDS = frozenset({"hi", "hello", "yes"})
+
+# Common function words that only one of the two languages uses. Prompts made mostly of these
+# are classified without running fastText; anything ambiguous still goes to the model.
+_ENGLISH_STOPWORDS = frozenset({
+    "the", "a", "an", "is", "are", "was", "were", "be", "been", "to", "of", "and", "in", "on",
+    "that", "it", "for", "with", "as", "this", "these", "those", "what", "how", "why", "when",
+    "where", "who", "which", "can", "do", "does", "did", "you", "your", "i", "my", "me", "we",
+    "our", "please", "not", "have", "has", "will", "would", "should", "could", "about", "from",
+    "there", "explain", "tell", "help", "thanks", "thank", "next", "give", "example", "mean",
+})
+_INDONESIAN_STOPWORDS = frozenset({
+    "yang", "dan", "di", "ke", "dari", "ini", "itu", "apa", "bagaimana", "kenapa", "mengapa",
+    "untuk", "dengan", "tidak", "ada", "adalah", "saya", "aku", "kamu", "anda", "bisa", "tolong",
+    "jelaskan", "dalam", "pada", "akan", "sudah", "belum", "juga", "atau", "karena", "tentang",
+    "kami", "kita", "mereka", "saja", "lagi", "jika", "kalau", "harus", "boleh", "mau", "ingin",
+    "seperti", "lebih", "bukan", "sangat", "terima", "kasih", "berikan", "contoh", "maksud",
+})
+_LANGUAGE_WORD_RE = re.compile(r"[a-z]+")
 
-# np.array = patched_array
 
-import fasttext
+def _get_model() -> FastText:
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = FastText.load("lid.176.ftz")
+    return _model
 
-model = fasttext.load_model("lid.176.bin")
+
+@functools.lru_cache(maxsize=4096)
+def _predict_language(text: str) -> str | None:
+    """Map the top fastText labels to 'english'/'indonesian'; short prompts repeat, so results are cached"""
+    labels, probs = _get_model().predict(text, k=3)
+    logger.debug("Detected labels: %s with probabilities %s", labels, probs)
+
+    for label, prob in zip(labels, probs):
+        if label == "__label__en":
+            return "english"
+        elif label in ("__label__id", "__label__min"):  # treat Minangkabau as Indonesian
+            return "indonesian"
+
+    return None
+
+
+def _stopword_language(cleaned: str) -> str | None:
+    """Classify plain-ASCII text from its stopwords when the evidence is one-sided, else None"""
+    if not cleaned.isascii():
+        return None
+    words = _LANGUAGE_WORD_RE.findall(cleaned)
+    english = sum(word in _ENGLISH_STOPWORDS for word in words)
+    indonesian = sum(word in _INDONESIAN_STOPWORDS for word in words)
+    # At least two hits, none for the other language, and a third of the words
+    if english >= 2 and not indonesian and english * 3 >= len(words):
+        return "english"
+    if indonesian >= 2 and not english and indonesian * 3 >= len(words):
+        return "indonesian"
+    return None
 
 
 def detect_language(text: str) -> str | None:
@@ -19,26 +79,21 @@ def detect_language(text: str) -> str | None:
     Detect if text is English or Indonesian.
     Returns 'english', 'indonesian', or None.
     """
-    print("Detecting language...", text)
+    logger.debug("Detecting language: %s", text)
     # Normalize text
-    IGNORE = {"hi", "hello", "yes"}
     cleaned = text.strip().lower()
 
     # Check ignored words
-    if cleaned in IGNORE:
+    if cleaned in _IGNORE_WORDS:
         return None
 
-    # Predict language
-    labels, probs = model.predict(text, k=3)
-    print(f"Detected labels: {labels} with probabilities {probs}")
+    # Unambiguous stopwords decide without the model
+    language = _stopword_language(cleaned)
+    if language:
+        return language
 
-    for label, prob in zip(labels, probs):
-        if label == "__label__en":
-            return "english"
-        elif label in ("__label__id", "__label__min"):  # treat Minangkabau as Indonesian
-            return "indonesian"
-
-    return None
+    # Predict language
+    return _predict_language(text)
 
 
 
@@ -52,18 +107,31 @@ Fetches Canvas course data and stores it in PostgreSQL database
 Automatically detects and transcribes YouTube videos in page content
 """
 
+import asyncio
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import html
 import psycopg2
+from psycopg2.extras import execute_values
 import subprocess
-import whisper
 import os
-import tempfile
-from typing import Dict, List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from typing import Dict, List, Any, Optional, Union
 import logging
 from app.services.db_config_rce import get_connection_string
 
+try:
+    from selectolax.parser import HTMLParser
+    HAS_SELECTOLAX = True
+except ImportError:
+    HAS_SELECTOLAX = False
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -115,6 +183,46 @@ except Exception as e:
         'password': 'ai_tutor_password'
     }
 
+# Whisper transcription: each video's 30s windows are decoded in batches of
+# WHISPER_BATCH_SIZE, and WHISPER_WORKERS threads transcribe different videos at once
+# on as many CTranslate2 model workers, fed by a separate pool of audio downloads
+AUDIO_DOWNLOAD_WORKERS = 8
+WHISPER_MODEL_SIZE = "base"
+WHISPER_BATCH_SIZE = 16
+WHISPER_WORKERS = 4
+WHISPER_SAMPLE_RATE = 16000
+# Silero VAD settings: silences of half a second or more split speech, so intros, music and
+# pauses in lecture videos never reach the encoder
+WHISPER_VAD_PARAMETERS = {"min_silence_duration_ms": 500}
+
+# CTranslate2 quantization: int8 weights with fp16 activations on GPU, plain int8 on CPU
+WHISPER_DEVICE = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+# Every visible GPU gets a model replica; CTranslate2 spreads concurrent calls across them
+WHISPER_DEVICE_INDEX = list(range(ctranslate2.get_cuda_device_count())) if WHISPER_DEVICE == "cuda" else 0
+WHISPER_COMPUTE_TYPE = "int8_float16" if WHISPER_DEVICE == "cuda" else "int8"
+
+# Concurrent Canvas fetches for a course's module items and pages
+CANVAS_FETCH_CONCURRENCY = 32
+
+# Rows per multi-row INSERT statement for module and module item upserts
+INSERT_PAGE_SIZE = 500
+
+# HTML cleanup (regex tag stripping is the fallback when selectolax is not installed) and
+# YouTube link extraction patterns
+_TAG_RE = re.compile(r'<[^>]+>')
+_WS_RE = re.compile(r'\s+')
+_EMBED_RE = re.compile(r'<iframe[^>]*src="([^"]*youtube\.com/embed/[^"]*)"[^>]*>', re.IGNORECASE)
+_DIRECT_RE = re.compile(r'https?://(?:www\.)?youtube\.com/watch\?v=([a-zA-Z0-9_-]+)', re.IGNORECASE)
+_VID_RE = re.compile(r'/embed/([a-zA-Z0-9_-]+)')
+_WATCH_ID_RE = re.compile(r'[?&]v=([a-zA-Z0-9_-]+)')
+
+
+def _video_id(youtube_url: str) -> Optional[str]:
+    """Pull the video ID out of a youtube.com/watch?v=... URL"""
+    match = _WATCH_ID_RE.search(youtube_url)
+    return match.group(1) if match else None
+
+
 # API Headers
 headers = {
     'Authorization': f'Bearer {os.getenv("CANVAS_API_TOKEN")}',
@@ -129,6 +237,18 @@ class CanvasDataStore:
         self.connection = None
         self.cursor = None
         self.whisper_model = None
+        self.batched_whisper = None
+        
+        # One keep-alive session for every Canvas call, retrying rate limits and server errors
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         
     def connect_db(self):
         """Connect to PostgreSQL database"""
@@ -139,6 +259,7 @@ class CanvasDataStore:
             
             # Ensure pages table has yt_transcript column
             self._ensure_yt_transcript_column()
+            self._ensure_yt_transcripts_table()
             return True
         except Exception as e:
             logger.error(f"❌ Database connection failed: {e}")
@@ -156,8 +277,25 @@ class CanvasDataStore:
         except Exception as e:
             logger.error(f"❌ Error adding yt_transcript column: {e}")
     
+    def _ensure_yt_transcripts_table(self):
+        """Ensure the per-video transcript cache table exists"""
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS yt_transcripts (
+                    video_id TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    transcript TEXT NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            self.connection.commit()
+            logger.info("✅ Ensured yt_transcripts table exists")
+        except Exception as e:
+            logger.error(f"❌ Error creating yt_transcripts table: {e}")
+    
     def close_db(self):
         """Close database connection"""
+        self.session.close()
         if self.cursor:
             self.cursor.close()
         if self.connection:
@@ -167,7 +305,7 @@ class CanvasDataStore:
     def get_all_courses(self) -> List[int]:
         """Fetch all courses from Canvas and return their IDs"""
         try:
-            response = requests.get(f"{os.getenv("CANVAS_URL")}/api/v1/courses", headers=headers)
+            response = self.session.get(f"{os.getenv("CANVAS_URL")}/api/v1/courses")
             response.raise_for_status()
             courses = response.json()
             return [course['id'] for course in courses]
@@ -180,7 +318,7 @@ class CanvasDataStore:
         url = f"{os.getenv("CANVAS_URL")}/api/v1/courses/{course_id}/{endpoint}"
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url)
             response.raise_for_status()
             data = response.json()
             logger.info(f"✅ Fetched {len(data) if isinstance(data, list) else 1} items from {endpoint}")
@@ -194,7 +332,7 @@ class CanvasDataStore:
         url = f"{os.getenv("CANVAS_URL")}/api/v1/courses/{course_id}/modules/{module_id}/items"
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url)
             response.raise_for_status()
             data = response.json()
             logger.info(f"✅ Fetched {len(data)} items for module {module_id}")
@@ -208,7 +346,7 @@ class CanvasDataStore:
         url = f"{os.getenv("CANVAS_URL")}/api/v1/courses/{course_id}/pages/{page_url}"
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url)
             response.raise_for_status()
             data = response.json()
             logger.info(f"✅ Fetched page content for {page_url}")
@@ -217,117 +355,255 @@ class CanvasDataStore:
             logger.error(f"❌ Error fetching page content for {page_url}: {e}")
             return None
     
+    async def _afetch_json(self, client: httpx.AsyncClient, url: str, what: str) -> Optional[Any]:
+        """GET a Canvas URL on the async client, logging and returning None on failure"""
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            # ValueError covers a 200 whose body is not JSON (e.g. an HTML login page)
+            logger.error(f"❌ Error fetching {what}: {e}")
+            return None
+    
+    async def fetch_course_content(self, modules: List[Dict], course_id) -> tuple:
+        """Fetch every module's items, then every page they reference, concurrently.
+        
+        Returns ({module_id: items or None}, {page_url: page or None}).
+        """
+        base_url = f"{os.getenv("CANVAS_URL")}/api/v1/courses/{course_id}"
+        limits = httpx.Limits(max_connections=CANVAS_FETCH_CONCURRENCY)
+        async with httpx.AsyncClient(http2=True, headers=headers, limits=limits, timeout=30) as client:
+            module_items = await asyncio.gather(*[
+                self._afetch_json(client, f"{base_url}/modules/{module['id']}/items", f"module items for module {module['id']}")
+                for module in modules
+            ])
+            items_by_module = {module['id']: items for module, items in zip(modules, module_items)}
+            
+            page_urls = list(dict.fromkeys(
+                item['page_url']
+                for items in module_items if items
+                for item in items
+                if item['type'].lower() == 'page' and item.get('page_url')
+            ))
+            pages = await asyncio.gather(*[
+                self._afetch_json(client, f"{base_url}/pages/{page_url}", f"page content for {page_url}")
+                for page_url in page_urls
+            ])
+        
+        logger.info(f"✅ Fetched items for {len(modules)} modules and {len(page_urls)} pages")
+        return items_by_module, dict(zip(page_urls, pages))
+    
     def extract_youtube_urls(self, html_content: str) -> List[str]:
         """Extract YouTube URLs from HTML content"""
         if not html_content:
             return []
         
-        youtube_urls = []
-        
-        # Pattern for YouTube embed URLs
-        embed_pattern = r'<iframe[^>]*src="([^"]*youtube\.com/embed/[^"]*)"[^>]*>'
-        embed_matches = re.findall(embed_pattern, html_content, re.IGNORECASE)
-        
-        # Pattern for direct YouTube URLs
-        direct_pattern = r'https?://(?:www\.)?youtube\.com/watch\?v=([a-zA-Z0-9_-]+)'
-        direct_matches = re.findall(direct_pattern, html_content, re.IGNORECASE)
-        
-        # Convert embed URLs to watch URLs
-        for embed_url in embed_matches:
-            video_id_match = re.search(r'/embed/([a-zA-Z0-9_-]+)', embed_url)
-            if video_id_match:
-                video_id = video_id_match.group(1)
-                youtube_urls.append(f"https://www.youtube.com/watch?v={video_id}")
-        
-        # Add direct URLs
-        for video_id in direct_matches:
-            youtube_urls.append(f"https://www.youtube.com/watch?v={video_id}")
+        # YouTube embed URLs, then direct YouTube URLs, as video IDs
+        video_ids = [m.group(1) for m in map(_VID_RE.search, _EMBED_RE.findall(html_content)) if m]
+        video_ids.extend(_DIRECT_RE.findall(html_content))
         
         # Remove duplicates while preserving order
-        seen = set()
-        unique_urls = []
-        for url in youtube_urls:
-            if url not in seen:
-                seen.add(url)
-                unique_urls.append(url)
-        
-        return unique_urls
+        return [f"https://www.youtube.com/watch?v={video_id}" for video_id in dict.fromkeys(video_ids)]
     
-    def download_audio(self, youtube_url: str, output_file: str = None) -> Optional[str]:
-        """Download audio from YouTube video"""
-        if not output_file:
-            output_file = tempfile.mktemp(suffix=".mp3")
+    def download_audio(self, youtube_url: str) -> Optional[np.ndarray]:
+        """Download audio from YouTube video as 16kHz mono float32 PCM, ready for Whisper.
         
+        The best audio stream is piped straight through one ffmpeg resample, so there is no
+        MP3 encode/decode round trip and nothing is written to disk.
+        """
         try:
             logger.info(f"🎵 Downloading audio from: {youtube_url}")
-            subprocess.run([
-                "yt-dlp", "-x", "--audio-format", "mp3", "-o", output_file, youtube_url
-            ], check=True, capture_output=True)
-            logger.info(f"✅ Audio downloaded to: {output_file}")
-            return output_file
-        except subprocess.CalledProcessError as e:
-            logger.error(f"❌ Error downloading audio: {e}")
-            return None
+            with subprocess.Popen(
+                ["yt-dlp", "-f", "bestaudio", "--quiet", "-o", "-", youtube_url],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            ) as ytdlp:
+                ffmpeg = subprocess.Popen(
+                    ["ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+                     "-ac", "1", "-ar", str(WHISPER_SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+                    stdin=ytdlp.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                )
+                # Let yt-dlp see SIGPIPE if ffmpeg exits early
+                ytdlp.stdout.close()
+                pcm, ffmpeg_error = ffmpeg.communicate()
+            
+            if ytdlp.returncode or ffmpeg.returncode or not pcm:
+                logger.error(f"❌ Error downloading audio: yt-dlp exit {ytdlp.returncode}, "
+                             f"ffmpeg exit {ffmpeg.returncode}: {ffmpeg_error.decode(errors='replace').strip()}")
+                return None
+            
+            audio = np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+            logger.info(f"✅ Audio downloaded ({len(audio) / WHISPER_SAMPLE_RATE:.0f}s)")
+            return audio
         except FileNotFoundError:
-            logger.error("❌ yt-dlp not found. Please install it: pip install yt-dlp")
+            logger.error("❌ yt-dlp or ffmpeg not found. Please install them: pip install yt-dlp")
             return None
     
-    def transcribe_with_whisper(self, audio_file: str) -> Optional[str]:
-        """Transcribe audio using Whisper"""
+    def _get_batched_whisper(self) -> BatchedInferencePipeline:
+        """Load the faster-whisper model and its batched pipeline on first use"""
+        if not self.batched_whisper:
+            logger.info("🔄 Loading Whisper model...")
+            self.whisper_model = WhisperModel(
+                WHISPER_MODEL_SIZE,
+                device=WHISPER_DEVICE,
+                device_index=WHISPER_DEVICE_INDEX,
+                compute_type=WHISPER_COMPUTE_TYPE,
+                num_workers=WHISPER_WORKERS
+            )
+            self.batched_whisper = BatchedInferencePipeline(model=self.whisper_model)
+        return self.batched_whisper
+    
+    def transcribe_with_whisper(self, audio: Union[str, np.ndarray]) -> Optional[str]:
+        """Transcribe audio (a file path or 16kHz float32 samples) using Whisper"""
         try:
-            if not self.whisper_model:
-                logger.info("🔄 Loading Whisper model...")
-                self.whisper_model = whisper.load_model("base")
+            batched_whisper = self._get_batched_whisper()
             
-            logger.info(f"�� Transcribing audio: {audio_file}")
-            result = self.whisper_model.transcribe(audio_file)
-            transcript = result["text"].strip()
+            logger.info(f"�� Transcribing audio: {audio if isinstance(audio, str) else f'{len(audio) / WHISPER_SAMPLE_RATE:.0f}s of samples'}")
+            # Greedy decoding; the VAD filter skips silence and music before it reaches the decoder
+            segments, _ = batched_whisper.transcribe(
+                audio, batch_size=WHISPER_BATCH_SIZE, beam_size=1,
+                vad_filter=True, vad_parameters=WHISPER_VAD_PARAMETERS
+            )
+            transcript = "".join(segment.text for segment in segments).strip()
             logger.info(f"✅ Transcription completed ({len(transcript)} characters)")
             return transcript
         except Exception as e:
             logger.error(f"❌ Error transcribing audio: {e}")
             return None
     
+    @contextmanager
+    def _savepoint(self):
+        """Run statements inside a savepoint, so a failure rolls back only them and not the
+        surrounding module-items transaction"""
+        self.cursor.execute("SAVEPOINT yt_transcript_cache")
+        try:
+            yield
+        except Exception:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT yt_transcript_cache")
+            raise
+        self.cursor.execute("RELEASE SAVEPOINT yt_transcript_cache")
+    
+    def _get_cached_transcripts(self, video_ids: List[str]) -> Dict[str, str]:
+        """Look up stored transcripts for these video IDs made with the current Whisper model"""
+        if not video_ids:
+            return {}
+        try:
+            with self._savepoint():
+                self.cursor.execute(
+                    "SELECT video_id, transcript FROM yt_transcripts WHERE video_id = ANY(%s) AND model = %s",
+                    (video_ids, WHISPER_MODEL_SIZE)
+                )
+                return dict(self.cursor.fetchall())
+        except Exception as e:
+            logger.error(f"❌ Error reading cached transcripts: {e}")
+            return {}
+    
+    def _cache_transcript(self, video_id: str, transcript: str):
+        """Store a video's transcript so later pages and runs skip downloading and transcribing it"""
+        try:
+            with self._savepoint():
+                self.cursor.execute("""
+                    INSERT INTO yt_transcripts (video_id, model, transcript, updated_at)
+                    VALUES (%s, %s, %s, NOW())
+                    ON CONFLICT (video_id) DO UPDATE SET
+                        model = EXCLUDED.model,
+                        transcript = EXCLUDED.transcript,
+                        updated_at = EXCLUDED.updated_at
+                """, (video_id, WHISPER_MODEL_SIZE, transcript))
+        except Exception as e:
+            logger.error(f"❌ Error caching transcript for video {video_id}: {e}")
+    
+    def transcribe_youtube_videos(self, youtube_urls: List[str]) -> List[Optional[str]]:
+        """Download and transcribe a page's videos with downloads and transcription overlapping.
+        
+        Videos already in yt_transcripts for the current model are served from there. The rest are
+        downloaded (network-bound) on their own pool; each finished download is handed to the
+        transcription pool, whose threads share the batched Whisper pipeline. Transcripts come back
+        in the order of youtube_urls.
+        """
+        transcripts: List[Optional[str]] = [None] * len(youtube_urls)
+        video_ids = [_video_id(url) for url in youtube_urls]
+        cached = self._get_cached_transcripts([video_id for video_id in video_ids if video_id])
+        pending = []
+        for i, video_id in enumerate(video_ids):
+            if video_id in cached:
+                transcripts[i] = cached[video_id]
+            else:
+                pending.append(i)
+        if cached:
+            logger.info(f"⚡ Reused {len(youtube_urls) - len(pending)} cached transcript(s)")
+        if not pending:
+            return transcripts
+        
+        try:
+            # Load the model up front so the transcription threads don't race to create it
+            self._get_batched_whisper()
+            with ThreadPoolExecutor(max_workers=AUDIO_DOWNLOAD_WORKERS) as download_pool, \
+                    ThreadPoolExecutor(max_workers=WHISPER_WORKERS) as whisper_pool:
+                downloads = {download_pool.submit(self.download_audio, youtube_urls[i]): i for i in pending}
+                transcriptions = {}
+                for download in as_completed(downloads):
+                    audio = download.result()
+                    if audio is not None:
+                        transcriptions[whisper_pool.submit(self.transcribe_with_whisper, audio)] = downloads[download]
+                
+                for transcription in as_completed(transcriptions):
+                    transcripts[transcriptions[transcription]] = transcription.result()
+            
+            # Cache writes stay on this thread, which owns the cursor
+            for i in pending:
+                if transcripts[i] and video_ids[i]:
+                    self._cache_transcript(video_ids[i], transcripts[i])
+            return transcripts
+        except Exception as e:
+            logger.error(f"❌ Error transcribing YouTube videos: {e}")
+            return transcripts
+    
     def transcribe_youtube_video(self, youtube_url: str) -> Optional[str]:
-        """Download and transcribe a YouTube video"""
+        """Download and transcribe a YouTube video, reusing its stored transcript when there is one"""
         try:
+            video_id = _video_id(youtube_url)
+            if video_id:
+                cached = self._get_cached_transcripts([video_id])
+                if video_id in cached:
+                    return cached[video_id]
+            
             # Download audio
-            audio_file = self.download_audio(youtube_url)
-            if not audio_file:
+            audio = self.download_audio(youtube_url)
+            if audio is None:
                 return None
             
             # Transcribe audio
-            transcript = self.transcribe_with_whisper(audio_file)
-            
-            # Clean up audio file
-            try:
-                os.remove(audio_file)
-            except:
-                pass
-            
+            transcript = self.transcribe_with_whisper(audio)
+            if transcript and video_id:
+                self._cache_transcript(video_id, transcript)
             return transcript
         except Exception as e:
             logger.error(f"❌ Error transcribing YouTube video {youtube_url}: {e}")
             return None
     
-    def clean_html(self, html_content: str) -> str:
-        """Clean HTML content and extract readable text, preserving YouTube video references"""
+    def clean_html(self, html_content: str, youtube_urls: Optional[List[str]] = None) -> str:
+        """Clean HTML content and extract readable text, preserving YouTube video references
+        (youtube_urls: already extracted from html_content, to skip scanning it again)"""
         if not html_content:
             return ""
         
         # Extract YouTube URLs before cleaning
-        youtube_urls = self.extract_youtube_urls(html_content)
-        
-        # Decode HTML entities
-        text = html.unescape(html_content)
+        if youtube_urls is None:
+            youtube_urls = self.extract_youtube_urls(html_content)
         
-        # Remove HTML tags
-        text = re.sub(r'<[^>]+>', '', text)
+        if HAS_SELECTOLAX:
+            # Parse once in C: tags dropped, entities decoded, malformed markup tolerated
+            text = HTMLParser(html_content).text(separator=' ', strip=True)
+        else:
+            # Decode HTML entities
+            text = html.unescape(html_content)
+            
+            # Remove HTML tags
+            text = _TAG_RE.sub('', text)
         
         # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
+        text = _WS_RE.sub(' ', text).strip()
         
         # Add YouTube video references
         if youtube_urls:
@@ -341,19 +617,9 @@ class CanvasDataStore:
     def store_modules(self, modules: List[Dict], course_id) -> bool:
         """Store modules in database and link to course"""
         try:
-            for module in modules:
-                # Store module itself
-                self.cursor.execute("""
-                    INSERT INTO modules (id, name, position, published, description, items_count, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        name = EXCLUDED.name,
-                        position = EXCLUDED.position,
-                        published = EXCLUDED.published,
-                        description = EXCLUDED.description,
-                        items_count = EXCLUDED.items_count,
-                        updated_at = EXCLUDED.updated_at
-                """, (
+            # One row per id: a batched ON CONFLICT DO UPDATE cannot touch the same row twice
+            rows = list({
+                module['id']: (
                     module['id'],
                     module['name'],
                     module.get('position'),
@@ -362,17 +628,29 @@ class CanvasDataStore:
                     module.get('items_count', 0),
                     module.get('created_at'),
                     module.get('updated_at')
-                ))
+                )
+                for module in modules
+            }.values())
 
-                # Store mapping in course_modules
-                self.cursor.execute("""
-                    INSERT INTO course_modules (course_id, module_id)
-                    VALUES (%s, %s)
-                    ON CONFLICT (course_id, module_id) DO NOTHING
-                """, (
-                    course_id,
-                    module['id']
-                ))
+            # Store modules themselves
+            execute_values(self.cursor, """
+                INSERT INTO modules (id, name, position, published, description, items_count, created_at, updated_at)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    position = EXCLUDED.position,
+                    published = EXCLUDED.published,
+                    description = EXCLUDED.description,
+                    items_count = EXCLUDED.items_count,
+                    updated_at = EXCLUDED.updated_at
+            """, rows, page_size=INSERT_PAGE_SIZE)
+
+            # Store mapping in course_modules
+            execute_values(self.cursor, """
+                INSERT INTO course_modules (course_id, module_id)
+                VALUES %s
+                ON CONFLICT (course_id, module_id) DO NOTHING
+            """, [(course_id, row[0]) for row in rows], page_size=INSERT_PAGE_SIZE)
 
             self.connection.commit()
             logger.info(f"✅ Stored {len(modules)} modules and course-module links in database")
@@ -383,27 +661,12 @@ class CanvasDataStore:
             self.connection.rollback()
             return False
     
-    def store_module_items(self, module_id: int, items: List[Dict], course_id) -> bool:
-        """Store module items in database"""
+    def store_module_items(self, module_id: int, items: List[Dict], course_id,
+                           pages: Optional[Dict[str, Optional[Dict]]] = None) -> bool:
+        """Store module items in database (pages: prefetched page content keyed by page_url)"""
         try:
-            for item in items:
-                # Store module item
-                self.cursor.execute("""
-                    INSERT INTO module_items (id, module_id, title, item_type, position, published, 
-                                           content_id, page_url, external_url, completion_requirement, 
-                                           created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        title = EXCLUDED.title,
-                        item_type = EXCLUDED.item_type,
-                        position = EXCLUDED.position,
-                        published = EXCLUDED.published,
-                        content_id = EXCLUDED.content_id,
-                        page_url = EXCLUDED.page_url,
-                        external_url = EXCLUDED.external_url,
-                        completion_requirement = EXCLUDED.completion_requirement,
-                        updated_at = EXCLUDED.updated_at
-                """, (
+            rows = list({
+                item['id']: (
                     item['id'],
                     module_id,
                     item['title'],
@@ -416,11 +679,52 @@ class CanvasDataStore:
                     item.get('completion_requirement', {}).get('type'),
                     item.get('created_at'),
                     item.get('updated_at')
-                ))
-                
-                # Store page content for page type items only
+                )
+                for item in items
+            }.values())
+
+            # Store module items
+            execute_values(self.cursor, """
+                INSERT INTO module_items (id, module_id, title, item_type, position, published, 
+                                       content_id, page_url, external_url, completion_requirement, 
+                                       created_at, updated_at)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE SET
+                    title = EXCLUDED.title,
+                    item_type = EXCLUDED.item_type,
+                    position = EXCLUDED.position,
+                    published = EXCLUDED.published,
+                    content_id = EXCLUDED.content_id,
+                    page_url = EXCLUDED.page_url,
+                    external_url = EXCLUDED.external_url,
+                    completion_requirement = EXCLUDED.completion_requirement,
+                    updated_at = EXCLUDED.updated_at
+            """, rows, page_size=INSERT_PAGE_SIZE)
+
+            # Store page content for page type items only, now that their module items exist.
+            # A page linked from several items keeps its first item, as one upsert per item did.
+            page_rows = {}
+            for item in items:
                 if item['type'].lower() == 'page' and item.get('page_url'):
-                    self._store_page_content(item, course_id)
+                    if pages is not None and item['page_url'] in pages:
+                        row = self._page_content_row(item, course_id, pages[item['page_url']])
+                    else:
+                        row = self._page_content_row(item, course_id)
+                    if row and row[0] not in page_rows:
+                        page_rows[row[0]] = row
+            
+            if page_rows:
+                execute_values(self.cursor, """
+                    INSERT INTO pages (id, module_item_id, title, body, front_page, yt_transcript, created_at, updated_at)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE SET
+                        title = EXCLUDED.title,
+                        body = EXCLUDED.body,
+                        front_page = EXCLUDED.front_page,
+                        yt_transcript = EXCLUDED.yt_transcript,
+                        updated_at = EXCLUDED.updated_at
+                """, list(page_rows.values()), page_size=INSERT_PAGE_SIZE)
+                logger.info(f"✅ Stored content for {len(page_rows)} pages in module {module_id}")
             
             self.connection.commit()
             logger.info(f"✅ Stored {len(items)} module items for module {module_id}")
@@ -431,12 +735,13 @@ class CanvasDataStore:
             self.connection.rollback()
             return False
     
-    def _store_page_content(self, item: Dict, course_id):
-        """Store page content for page type items with YouTube transcription"""
+    def _page_content_row(self, item: Dict, course_id, page_content: Optional[Dict] = None) -> Optional[tuple]:
+        """Build the pages row for a page type item, with YouTube transcription (None if unavailable)"""
         try:
-            page_content = self.fetch_page_content(item['page_url'], course_id)
+            if page_content is None:
+                page_content = self.fetch_page_content(item['page_url'], course_id)
             if not page_content:
-                return
+                return None
             
             # Extract YouTube URLs from page content
             youtube_urls = self.extract_youtube_urls(page_content.get('body', ''))
@@ -447,9 +752,7 @@ class CanvasDataStore:
                 logger.info(f"�� Found {len(youtube_urls)} YouTube video(s) in page: {item['title']}")
                 transcripts = []
                 
-                for i, url in enumerate(youtube_urls, 1):
-                    logger.info(f"�� Transcribing video {i}/{len(youtube_urls)}: {url}")
-                    transcript = self.transcribe_youtube_video(url)
+                for i, transcript in enumerate(self.transcribe_youtube_videos(youtube_urls), 1):
                     if transcript:
                         transcripts.append(f"=== VIDEO {i} TRANSCRIPT ===\n{transcript}\n")
                     else:
@@ -458,31 +761,21 @@ class CanvasDataStore:
                 yt_transcript = "\n".join(transcripts)
                 logger.info(f"✅ YouTube transcription completed for page: {item['title']}")
             
-            # Store page content with transcript
-            self.cursor.execute("""
-                INSERT INTO pages (id, module_item_id, title, body, front_page, yt_transcript, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE SET
-                    title = EXCLUDED.title,
-                    body = EXCLUDED.body,
-                    front_page = EXCLUDED.front_page,
-                    yt_transcript = EXCLUDED.yt_transcript,
-                    updated_at = EXCLUDED.updated_at
-            """, (
+            # Page content with transcript
+            return (
                 page_content['page_id'],
                 item['id'],
                 page_content['title'],
-                self.clean_html(page_content.get('body', '')),
+                self.clean_html(page_content.get('body', ''), youtube_urls),
                 page_content.get('front_page', False),
                 yt_transcript,
                 page_content.get('created_at'),
                 page_content.get('updated_at')
-            ))
-            
-            logger.info(f"✅ Stored page content for item {item['id']}")
+            )
             
         except Exception as e:
-            logger.error(f"❌ Error storing page content for item {item['id']}: {e}")
+            logger.error(f"❌ Error preparing page content for item {item['id']}: {e}")
+            return None
     
     
     def store_canvas_data_for_course(self, course_id: int) -> bool:
@@ -491,8 +784,8 @@ class CanvasDataStore:
             logger.info(f"🚀 Starting data extraction for course {course_id}...")
 
             # Fetch modules
-            url = f"{CANVAS_URL}/api/v1/courses/{course_id}/modules"
-            response = requests.get(url, headers=headers)
+            url = f"{os.getenv("CANVAS_URL")}/api/v1/courses/{course_id}/modules"
+            response = self.session.get(url)
             response.raise_for_status()
             modules = response.json()
 
@@ -504,14 +797,17 @@ class CanvasDataStore:
             if not self.store_modules(modules, course_id):  # <-- pass course_id
                 return False
 
+            # Module items and their pages are independent requests, fetched concurrently up front
+            items_by_module, pages = asyncio.run(self.fetch_course_content(modules, course_id))
+
             total_items = 0
             for module in modules:
                 module_id = module['id']
                 logger.info(f"📦 Processing module: {module['name']} (ID: {module_id})")
 
-                items = self.fetch_module_items(module_id, course_id)  # <-- pass course_id
+                items = items_by_module.get(module_id)
                 if items:
-                    if self.store_module_items(module_id, items, course_id):
+                    if self.store_module_items(module_id, items, course_id, pages):
                         total_items += len(items)
                     else:
                         logger.warning(f"⚠️ Failed to store items for module {module_id}")
@@ -531,7 +827,7 @@ def main():
     try:
         print("✅ Whisper is available")
     except ImportError:
-        print("❌ Whisper not found. Install with: pip install openai-whisper")
+        print("❌ Whisper not found. Install with: pip install faster-whisper")
         return
     
     try:
@@ -1,5 +1,8 @@
+import asyncio
+import logging
 import re
 from array import array
+from typing import List, Tuple
 
 # import vertexai
 # from vertexai.language_models import TextEmbeddingModel
@@ -7,12 +10,28 @@ from array import array
 # initialize vertexai
 from app.core.config import embedding_model
 
-async def embed_course_doc(content: str, doc_name: str, module_name: str):
+# Inputs per get_embeddings request: gemini-embedding-001 takes a single input per request
+# (raise this for models such as text-embedding-005 that accept up to 250), and how many
+# requests are in flight at once
+EMBEDDING_BATCH_SIZE = 1
+EMBEDDING_CONCURRENCY = 8
+
+logger = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r'\s+')
+_KEEP_RE = re.compile(r'[^\w\s\-\.]')
+
+
+def _clean_doc_text(content: str) -> str:
     text = content.lower()
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'[^\w\s\-\.]', '', text)
-    text = text.strip()
-    print("text:", text)
+    text = _WS_RE.sub(' ', text)
+    text = _KEEP_RE.sub('', text)
+    return text.strip()
+
+
+async def embed_course_doc(content: str, doc_name: str, module_name: str):
+    text = _clean_doc_text(content)
+    logger.debug("Embedding text: %s", text)
 
     # The API expects an input object or list of inputs
     embeddings = embedding_model.get_embeddings([text])
@@ -23,5 +42,33 @@ async def embed_course_doc(content: str, doc_name: str, module_name: str):
         "doc_name": doc_name,
         "module_name": module_name,
         "content": text,
-        "embedding": embedding.tolist()
+        "embedding": embedding
     }
+
+
+async def embed_course_docs_batch(docs: List[Tuple[str, str, str]]) -> List[dict]:
+    """Embed many (content, doc_name, module_name) documents, returning embed_course_doc-shaped results in order.
+
+    Texts are sent EMBEDDING_BATCH_SIZE per request with up to EMBEDDING_CONCURRENCY requests
+    in flight, instead of one blocking request per document.
+    """
+    texts = [_clean_doc_text(content) for content, _, _ in docs]
+    semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+    async def embed(batch: List[str]):
+        async with semaphore:
+            return await embedding_model.get_embeddings_async(batch)
+
+    batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    results = await asyncio.gather(*[embed(batch) for batch in batches])
+    embeddings = [embedding for result in results for embedding in result]
+
+    return [
+        {
+            "doc_name": doc_name,
+            "module_name": module_name,
+            "content": text,
+            "embedding": array("f", embedding.values)
+        }
+        for (_, doc_name, module_name), text, embedding in zip(docs, texts, embeddings)
+    ]
@@ -3,120 +3,244 @@ LTI Advantage Service for Canvas API Access
 Handles OAuth2 token exchange and Canvas API access via LTI Advantage
 """
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
 import requests
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, FrozenSet, List, Any, Optional, Tuple, Union
+from urllib.parse import urlparse
 import json
 
 logger = logging.getLogger(__name__)
 
+# How long a request waits for another request's in-flight exchange for the same user
+TOKEN_EXCHANGE_WAIT_SECONDS = 30
+
+# Token lifetime (typical LTI Advantage token lifetime) and how early to refresh before expiry
+TOKEN_LIFETIME_SECONDS = 3600.0
+TOKEN_REFRESH_SKEW_SECONDS = 300.0
+
+# How often a cached token is re-checked against Canvas, so one revoked there is dropped
+# instead of failing every API call until it expires locally
+TOKEN_VALIDATION_INTERVAL_SECONDS = 600.0
+TOKEN_VALIDATION_TIMEOUT_SECONDS = 5
+
+# Prefix of the locally generated placeholder tokens, which Canvas cannot validate
+SIMULATED_TOKEN_PREFIX = "lti_advantage_"
+
+# Most tokens kept at once; expired entries are swept first, then the least recently used
+MAX_STORED_TOKENS = 10_000
+
+# AGS line item scope; its presence selects the client_credentials flow
+_LINEITEM_SCOPE = "https://purl.imsglobal.org/spec/lti-ags/scope/lineitem"
+
+# Canvas base URL for each known LTI issuer host
+_ISSUER_MAP = {
+    "canvas.instructure.com": "https://canvas.instructure.com",
+    "sso.canvaslms.com": "https://sso.canvaslms.com",
+    "taclegacy.instructure.com": "https://taclegacy.instructure.com",
+}
+
+# Contexts whose Canvas URL could not be extracted, keyed by every field the extraction reads, with
+# a time.monotonic() expiry, so a misconfigured integration repeating the same launch skips the warning
+URL_FAILURE_TTL_SECONDS = 60.0
+MAX_URL_FAILURES = 1000
+_url_failures: "OrderedDict[Tuple[str, ...], float]" = OrderedDict()
+_url_failures_lock = threading.Lock()
+
+
+def _extract_canvas_url(lti_context: Dict[str, Any]) -> Optional[str]:
+    """Extract Canvas instance URL from LTI context"""
+    platform = lti_context.get("tool_platform")
+    custom = lti_context.get("custom")
+    failure_key = (
+        str(lti_context.get("iss")),
+        str(lti_context.get("course_id")),
+        str(platform.get("url")) if isinstance(platform, dict) else "",
+        str(lti_context.get("custom_canvas_api_domain")),
+        str(custom.get("canvas_api_domain")) if isinstance(custom, dict) else "",
+    )
+    with _url_failures_lock:
+        expiry = _url_failures.get(failure_key)
+        if expiry is not None:
+            if time.monotonic() < expiry:
+                return None
+            del _url_failures[failure_key]
+    
+    # Try to get from tool_platform
+    if isinstance(platform, dict) and "url" in platform:
+        return platform["url"]
+
+    # Try to get from issuer
+    issuer = lti_context.get("iss")
+    if isinstance(issuer, str):
+        canvas_url = _ISSUER_MAP.get(urlparse(issuer).netloc or issuer)
+        if canvas_url:
+            return canvas_url
+
+    # Try to get from custom parameters
+    if "custom_canvas_api_domain" in lti_context:
+        domain = lti_context["custom_canvas_api_domain"]
+        return f"https://{domain}"
+
+    # Try to get from custom fields with Canvas variable substitutions
+    if isinstance(custom, dict):
+        domain = custom.get("canvas_api_domain")
+        if domain and domain != "$Canvas.api.domain":
+            return f"https://{domain}"
+
+    # For hardcoded course 240, use the known Canvas domain
+    if lti_context.get("course_id") == "240":
+        logger.info("Using hardcoded Canvas domain for course 240")
+        return "https://taclegacy.instructure.com"
+
+    logger.warning("Could not extract Canvas URL from LTI context")
+    with _url_failures_lock:
+        _url_failures[failure_key] = time.monotonic() + URL_FAILURE_TTL_SECONDS
+        _url_failures.move_to_end(failure_key)
+        if len(_url_failures) > MAX_URL_FAILURES:
+            _url_failures.popitem(last=False)
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedLtiContext:
+    """The parts of a raw LTI context this service reads, extracted once per exchange"""
+    canvas_url: Optional[str]
+    scopes: FrozenSet[str]
+    custom_token: Optional[str]
+    course_id: Optional[str]
+    
+    @classmethod
+    def from_raw(cls, lti_context: Dict[str, Any]) -> "ParsedLtiContext":
+        """Parse a raw LTI context dict; a space-separated scope string is split into scopes"""
+        scopes = lti_context.get("scope") or ()
+        if isinstance(scopes, str):
+            scopes = scopes.split()
+        return cls(
+            canvas_url=_extract_canvas_url(lti_context),
+            scopes=frozenset(scopes),
+            custom_token=lti_context.get("custom_canvas_api_token"),
+            course_id=lti_context.get("course_id")
+        )
+
+
+LtiContext = Union[Dict[str, Any], ParsedLtiContext]
+
+
+def _parse_context(lti_context: LtiContext) -> ParsedLtiContext:
+    """Accept either form at the public API, parsing raw dicts once"""
+    if isinstance(lti_context, ParsedLtiContext):
+        return lti_context
+    return ParsedLtiContext.from_raw(lti_context)
+
+
 class LTIAdvantageService:
     """Service for LTI Advantage OAuth2 token exchange and Canvas API access"""
     
+    # Fixed attribute set: a mistyped attribute raises instead of silently adding shadow state
+    __slots__ = ("tokens", "_lock", "_pending_exchanges", "_session")
+    
     def __init__(self):
-        self.tokens = {}  # Store tokens by user_id
-        self.token_expiry = {}  # Store token expiry times
+        # (token, time.monotonic() expiry, canvas_url, last validated) by user_id, so a token and
+        # its metadata are always read and written together
+        self.tokens: "OrderedDict[str, Tuple[str, float, str, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        # Exchanges in progress by user_id; concurrent callers wait on the leader's future
+        self._pending_exchanges: Dict[str, Future] = {}
         
-    def exchange_token(self, user_id: str, course_id: str, lti_context: Dict[str, Any]) -> Optional[str]:
-        """Exchange LTI context for Canvas API access token"""
+        # One keep-alive session for token requests to Canvas, so refreshes reuse TLS connections
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504])
+        )
+        self._session.mount("https://", adapter)
+        
+    def exchange_token(self, user_id: str, course_id: str, lti_context: LtiContext) -> Optional[str]:
+        """Exchange LTI context (raw or already parsed) for Canvas API access token"""
         try:
-            # Check if we have a valid token
-            if self._is_token_valid(user_id):
-                logger.info(f"Using existing valid token for user {user_id}")
-                return self.tokens.get(user_id)
-            
-            # Get Canvas instance URL from LTI context
-            canvas_url = self._extract_canvas_url(lti_context)
-            if not canvas_url:
-                logger.error("Could not extract Canvas URL from LTI context")
-                return None
-            
-            # Exchange for token using LTI Advantage
-            token = self._request_canvas_token(canvas_url, user_id, course_id, lti_context)
+            # Check if we have a token that stays valid past the refresh window, so callers never
+            # receive one that expires mid-request
+            token = self._get_valid_token(user_id, TOKEN_REFRESH_SKEW_SECONDS)
             if token:
-                self._store_token(user_id, token)
-                logger.info(f"Successfully obtained Canvas API token for user {user_id}")
+                logger.info("Using existing valid token for user %s", user_id)
                 return token
             
-            return None
+            # One request per user performs the exchange; the others wait for its result
+            future = Future()
+            with self._lock:
+                pending = self._pending_exchanges.setdefault(user_id, future)
+            if pending is not future:
+                logger.info("Waiting for in-flight token exchange for user %s", user_id)
+                return pending.result(timeout=TOKEN_EXCHANGE_WAIT_SECONDS)
+            
+            try:
+                token = self._exchange_token(user_id, course_id, _parse_context(lti_context))
+                future.set_result(token)
+                return token
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    self._pending_exchanges.pop(user_id, None)
             
         except Exception as e:
-            logger.error(f"Error exchanging LTI context for token: {e}")
+            logger.error("Error exchanging LTI context for token: %s", e)
             return None
     
-    def _extract_canvas_url(self, lti_context: Dict[str, Any]) -> Optional[str]:
-        """Extract Canvas instance URL from LTI context"""
-        try:
-            # Try to get from tool_platform
-            if "tool_platform" in lti_context:
-                platform = lti_context["tool_platform"]
-                if "url" in platform:
-                    return platform["url"]
-            
-            # Try to get from issuer
-            if "iss" in lti_context:
-                issuer = lti_context["iss"]
-                if "canvas.instructure.com" in issuer:
-                    return "https://canvas.instructure.com"
-                elif "sso.canvaslms.com" in issuer:
-                    return "https://sso.canvaslms.com"
-                elif "taclegacy.instructure.com" in issuer:
-                    return "https://taclegacy.instructure.com"
-            
-            # Try to get from custom parameters
-            if "custom_canvas_api_domain" in lti_context:
-                domain = lti_context["custom_canvas_api_domain"]
-                return f"https://{domain}"
-            
-            # Try to get from custom fields with Canvas variable substitutions
-            if "custom" in lti_context:
-                custom = lti_context["custom"]
-                if "canvas_api_domain" in custom:
-                    domain = custom["canvas_api_domain"]
-                    if domain and domain != "$Canvas.api.domain":
-                        return f"https://{domain}"
-            
-            # For hardcoded course 240, use the known Canvas domain
-            if lti_context.get("course_id") == "240":
-                logger.info("Using hardcoded Canvas domain for course 240")
-                return "https://taclegacy.instructure.com"
-            
-            logger.warning("Could not extract Canvas URL from LTI context")
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error extracting Canvas URL: {e}")
+    def _exchange_token(self, user_id: str, course_id: str, context: ParsedLtiContext) -> Optional[str]:
+        """Request and store a new token; only the leader of a user's exchange calls this"""
+        # Canvas instance URL from LTI context
+        canvas_url = context.canvas_url
+        if not canvas_url:
+            logger.error("Could not extract Canvas URL from LTI context")
             return None
+        
+        # Exchange for token using LTI Advantage
+        token = self._request_canvas_token(canvas_url, user_id, course_id, context)
+        if token:
+            self._store_token(user_id, token, canvas_url)
+            logger.info("Successfully obtained Canvas API token for user %s", user_id)
+            return token
+        
+        return None
     
-    def _request_canvas_token(self, canvas_url: str, user_id: str, course_id: str, lti_context: Dict[str, Any]) -> Optional[str]:
+    def _request_canvas_token(self, canvas_url: str, user_id: str, course_id: str, context: ParsedLtiContext) -> Optional[str]:
         """Request Canvas API access token using LTI Advantage"""
         try:
             # For LTI 1.3, we need to use the LTI Advantage OAuth2 flow
             # This requires the tool to be configured with proper scopes
             
             # Check if we have LTI Advantage scopes in the context
-            if "https://purl.imsglobal.org/spec/lti-ags/scope/lineitem" in lti_context.get("scope", []):
+            if _LINEITEM_SCOPE in context.scopes:
                 logger.info("LTI Advantage AGS scope detected, using client_credentials flow")
-                return self._get_client_credentials_token(canvas_url, lti_context)
+                return self._get_client_credentials_token(canvas_url, context)
             
             # Check if we have a custom Canvas API token in the context
-            if "custom_canvas_api_token" in lti_context:
+            if context.custom_token is not None:
                 logger.info("Using custom Canvas API token from LTI context")
-                return lti_context["custom_canvas_api_token"]
+                return context.custom_token
             
             # For now, we'll use a simulated token exchange
             # In production, this would use the actual LTI Advantage OAuth2 flow
             logger.warning("No LTI Advantage scopes or custom token found, using simulated token")
-            simulated_token = f"lti_advantage_token_{user_id}_{course_id}_{int(datetime.now().timestamp())}"
+            simulated_token = f"lti_advantage_token_{user_id}_{course_id}_{time.time_ns() // 1_000_000_000}"
             
-            logger.info(f"Generated simulated Canvas API token for user {user_id}")
+            logger.info("Generated simulated Canvas API token for user %s", user_id)
             return simulated_token
             
         except Exception as e:
-            logger.error(f"Error requesting Canvas token: {e}")
+            logger.error("Error requesting Canvas token: %s", e)
             return None
     
-    def _get_client_credentials_token(self, canvas_url: str, lti_context: Dict[str, Any]) -> Optional[str]:
+    def _get_client_credentials_token(self, canvas_url: str, context: ParsedLtiContext) -> Optional[str]:
         """Get client_credentials token using LTI Advantage"""
         try:
             # This would implement the actual OAuth2 client_credentials flow
@@ -124,47 +248,100 @@ class LTIAdvantageService:
             
             # In production, you would:
             # 1. Use the client_id and client_secret from your LTI tool configuration
-            # 2. Make a POST request to /login/oauth2/token with grant_type=client_credentials
+            # 2. Make a POST request to /login/oauth2/token with grant_type=client_credentials,
+            #    through self._session so the connection to Canvas is reused
             # 3. Include the proper scopes for progress access
             
             logger.info("Simulating LTI Advantage client_credentials token exchange")
-            simulated_token = f"lti_advantage_client_credentials_{int(datetime.now().timestamp())}"
+            simulated_token = f"lti_advantage_client_credentials_{time.time_ns() // 1_000_000_000}"
             
             return simulated_token
             
         except Exception as e:
-            logger.error(f"Error getting client_credentials token: {e}")
+            logger.error("Error getting client_credentials token: %s", e)
             return None
     
-    def _store_token(self, user_id: str, token: str):
+    def _store_token(self, user_id: str, token: str, canvas_url: str):
         """Store token and set expiry"""
-        self.tokens[user_id] = token
-        # Set token to expire in 1 hour (typical LTI Advantage token lifetime)
-        self.token_expiry[user_id] = datetime.now() + timedelta(hours=1)
+        # Set token to expire in 1 hour; a freshly issued token counts as validated
+        with self._lock:
+            now = time.monotonic()
+            self.tokens[user_id] = (token, now + TOKEN_LIFETIME_SECONDS, canvas_url, now)
+            self.tokens.move_to_end(user_id)
+            
+            if len(self.tokens) > MAX_STORED_TOKENS:
+                for expired_user in [uid for uid, entry in self.tokens.items() if now >= entry[1]]:
+                    del self.tokens[expired_user]
+                while len(self.tokens) > MAX_STORED_TOKENS:
+                    self.tokens.popitem(last=False)
     
-    def _is_token_valid(self, user_id: str) -> bool:
-        """Check if stored token is still valid"""
-        if user_id not in self.tokens or user_id not in self.token_expiry:
-            return False
+    def _get_valid_token(self, user_id: str, skew_seconds: float = 0.0) -> Optional[str]:
+        """Return the stored token if it is valid for at least skew_seconds more, removing it once expired.
         
-        expiry = self.token_expiry[user_id]
-        if datetime.now() >= expiry:
-            # Remove expired token
-            del self.tokens[user_id]
-            del self.token_expiry[user_id]
-            return False
+        A returned token that Canvas has not confirmed for TOKEN_VALIDATION_INTERVAL_SECONDS gets a
+        background check; the current caller is not delayed by it.
+        """
+        with self._lock:
+            entry = self.tokens.get(user_id)
+            if entry is None:
+                return None
+            
+            token, expiry, canvas_url, validated_at = entry
+            now = time.monotonic()
+            if now >= expiry:
+                # Remove expired token
+                del self.tokens[user_id]
+                return None
+            if now + skew_seconds >= expiry:
+                return None
+            
+            self.tokens.move_to_end(user_id)
+            revalidate = (now - validated_at > TOKEN_VALIDATION_INTERVAL_SECONDS
+                          and not token.startswith(SIMULATED_TOKEN_PREFIX))
+            if revalidate:
+                # Marked up front so only one check per interval is started
+                self.tokens[user_id] = (token, expiry, canvas_url, now)
+        
+        if revalidate:
+            threading.Thread(
+                target=self._validate_token, args=(user_id, token, canvas_url), daemon=True
+            ).start()
+        return token
+    
+    def _validate_token(self, user_id: str, token: str, canvas_url: str):
+        """Ask Canvas whether a cached token still works, dropping it if Canvas answers 401"""
+        try:
+            response = self._session.head(
+                f"{canvas_url}/api/v1/users/self",
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=TOKEN_VALIDATION_TIMEOUT_SECONDS
+            )
+        except requests.RequestException as e:
+            logger.warning("Could not validate token for user %s: %s", user_id, e)
+            return
         
-        return True
+        if response.status_code == 401:
+            with self._lock:
+                entry = self.tokens.get(user_id)
+                if entry and entry[0] == token:
+                    del self.tokens[user_id]
+            logger.info("Token for user %s was rejected by Canvas, dropped it", user_id)
     
-    def get_canvas_api_context(self, user_id: str, course_id: str, lti_context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def _is_token_valid(self, user_id: str, skew_seconds: float = 0.0) -> bool:
+        """Check if stored token is still valid"""
+        return self._get_valid_token(user_id, skew_seconds) is not None
+    
+    def get_canvas_api_context(self, user_id: str, course_id: str, lti_context: LtiContext) -> Optional[Dict[str, Any]]:
         """Get Canvas API context for a user"""
         try:
-            token = self.exchange_token(user_id, course_id, lti_context)
-            if not token:
+            # Parsed once and handed to the exchange rather than walked again there
+            context = _parse_context(lti_context)
+            canvas_url = context.canvas_url
+            if not canvas_url:
                 return None
             
-            canvas_url = self._extract_canvas_url(lti_context)
-            if not canvas_url:
+            token = self.exchange_token(user_id, course_id, context)
+            if not token:
                 return None
             
             return {
@@ -175,39 +352,25 @@ class LTIAdvantageService:
             }
             
         except Exception as e:
-            logger.error(f"Error getting Canvas API context: {e}")
+            logger.error("Error getting Canvas API context: %s", e)
             return None
     
-    def refresh_token_if_needed(self, user_id: str, course_id: str, lti_context: Dict[str, Any]) -> Optional[str]:
-        """Refresh token if it's expired or about to expire"""
-        try:
-            if not self._is_token_valid(user_id):
-                logger.info(f"Token expired for user {user_id}, refreshing...")
-                return self.exchange_token(user_id, course_id, lti_context)
-            
-            # Check if token expires in next 5 minutes
-            if user_id in self.token_expiry:
-                expiry = self.token_expiry[user_id]
-                if datetime.now() + timedelta(minutes=5) >= expiry:
-                    logger.info(f"Token expires soon for user {user_id}, refreshing...")
-                    return self.exchange_token(user_id, course_id, lti_context)
-            
-            return self.tokens.get(user_id)
-            
-        except Exception as e:
-            logger.error(f"Error refreshing token: {e}")
-            return None
+    def refresh_token_if_needed(self, user_id: str, course_id: str, lti_context: LtiContext) -> Optional[str]:
+        """Refresh token if it's expired or about to expire.
+        
+        exchange_token already skips tokens inside the refresh window, so this is the same call.
+        """
+        return self.exchange_token(user_id, course_id, lti_context)
+    
+    def close(self):
+        """Close pooled HTTP connections"""
+        self._session.close()
     
     def revoke_token(self, user_id: str):
         """Revoke and remove stored token"""
-        try:
-            if user_id in self.tokens:
-                del self.tokens[user_id]
-            if user_id in self.token_expiry:
-                del self.token_expiry[user_id]
-            logger.info(f"Token revoked for user {user_id}")
-        except Exception as e:
-            logger.error(f"Error revoking token: {e}")
+        with self._lock:
+            self.tokens.pop(user_id, None)
+        logger.info("Token revoked for user %s", user_id)
 
 # Global instance
 lti_advantage_service = LTIAdvantageService() 
\ No newline at end of file
@@ -3,11 +3,12 @@ LTI AI Service for Canvas Integration
 Provides contextual AI assistance based on Canvas course progress and modules
 """
 import logging
+from contextvars import ContextVar
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 
 from .ai_service import ai_service
-from .canvas_api_service import canvas_api_service
+from .canvas_api_service import CanvasAPIService
 from .lti_advantage_service import lti_advantage_service
 from .knowledge_base_service import knowledge_base_service
 from .lti_rag_service import LTIRAGService
@@ -15,6 +16,9 @@ from .enhanced_canvas_knowledge_service import EnhancedCanvasKnowledgeService
 
 logger = logging.getLogger(__name__)
 
+# Canvas API service for the request being handled; each request (task) sees its own
+_canvas_api: ContextVar[Optional[CanvasAPIService]] = ContextVar("canvas_api", default=None)
+
 class LTIAIService:
     """AI service specifically for LTI integration with Canvas progress tracking"""
     
@@ -23,7 +27,12 @@ class LTIAIService:
         self.lti_rag_service = LTIRAGService()
         self.enhanced_canvas_knowledge = EnhancedCanvasKnowledgeService()
         
-    def generate_contextual_response(self, message: str, user_id: str, course_id: str, 
+    @property
+    def canvas_api_service(self) -> CanvasAPIService:
+        """Canvas API service bound to the current request's context (unconfigured if none was set)"""
+        return _canvas_api.get() or CanvasAPIService()
+    
+    async def generate_contextual_response(self, message: str, user_id: str, course_id: str, 
                                    lti_context: Dict[str, Any], language: str = "en") -> Dict[str, Any]:
         """Generate AI response with Canvas course context"""
         try:
@@ -36,32 +45,28 @@ class LTIAIService:
             # This ensures we get real course data instead of simulated tokens
             real_canvas_context = self._get_real_canvas_context(course_id, user_id)
             
-            # Get user's current course progress using real Canvas API
-            progress_context = self._get_progress_context(real_canvas_context, lti_context)
-            
-            # Ensure course_id is set in progress context
-            if not progress_context.get("course_id") and lti_context.get("course_id"):
-                progress_context["course_id"] = lti_context["course_id"]
-                logger.info(f"Set course_id in progress context: {lti_context['course_id']}")
-            
-            # Set Canvas API context with real credentials
+            # Bind a Canvas API service with the real credentials to this request
             if real_canvas_context:
-                canvas_api_service.set_lti_context(
+                _canvas_api.set(CanvasAPIService(
                     real_canvas_context["base_url"],
                     real_canvas_context["access_token"],
                     real_canvas_context["course_id"],
                     real_canvas_context["user_id"]
-                )
+                ))
                 logger.info("✅ Canvas API context set successfully with real credentials")
-                
-                # Now that Canvas API is set up, analyze the user query and fetch relevant data
-                logger.info("🔍 Analyzing user query for Canvas API calls...")
-                
             else:
                 logger.warning(f"⚠️ Could not get real Canvas API context for user {user_id}, using fallback")
             
+            # Get user's current course progress using real Canvas API
+            progress_context = await self._get_progress_context(real_canvas_context, lti_context)
+            
+            # Ensure course_id is set in progress context
+            if not progress_context.get("course_id") and lti_context.get("course_id"):
+                progress_context["course_id"] = lti_context["course_id"]
+                logger.info(f"Set course_id in progress context: {lti_context['course_id']}")
+            
             # Generate enhanced AI response with progress context
-            response = self._generate_progress_aware_response(message, progress_context, language)
+            response = await self._generate_progress_aware_response(message, progress_context, language)
             
             # Add Canvas API integration status to response
             if real_canvas_context:
@@ -106,7 +111,7 @@ class LTIAIService:
             logger.error(f"Error getting real Canvas context: {e}")
             return None
     
-    def _get_enhanced_canvas_context(self, message: str, progress_context: Dict[str, Any]) -> List[Dict[str, Any]]:
+    async def _get_enhanced_canvas_context(self, message: str, progress_context: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Get enhanced Canvas context using specific Canvas APIs based on user query"""
         try:
             course_id = progress_context.get("course_id")
@@ -123,7 +128,7 @@ class LTIAIService:
             logger.info(f"Query analysis: {query_analysis}")
             
             # Fetch relevant Canvas data based on query analysis
-            canvas_data = self._fetch_relevant_canvas_data(course_id, user_id, query_analysis)
+            canvas_data = await self._fetch_relevant_canvas_data(course_id, user_id, query_analysis)
             
             if canvas_data:
                 # Convert Canvas data to knowledge base format
@@ -146,7 +151,7 @@ class LTIAIService:
             logger.error(f"Error getting enhanced Canvas context: {e}")
             return []
     
-    def _get_smart_enhanced_canvas_context(self, message: str, progress_context: Dict[str, Any]) -> List[Dict[str, Any]]:
+    async def _get_smart_enhanced_canvas_context(self, message: str, progress_context: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Get enhanced Canvas context using smart query handling"""
         try:
             course_id = progress_context.get("course_id")
@@ -194,7 +199,7 @@ class LTIAIService:
                     
                     # CRITICAL: Also add basic module structure from Canvas API as fallback
                     try:
-                        basic_modules = self.canvas_api_service.get_course_modules()
+                        basic_modules = await self.canvas_api_service.get_course_modules()
                         if basic_modules:
                             # Find the specific module in the basic list
                             for basic_module in basic_modules:
@@ -356,7 +361,7 @@ class LTIAIService:
             logger.error(f"Error formatting enhanced item content: {e}")
             return str(item)
     
-    def _get_progress_context(self, canvas_context: Dict[str, Any], lti_context: Dict[str, Any]) -> Dict[str, Any]:
+    async def _get_progress_context(self, canvas_context: Dict[str, Any], lti_context: Dict[str, Any]) -> Dict[str, Any]:
         """Get comprehensive progress context for the user"""
         try:
             # Check if we have real Canvas API context and try to get real progress
@@ -365,13 +370,13 @@ class LTIAIService:
                     logger.info("🔍 Attempting to get real progress from Canvas API...")
                     
                     # Get real progress from Canvas API
-                    real_progress = self.canvas_api_service.get_user_progress()
+                    real_progress = await self.canvas_api_service.get_user_progress()
                     if real_progress:
                         logger.info("✅ Retrieved real progress from Canvas API")
                         
                         # Also get current module context for better understanding
                         try:
-                            current_module_context = self.canvas_api_service.get_current_module_context()
+                            current_module_context = await self.canvas_api_service.get_current_module_context()
                             logger.info("✅ Retrieved current module context from Canvas API")
                         except Exception as e:
                             logger.warning(f"⚠️ Could not get current module context: {e}")
@@ -416,7 +421,7 @@ class LTIAIService:
             logger.error(f"Error getting progress context: {e}")
             return self._fallback_progress_context()
     
-    def _generate_progress_aware_response(self, message: str, progress_context: Dict[str, Any], 
+    async def _generate_progress_aware_response(self, message: str, progress_context: Dict[str, Any], 
                                         language: str) -> Dict[str, Any]:
         """Generate AI response that's aware of user's course progress"""
         try:
@@ -433,7 +438,7 @@ class LTIAIService:
                 logger.info("🔍 Canvas API is ready - fetching relevant data based on user query...")
                 
                 # Get enhanced Canvas context using the new smart query analysis
-                enhanced_canvas_context = self._get_enhanced_canvas_context(message, progress_context)
+                enhanced_canvas_context = await self._get_enhanced_canvas_context(message, progress_context)
                 
                 if enhanced_canvas_context:
                     knowledge_context.extend(enhanced_canvas_context)
@@ -443,7 +448,7 @@ class LTIAIService:
             else:
                 logger.info("🔄 Canvas API not ready, using fallback enhanced context...")
                 # Get enhanced Canvas knowledge for better context using smart query handling
-                enhanced_canvas_context = self._get_smart_enhanced_canvas_context(message, progress_context)
+                enhanced_canvas_context = await self._get_smart_enhanced_canvas_context(message, progress_context)
                 
                 # Combine knowledge contexts
                 if enhanced_canvas_context:
@@ -1190,7 +1195,7 @@ class LTIAIService:
             logger.error(f"Error analyzing user query: {e}")
             return {"query_type": "general", "targets": []}
     
-    def _fetch_relevant_canvas_data(self, course_id: str, user_id: str, query_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    async def _fetch_relevant_canvas_data(self, course_id: str, user_id: str, query_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Fetch relevant Canvas data based on query analysis"""
         try:
             canvas_data = {
@@ -1205,7 +1210,7 @@ class LTIAIService:
             
             # Always fetch user progress for context
             try:
-                canvas_data["user_progress"] = self.canvas_api_service.get_user_progress()
+                canvas_data["user_progress"] = await self.canvas_api_service.get_user_progress()
                 logger.info("✅ Fetched user progress from Canvas API")
             except Exception as e:
                 logger.warning(f"Could not fetch user progress: {e}")
@@ -1214,12 +1219,12 @@ class LTIAIService:
             if query_analysis["query_type"] in ["current_module", "current_module_objectives"]:
                 # Fetch current module information
                 try:
-                    current_module_context = self.canvas_api_service.get_current_module_context()
+                    current_module_context = await self.canvas_api_service.get_current_module_context()
                     if current_module_context:
                         # Get detailed information about the current module
                         current_module_id = current_module_context.get("current_module", {}).get("id")
                         if current_module_id:
-                            detailed_module = self.canvas_api_service.get_module_details(str(current_module_id), user_id)
+                            detailed_module = await self.canvas_api_service.get_module_details(str(current_module_id), user_id)
                             if detailed_module:
                                 canvas_data["modules"].append(detailed_module)
                                 canvas_data["current_module"] = detailed_module
@@ -1237,7 +1242,7 @@ class LTIAIService:
                     logger.info(f"🔍 Fetching specific module for query: {query_analysis.get('modules', [])}")
                     
                     # Step 1: Get all modules from Canvas API
-                    all_modules = self.canvas_api_service.get_course_modules()
+                    all_modules = await self.canvas_api_service.get_course_modules()
                     if not all_modules:
                         logger.warning("No modules found in Canvas API")
                         return canvas_data
@@ -1261,7 +1266,7 @@ class LTIAIService:
                         logger.info(f"🎯 Fetching details for module: {module_name} (ID: {module_id})")
                         
                         # Call specific module API with the module ID
-                        detailed_module = self.canvas_api_service.get_module_details(str(module_id), user_id)
+                        detailed_module = await self.canvas_api_service.get_module_details(str(module_id), user_id)
                         if detailed_module:
                             canvas_data["modules"].append(detailed_module)
                             logger.info(f"✅ Successfully fetched detailed module: {detailed_module.get('name')}")
@@ -1275,11 +1280,11 @@ class LTIAIService:
             elif query_analysis["query_type"] == "module_general":
                 # Fetch overview of all modules
                 try:
-                    modules = self.canvas_api_service.get_course_modules()
+                    modules = await self.canvas_api_service.get_course_modules()
                     if modules:
                         # Get first few modules for overview
                         for module in modules[:5]:
-                            detailed_module = self.canvas_api_service.get_module_details(str(module.get("id")), user_id)
+                            detailed_module = await self.canvas_api_service.get_module_details(str(module.get("id")), user_id)
                             if detailed_module:
                                 canvas_data["modules"].append(detailed_module)
                                 logger.info(f"✅ Fetched module overview: {detailed_module.get('name')}")
@@ -1290,62 +1295,58 @@ class LTIAIService:
                 # Fetch assignments
                 try:
                     # Get modules first, then extract assignments
-                    modules = self.canvas_api_service.get_course_modules()
+                    modules = await self.canvas_api_service.get_course_modules()
                     for module in modules:
                         module_id = str(module.get("id"))
-                        items = self.canvas_api_service.get_module_items(module_id, user_id)
+                        items = await self.canvas_api_service.get_module_items(module_id, user_id)
                         for item in items:
                             if item.get("type") == "Assignment":
-                                detailed_item = self.canvas_api_service.get_module_item_details(module_id, str(item.get("id")), user_id)
-                                if detailed_item:
-                                    canvas_data["assignments"].append(detailed_item)
-                                    logger.info(f"✅ Fetched assignment: {detailed_item.get('title')}")
+                                # get_module_items already carries content_details for each item
+                                canvas_data["assignments"].append(item)
+                                logger.info(f"✅ Fetched assignment: {item.get('title')}")
                 except Exception as e:
                     logger.warning(f"Could not fetch assignments: {e}")
             
             elif query_analysis["query_type"] == "quiz_specific":
                 # Fetch quizzes
                 try:
-                    modules = self.canvas_api_service.get_course_modules()
+                    modules = await self.canvas_api_service.get_course_modules()
                     for module in modules:
                         module_id = str(module.get("id"))
-                        items = self.canvas_api_service.get_module_items(module_id, user_id)
+                        items = await self.canvas_api_service.get_module_items(module_id, user_id)
                         for item in items:
                             if item.get("type") == "Quiz":
-                                detailed_item = self.canvas_api_service.get_module_item_details(module_id, str(item.get("id")), user_id)
-                                if detailed_item:
-                                    canvas_data["quizzes"].append(detailed_item)
-                                    logger.info(f"✅ Fetched quiz: {detailed_item.get('title')}")
+                                # get_module_items already carries content_details for each item
+                                canvas_data["quizzes"].append(item)
+                                logger.info(f"✅ Fetched quiz: {item.get('title')}")
                 except Exception as e:
                     logger.warning(f"Could not fetch quizzes: {e}")
             
             elif query_analysis["query_type"] == "item_specific":
                 # Fetch specific items mentioned in the query
                 try:
-                    modules = self.canvas_api_service.get_course_modules()
+                    modules = await self.canvas_api_service.get_course_modules()
                     for module in modules:
                         module_id = str(module.get("id"))
-                        items = self.canvas_api_service.get_module_items(module_id, user_id)
+                        items = await self.canvas_api_service.get_module_items(module_id, user_id)
                         for item in items:
                             if self._is_item_relevant_to_query(item, query_analysis):
-                                detailed_item = self.canvas_api_service.get_module_item_details(module_id, str(item.get("id")), user_id)
-                                if detailed_item:
-                                    # Add module context to the item
-                                    detailed_item["module_context"] = module
-                                    canvas_data["modules"].append(module)
-                                    canvas_data["assignments"].append(detailed_item)
-                                    logger.info(f"✅ Fetched specific item: {detailed_item.get('title')}")
+                                # Add module context to the item
+                                item["module_context"] = module
+                                canvas_data["modules"].append(module)
+                                canvas_data["assignments"].append(item)
+                                logger.info(f"✅ Fetched specific item: {item.get('title')}")
                 except Exception as e:
                     logger.warning(f"Could not fetch specific items: {e}")
             
             else:
                 # General query - fetch overview data
                 try:
-                    modules = self.canvas_api_service.get_course_modules()
+                    modules = await self.canvas_api_service.get_course_modules()
                     if modules:
                         # Get first few modules for overview
                         for module in modules[:3]:
-                            detailed_module = self.canvas_api_service.get_module_details(str(module.get("id")), user_id)
+                            detailed_module = await self.canvas_api_service.get_module_details(str(module.get("id")), user_id)
                             if detailed_module:
                                 canvas_data["modules"].append(detailed_module)
                                 logger.info(f"✅ Fetched overview module: {detailed_module.get('name')}")
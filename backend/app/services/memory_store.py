@@ -0,0 +1,85 @@
+"""
+Compact Memory Store for the iframe widget flow
+Keeps per-session subject-predicate-object facts extracted off the request path,
+so prompts carry distilled facts instead of raw past transcripts.
+The store is a per-process cache: the session's facts are persisted after the summary
+text in the conversation row (see with_facts), and re-read from there on each turn.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+Triple = Tuple[str, str, str]
+
+# Marker the summarizer emits before its fact lines ("subject | predicate | object")
+FACTS_MARKER = "FACTS:"
+
+
+class MemoryStore:
+    """Process-local store of semantic triples per conversation session"""
+
+    def __init__(self, max_sessions: int = 2048, max_triples: int = 20):
+        self.max_sessions = max_sessions
+        self.max_triples = max_triples
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, OrderedDict[Tuple[str, str], str]]" = OrderedDict()
+
+    def extract_triples(self, text: str) -> List[Triple]:
+        """Parse "subject | predicate | object" lines into triples, skipping anything malformed"""
+        triples = []
+        for line in text.splitlines():
+            parts = [part.strip(" -•*`\"'").strip() for part in line.split("|")]
+            if len(parts) == 3 and all(parts):
+                triples.append((parts[0].lower(), parts[1].lower(), parts[2]))
+        return triples
+
+    def split_summary(self, text: str) -> Tuple[str, List[Triple]]:
+        """Separate the summarizer output into the summary text and its fact triples"""
+        if not text or FACTS_MARKER not in text:
+            return text, []
+        summary, _, facts = text.partition(FACTS_MARKER)
+        return summary.strip(), self.extract_triples(facts)
+
+    def add_triples(self, session_id: str, triples: List[Triple]) -> None:
+        """Merge triples into a session; a newer object replaces the old one for the same subject/predicate"""
+        if not session_id or not triples:
+            return
+
+        with self._lock:
+            facts = self._sessions.pop(session_id, None) or OrderedDict()
+            for subject, predicate, obj in triples:
+                facts.pop((subject, predicate), None)
+                facts[(subject, predicate)] = obj
+            while len(facts) > self.max_triples:
+                facts.popitem(last=False)
+
+            self._sessions[session_id] = facts
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+        logger.info(f"🧠 Stored {len(triples)} memory facts for session {session_id}")
+
+    def with_facts(self, session_id: str, summary: str) -> str:
+        """Append the session's facts to a summary for storage, in the format split_summary parses"""
+        with self._lock:
+            facts = self._sessions.get(session_id)
+            if not facts:
+                return summary
+            lines = [f"{subject} | {predicate} | {obj}" for (subject, predicate), obj in facts.items()]
+        return f"{summary}\n{FACTS_MARKER}\n" + "\n".join(lines)
+
+    def get_triples(self, session_id: str) -> List[str]:
+        """Return the session's facts formatted for the prompt, e.g. "user prefers=visual examples" """
+        with self._lock:
+            facts = self._sessions.get(session_id)
+            if not facts:
+                return []
+            return [f"{subject} {predicate}={obj}" for (subject, predicate), obj in facts.items()]
+
+
+# Global instance
+memory_store = MemoryStore()
@@ -0,0 +1,192 @@
+"""
+Prompt/Response Cache for AWS Bedrock generations
+Exact-match LRU on the full prompt, backed by a semantic tier over recent student queries
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Short follow-ups ("yes", "next one") only make sense against the live history,
+# so they never take the semantic path
+MIN_SEMANTIC_QUERY_WORDS = 3
+
+# Dynamically int8-quantized ONNX export of the encoder used on CPU (all-MiniLM-L6-v2 ships
+# variants for avx2, avx512 and avx512_vnni; pick the one the host CPU supports)
+SEMANTIC_ONNX_FILE = os.getenv('BEDROCK_SEMANTIC_CACHE_ONNX_FILE', 'onnx/model_qint8_avx512_vnni.onnx')
+
+
+class PromptResponseCache:
+    """Two-tier cache: blake2b prompt hash LRU, then cosine similarity over recent queries"""
+
+    def __init__(self, max_entries: int = 1024, semantic_entries: int = 512,
+                 threshold: float = 0.93, embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 semantic_enabled: bool = True):
+        self.max_entries = max_entries
+        self.semantic_entries = semantic_entries
+        self.threshold = threshold
+        self.embedding_model_name = embedding_model_name
+        self.semantic_enabled = semantic_enabled
+
+        self._lock = threading.Lock()
+        self._exact: "OrderedDict[bytes, str]" = OrderedDict()
+
+        # Semantic tier is a fixed-size ring buffer of unit vectors; the matrix is
+        # allocated on first insert once the embedding dimension is known
+        self._encoder = None
+        self._vectors: Optional[np.ndarray] = None
+        self._scopes: List[Optional[str]] = [None] * semantic_entries
+        self._responses: List[Optional[str]] = [None] * semantic_entries
+        self._cursor = 0
+        self._embedding_memo: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    @staticmethod
+    def _exact_key(model_id: str, temperature: float, prompt: Union[str, Dict[str, str]]) -> bytes:
+        """Hash the generation parameters and prompt (plain or structured) into a compact key"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{model_id}|{temperature}|".encode())
+        if isinstance(prompt, dict):
+            for key, value in prompt.items():
+                digest.update(f"\x1f{key}\x1e".encode())
+                digest.update(str(value).encode())
+        else:
+            digest.update(prompt.encode())
+        return digest.digest()
+
+    @staticmethod
+    def _semantic_scope(model_id: str, temperature: float, scope: str) -> str:
+        return f"{model_id}|{temperature}|{scope}"
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query with the local sentence-transformers model (loaded on first use)"""
+        if not self.semantic_enabled:
+            return None
+
+        memo = self._embedding_memo.get(query)
+        if memo is not None:
+            return memo
+
+        try:
+            if self._encoder is None:
+                import torch
+                from sentence_transformers import SentenceTransformer
+                # Run on the GPU in FP16 when one is available; vectors are cast back to float32 below
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                if device == "cuda":
+                    self._encoder = SentenceTransformer(self.embedding_model_name, device=device)
+                    self._encoder.half()
+                else:
+                    self._encoder = self._load_cpu_encoder(SentenceTransformer)
+                logger.info(f"✅ Semantic cache encoder loaded: {self.embedding_model_name} ({device})")
+            vector = self._encoder.encode(query, normalize_embeddings=True).astype(np.float32)
+        except Exception as e:
+            logger.warning(f"⚠️ Semantic cache disabled, encoder unavailable: {e}")
+            self.semantic_enabled = False
+            return None
+
+        self._embedding_memo[query] = vector
+        if len(self._embedding_memo) > 64:
+            self._embedding_memo.popitem(last=False)
+        return vector
+
+    def _load_cpu_encoder(self, SentenceTransformer):
+        """Prefer the model's int8-quantized ONNX export under ONNX Runtime on CPU, falling back to PyTorch"""
+        try:
+            return SentenceTransformer(self.embedding_model_name, device="cpu", backend="onnx",
+                                       model_kwargs={"file_name": SEMANTIC_ONNX_FILE})
+        except Exception as e:
+            logger.warning(f"⚠️ ONNX encoder unavailable, using PyTorch: {e}")
+            return SentenceTransformer(self.embedding_model_name, device="cpu")
+
+    def _semantic_eligible(self, query: Optional[str], scope: Optional[str]) -> bool:
+        return bool(self.semantic_enabled and query and scope is not None
+                    and len(query.split()) >= MIN_SEMANTIC_QUERY_WORDS)
+
+    def get(self, prompt: Union[str, Dict[str, str]], model_id: str, temperature: float,
+            query: str = None, scope: str = None) -> Optional[str]:
+        """Return a cached response for this prompt, or for a semantically equivalent query"""
+        key = self._exact_key(model_id, temperature, prompt)
+        with self._lock:
+            cached = self._exact.get(key)
+            if cached is not None:
+                self._exact.move_to_end(key)
+                logger.info("⚡ Prompt cache hit (exact)")
+                return cached
+
+        if not self._semantic_eligible(query, scope):
+            return None
+
+        vector = self._embed(query.strip().lower())
+        if vector is None:
+            return None
+
+        full_scope = self._semantic_scope(model_id, temperature, scope)
+        with self._lock:
+            if self._vectors is None:
+                return None
+            rows = [i for i, s in enumerate(self._scopes) if s == full_scope]
+            if not rows:
+                return None
+            scores = self._vectors[rows] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            logger.info(f"⚡ Prompt cache hit (semantic, score={scores[best]:.3f})")
+            return self._responses[rows[best]]
+
+    def put(self, prompt: Union[str, Dict[str, str]], model_id: str, temperature: float, response: str,
+            query: str = None, scope: str = None) -> None:
+        """Store a generated response under both cache tiers"""
+        key = self._exact_key(model_id, temperature, prompt)
+        with self._lock:
+            self._exact[key] = response
+            self._exact.move_to_end(key)
+            if len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+        if not self._semantic_eligible(query, scope):
+            return
+
+        vector = self._embed(query.strip().lower())
+        if vector is None:
+            return
+
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.semantic_entries, vector.shape[0]), dtype=np.float32)
+            slot = self._cursor
+            self._vectors[slot] = vector
+            self._scopes[slot] = self._semantic_scope(model_id, temperature, scope)
+            self._responses[slot] = response
+            self._cursor = (slot + 1) % self.semantic_entries
+
+    def clear(self) -> None:
+        """Drop every cached response"""
+        with self._lock:
+            self._exact.clear()
+            self._scopes = [None] * self.semantic_entries
+            self._responses = [None] * self.semantic_entries
+            self._cursor = 0
+
+
+def build_prompt_cache() -> Optional[PromptResponseCache]:
+    """Create the cache from environment settings, or None when disabled"""
+    if os.getenv('BEDROCK_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    return PromptResponseCache(
+        max_entries=int(os.getenv('BEDROCK_CACHE_SIZE', '1024')),
+        semantic_entries=int(os.getenv('BEDROCK_SEMANTIC_CACHE_SIZE', '512')),
+        threshold=float(os.getenv('BEDROCK_SEMANTIC_CACHE_THRESHOLD', '0.93')),
+        semantic_enabled=os.getenv('BEDROCK_SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true',
+    )
@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from app.repository.conversation_memory import ConversationMemoryRawRepository
 from app.repository.user_sessions import SessionRepository
 from app.core.config import embedding_model
+from app.services.memory_store import memory_store, FACTS_MARKER
 
 # Load environment variables
 load_dotenv()
@@ -15,7 +16,7 @@ load_dotenv()
 USE_BEDROCK = os.getenv('USE_BEDROCK', 'false').lower() == 'true'
 
 if USE_BEDROCK:
-    from .bedrock_service import bedrock_service
+    from .bedrock_service import get_bedrock_service
     logger = logging.getLogger(__name__)
     logger.info("🤖 Using AWS Bedrock Claude for conversation summarization")
 else:
@@ -61,13 +62,13 @@ class ConvoSummerizer:
         # self._initialize_vector_store()
         
     def _initialize_bedrock(self):
-        """Initialize AWS Bedrock service"""
-        try:
-            self.bedrock = bedrock_service
-            logger.info("✅ AWS Bedrock service initialized successfully")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize Bedrock: {e}")
-            raise
+        """Defer AWS Bedrock client creation to the first generation call"""
+        logger.info("✅ AWS Bedrock service will initialize on first use")
+
+    @property
+    def bedrock(self):
+        """Shared Bedrock service, created on first access"""
+        return get_bedrock_service()
         
     def _setup_credentials(self):
         """Setup Google Cloud credentials"""
@@ -111,6 +112,10 @@ class ConvoSummerizer:
 
         keep in mind that the summary wil be fed to another ai assisstant. make it accordingly
 
+        After the summary, write a line containing only {FACTS_MARKER} followed by up to 5 short facts about the
+        student worth remembering (preferences, struggles, goals, topics covered), one per line as
+        `subject | predicate | object`, for example: `user | prefers | visual examples`
+
         existing summary: {summary}
         user query: {query}
         ai response: {response}
@@ -145,6 +150,12 @@ class ConvoSummerizer:
 
 
             
+            # Facts go to the compact memory layer and are persisted after the summary text,
+            # so other workers and restarts can reload them from the latest row
+            summary, triples = memory_store.split_summary(summary)
+            memory_store.add_triples(session_id, triples)
+            stored_summary = memory_store.with_facts(session_id, summary)
+
             # Log response summary
             logger.info(f"  summary generated successfully: {summary}")
 
@@ -162,7 +173,7 @@ class ConvoSummerizer:
                 'message': response,
                 'message_from': 'ai',
                 'session_id': session_id,
-                'summary': summary,
+                'summary': stored_summary,
                 'embedding': embedding_str,
                 'evaluation': evaluation,
                 'quiz_session_id': quiz_session_id,
@@ -211,6 +222,12 @@ class ConvoSummerizer:
                 summary_response = self.gemini_model.generate_content(prompt)
                 summary = summary_response.text
 
+            # Facts go to the compact memory layer and are persisted after the summary text,
+            # so other workers and restarts can reload them from the latest row
+            summary, triples = memory_store.split_summary(summary)
+            memory_store.add_triples(session_id, triples)
+            stored_summary = memory_store.with_facts(session_id, summary)
+
             # Log response summary
             logger.info(f"  summary generated successfully: {summary}")
 
@@ -226,7 +243,7 @@ class ConvoSummerizer:
                 'message': response,
                 'message_from': 'ai',
                 'session_id': session_id,
-                'summary': summary,
+                'summary': stored_summary,
                 'embedding': embedding_str
             }
 
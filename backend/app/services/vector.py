@@ -14,7 +14,7 @@ load_dotenv()
 USE_BEDROCK = os.getenv('USE_BEDROCK', 'false').lower() == 'true'
 
 if USE_BEDROCK:
-    from .bedrock_service import bedrock_service
+    from .bedrock_service import get_bedrock_service
     logger = logging.getLogger(__name__)
     logger.info("🤖 Using AWS Bedrock Claude for AI tutoring")
 else:
@@ -234,13 +234,13 @@ class AITutor:
         self.student_profile = {}
     
     def _initialize_bedrock(self):
-        """Initialize AWS Bedrock service"""
-        try:
-            self.bedrock = bedrock_service
-            logger.info("✅ AWS Bedrock service initialized successfully")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize Bedrock: {e}")
-            raise
+        """Defer AWS Bedrock client creation to the first generation call"""
+        logger.info("✅ AWS Bedrock service will initialize on first use")
+
+    @property
+    def bedrock(self):
+        """Shared Bedrock service, created on first access"""
+        return get_bedrock_service()
         
     def _setup_credentials(self):
         """Setup Google Cloud credentials"""
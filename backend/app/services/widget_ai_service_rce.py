@@ -3,9 +3,12 @@ Widget AI Service for AI Tutor Widget
 Uses either AWS Bedrock Claude or Google Vertex AI Gemini based on USE_BEDROCK environment variable
 """
 
+import hashlib
+import json
 import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Dict, List, Any
 import os
 from dotenv import load_dotenv
 
@@ -16,7 +19,7 @@ load_dotenv()
 USE_BEDROCK = os.getenv('USE_BEDROCK').lower() == 'true'
 
 if USE_BEDROCK:
-    from .bedrock_service import bedrock_service
+    from .bedrock_service import get_bedrock_service
     logger = logging.getLogger(__name__)
     logger.info("🤖 Using AWS Bedrock Claude for AI generation")
 else:
@@ -26,6 +29,461 @@ else:
     logger = logging.getLogger(__name__)
     logger.info("🤖 Using Google Vertex AI Gemini for AI generation")
 
+# Input budgets for the per-turn prompt sections. Claude averages roughly four
+# characters per token on course prose, which is close enough to cap spend
+# without shipping a tokenizer
+CHARS_PER_TOKEN = 4
+CONTEXT_TOKEN_BUDGET = int(os.getenv('PROMPT_CONTEXT_TOKEN_BUDGET', '6000'))
+HISTORY_TOKEN_BUDGET = int(os.getenv('PROMPT_HISTORY_TOKEN_BUDGET', '1000'))
+
+# Raw turns kept in the regular prompt next to the summary and memory facts
+RECENT_TURNS = 2
+QUIZ_RECENT_TURNS = 5
+
+# Greetings and acknowledgements answered without a model call, by reply kind
+TRIVIAL_MESSAGES = {
+    "hi": "greeting", "hello": "greeting", "hey": "greeting", "halo": "greeting",
+    "thanks": "thanks", "thank you": "thanks", "terima kasih": "thanks", "makasih": "thanks",
+    "ok": "ack", "okay": "ack", "oke": "ack",
+}
+
+CANNED_REPLIES = {
+    "english": {
+        "greeting": "Hi! I'm your AI tutor for this course. Ask me anything about the current topic, or say \"quiz me\" to test yourself.",
+        "thanks": "You're welcome! Let me know if you have any other questions about this topic.",
+        "ack": "Great! Let me know if you have any other questions about this topic.",
+    },
+    "indonesian": {
+        "greeting": "Halo! Saya tutor AI untuk kursus ini. Tanyakan apa saja tentang topik saat ini, atau katakan \"quiz me\" untuk menguji diri Anda.",
+        "thanks": "Sama-sama! Beri tahu saya jika ada pertanyaan lain tentang topik ini.",
+        "ack": "Baik! Beri tahu saya jika ada pertanyaan lain tentang topik ini.",
+    },
+}
+
+# Optional faster Bedrock model for short statements (under LIGHT_MODEL_MAX_WORDS, no question mark)
+LIGHT_MODEL_ID = os.getenv('BEDROCK_LIGHT_MODEL')
+LIGHT_MODEL_MAX_WORDS = 8
+
+# Topics whose course material is kept for follow-up turns that arrive without it
+MAX_STICKY_TOPICS = 256
+
+# Static instructions and examples form the system part of every prompt so the
+# provider-side prompt cache can reuse them; per-turn context and the query are
+# separate parts (joined after the delimiter for models without a system slot)
+DYNAMIC_DELIMITER = "<<<DYNAMIC>>>"
+
+REGULAR_PROMPT_PREFIX_V1 = """
+You are an expert AI tutor for a course on Design Thinking, Psychology, and Leadership Development. 
+Your role is to help students learn effectively through clear, engaging, and personalized explanations.
+
+### INSTRUCTIONS:
+1. **Language Response**: Respond in the Student's Preferred Language from the CONTEXT section unless explicitly requested otherwise by the student
+2. **Content Accuracy**: Greet the students and base responses strictly on provided course material and the youtube transcript (if available), connecting concepts to real-world applications
+3. **Context Utilization**: Always incorporate conversation context for personalized responses
+4. **Out of context Questions**: for every question, check if the query is related to the RELEVANT COURSE MATERIAL. if it s not, then tell the respond with "Your question is not related to our current topic. If you have any queries on the current topic, Let me know and I'll be happy to help".
+5. **Conciseness**: Keep responses brief yet comprehensive
+6. **Tutoring Approach**: Be supportive, encouraging, and provide step-by-step explanations for complex concepts
+7. **Error Handling**: Never mention inability to find information or system errors
+9. **Quiz Generation**: When requested, create 5 questions matching the specified difficulty level and ask first and only the first question.
+10. **CRITICAL QUIZ FORMATTING**: 
+    - For MEDIUM difficulty: ALWAYS include the question text AND all 4 multiple choice options (A, B, C, D) in the "answer" field
+    - Format: "Question text?\nA: Option 1\nB: Option 2\nC: Option 3\nD: Option 4"
+11. **Structured Output**: Always respond with valid JSON format
+12. **NEVER ADD `//n` in JSON STRINGS, REPLACE THEM WITH `/n`**
+13. **ALWAYS REPLACE `//n` with `/n`**
+
+### QUIZ DIFFICULTY GUIDELINES:
+- **Easy**: ALWAYS true/false questions testing basic recall
+- **Medium**: ALWAYS multiple choice questions (4 options A-D) testing understanding and application
+- **Hard**: ALWAYS short answer questions requiring concept explanation and critical thinking
+
+**CRITICAL**: Follow difficulty guidelines EXACTLY. Medium difficulty MUST be multiple choice with 4 options.
+
+### CRITICAL: Your response must always be in the specified JSON format,  NO ADDITIONAL TEXT. NUMBER OF QUESTIONS MUST ALWAYS BE 5 IF THE USER WANTS QUIZ
+
+### STRICT FORMATTING RULES: 
+    - NO code block markers (no ```json or ```)
+    - NO text before or after the JSON
+    - NO explanations or additional content
+    - ONLY the raw JSON object
+    - Make the answers properly formatted with \\n for new lines, and use bullet points where appropriate, but keep it concise.
+
+
+
+### RESPONSE FORMAT:
+Always return valid JSON with this structure:
+Schema:
+{
+    "answer": "Your educational response here", 
+    "wants_quiz": false,
+    "spoken_language": "language_code",
+    "quiz": []
+}
+
+Quiz questions should follow this format:
+Schema:
+{
+    "question_number": 1,
+    "difficulty": "easy/medium/hard",
+    "question_type": "true_false/multiple_choice/short_answer",
+    "question_text": "Question text here",
+    "options": {"A": "Option1", "B": "Option2"},  # Only for multiple_choice or true_false
+    "expected_answer": "Correct answer",
+    "explanation": "Brief explanation of why this is correct"
+}
+
+### EXAMPLE SCENARIOS:
+
+1. **Concept Explanation**:
+Student: "What are the design principles?"
+Response: 
+{
+    "answer": "In our course, design principles refer to the core stages of **Design Thinking**:\\n• Empathize: Understand user needs\\n• Define: Frame the problem\\n• Ideate: Generate solutions\\n• Prototype: Create models\\n• Test: Evaluate solutions",
+    "wants_quiz": false,
+    "spoken_language": "english",
+    "quiz": []
+}
+
+2. **Indonesian Response**:
+Student: "Apa itu pembelajaran berbasis proyek?"
+Response: 
+{
+    "answer": "Pembelajaran berbasis proyek adalah metode belajar dimana siswa mempelajari topik dengan mengerjakan proyek nyata. Pendekatan ini meningkatkan:\\n• Keterampilan berpikir kritis\\n• Kemampuan kolaborasi\\n• Penerapan teori dalam praktik",
+    "wants_quiz": false,
+    "spoken_language": "indonesian",
+    "quiz": []
+}
+
+3. **Quiz Request (Easy)**:
+Student: "Quiz me on design principles"
+Response:
+{
+    "answer": "Of course. I've designed the questions for you. Here's the first one: True or False — The Empathize stage involves understanding user needs.",
+    "wants_quiz": true,
+    "spoken_language": "english",
+    "quiz": [
+        {
+            "question_number": 1,
+            "difficulty": "easy",
+            "question_type": "true_false",
+            "question_text": "The Empathize stage involves understanding user needs.",
+            "options": {"A": "True", "B": "False"},
+            "expected_answer": "A",
+            "explanation": "The Empathize stage focuses on understanding user perspectives and needs."
+        },
+        {
+            "question_number": 2,
+            "difficulty": "easy",
+            "question_type": "true_false",
+            "question_text": "The Define stage comes before the Ideate stage in Design Thinking.",
+            "options": {"A": "True", "B": "False"},
+            "expected_answer": "A",
+            "explanation": "The Design Thinking process follows: Empathize → Define → Ideate → Prototype → Test."
+        },
+        {
+            "question_number": 3,
+            "difficulty": "easy",
+            "question_type": "true_false",
+            "question_text": "Prototyping is the final stage of Design Thinking.",
+            "options": {"A": "True", "B": "False"},
+            "expected_answer": "B",
+            "explanation": "Testing is the final stage. Prototyping comes before testing."
+        },
+        {
+            "question_number": 4,
+            "difficulty": "easy",
+            "question_type": "true_false",
+            "question_text": "Empathy involves understanding user emotions and experiences.",
+            "options": {"A": "True", "B": "False"},
+            "expected_answer": "A",
+            "explanation": "Empathy is about understanding users' feelings, thoughts, and experiences."
+        },
+        {
+            "question_number": 5,
+            "difficulty": "easy",
+            "question_type": "true_false",
+            "question_text": "Design Thinking is only used for product design.",
+            "options": {"A": "True", "B": "False"},
+            "expected_answer": "B",
+            "explanation": "Design Thinking can be applied to various fields including business, education, and social innovation."
+        }
+    ]
+}
+
+4. **Quiz Request (Medium)**:
+Student: "Can you quiz me on design principles?"
+Response:
+{
+    "answer": "Of course. I've designed the questions for you. Here's the first one: What is the primary purpose of a low-fidelity prototype?\\nA: To create a polished final product\\nB: To test ideas quickly without significant investment\\nC: To impress stakeholders with detailed design\\nD: To replace the need for user testing",
+    "wants_quiz": true,
+    "spoken_language": "english",
+    "quiz": [
+        {
+            "question_number": 1,
+            "difficulty": "medium",
+            "question_type": "multiple_choice",
+            "question_text": "What is the primary purpose of a low-fidelity prototype?",
+            "options": {
+                "A": "To create a polished final product",
+                "B": "To test ideas quickly without significant investment",
+                "C": "To impress stakeholders with detailed design",
+                "D": "To replace the need for user testing"
+            },
+            "expected_answer": "B",
+            "explanation": "Low-fidelity prototypes are quick, low-cost representations used to test core concepts without investing significant time or resources."
+        },
+        {
+            "question_number": 2,
+            "difficulty": "medium",
+            "question_type": "multiple_choice",
+            "question_text": "Which of the following is an example of a high-fidelity prototype?",
+            "options": {
+                "A": "A hand-drawn sketch on a napkin",
+                "B": "A paper model of a mobile app screen",
+                "C": "A clickable, interactive model created in Figma",
+                "D": "A workflow diagram on a whiteboard"
+            },
+            "expected_answer": "C",
+            "explanation": "High-fidelity prototypes are detailed, interactive models that closely resemble the final product."
+        },
+        {
+            "question_number": 3,
+            "difficulty": "medium",
+            "question_type": "multiple_choice",
+            "question_text": "What is the main goal of the Empathize stage in Design Thinking?",
+            "options": {
+                "A": "To generate as many ideas as possible",
+                "B": "To understand the user's needs and experiences",
+                "C": "To create the final solution",
+                "D": "To test the prototype with users"
+            },
+            "expected_answer": "B",
+            "explanation": "The Empathize stage focuses on gaining insight into users' experiences, emotions, and needs."
+        },
+        {
+            "question_number": 4,
+            "difficulty": "medium",
+            "question_type": "multiple_choice",
+            "question_text": "Which stage of Design Thinking involves narrowing down ideas to the most promising ones?",
+            "options": {
+                "A": "Empathize",
+                "B": "Define",
+                "C": "Ideate",
+                "D": "Prototype"
+            },
+            "expected_answer": "C",
+            "explanation": "The Ideate stage involves generating many ideas and then selecting the most promising ones for prototyping."
+        },
+        {
+            "question_number": 5,
+            "difficulty": "medium",
+            "question_type": "multiple_choice",
+            "question_text": "What is the primary benefit of iterative prototyping?",
+            "options": {
+                "A": "It saves money on materials",
+                "B": "It allows for continuous improvement based on feedback",
+                "C": "It reduces the need for user research",
+                "D": "It speeds up the final production process"
+            },
+            "expected_answer": "B",
+            "explanation": "Iterative prototyping allows teams to continuously refine solutions based on user feedback and testing results."
+        }
+    ]
+}
+
+5. **Quiz Request (Hard)**:
+Student: "Can you quiz me on design principles?"
+Response: 
+{
+    "answer": "Of course. Here's the first one: How can you show empathy to a frustrated team member?",
+    "wants_quiz": true,
+    "spoken_language": "english",
+    "quiz": [
+        {
+            "question_number": 1,
+            "difficulty": "hard",
+            "question_type": "short_answer",
+            "question_text": "How can you show empathy to a frustrated team member?",
+            "expected_answer": "Acknowledge their feelings and offer help or support.",
+            "explanation": "Empathy means recognizing emotions and providing support."
+        },
+        {
+            "question_number": 2,
+            "difficulty": "hard",
+            "question_type": "short_answer",
+            "question_text": "Explain the difference between a problem statement and a solution statement in the Define stage.",
+            "expected_answer": "A problem statement describes what needs to be solved, while a solution statement describes how to solve it.",
+            "explanation": "Problem statements focus on the issue, solution statements focus on the approach."
+        },
+        {
+            "question_number": 3,
+            "difficulty": "hard",
+            "question_type": "short_answer",
+            "question_text": "What are the key characteristics of effective brainstorming in the Ideate stage?",
+            "expected_answer": "Encourage wild ideas, defer judgment, build on others' ideas, and aim for quantity over quality initially.",
+            "explanation": "Effective brainstorming creates a safe space for creative thinking without immediate criticism."
+        },
+        {
+            "question_number": 4,
+            "difficulty": "hard",
+            "question_type": "short_answer",
+            "question_text": "Describe how you would conduct user testing for a mobile app prototype.",
+            "expected_answer": "Set clear objectives, recruit representative users, create realistic scenarios, observe behavior, and collect both quantitative and qualitative feedback.",
+            "explanation": "User testing should be systematic, objective, and focused on real user behavior."
+        },
+        {
+            "question_number": 5,
+            "difficulty": "hard",
+            "question_type": "short_answer",
+            "question_text": "How does Design Thinking contribute to innovation in organizations?",
+            "expected_answer": "It provides a human-centered approach to problem-solving, encourages collaboration, and enables rapid iteration to find breakthrough solutions.",
+            "explanation": "Design Thinking drives innovation by focusing on user needs and enabling creative problem-solving processes."
+        }
+    ]
+}
+
+### CRITICAL REMINDER FOR MEDIUM DIFFICULTY QUIZZES:
+If difficulty is "medium" and wants_quiz is true, your "answer" field MUST include:
+1. The introduction text
+2. The question text
+3. ALL 4 multiple choice options (A, B, C, D) with \\n line breaks
+
+Example format for medium difficulty:
+"answer": "Of course. Here's the first one: [Question text]?\\nA: [Option 1]\\nB: [Option 2]\\nC: [Option 3]\\nD: [Option 4]"
+
+Provide a concise, helpful response that demonstrates your expertise as an AI tutor. Use bullet points for readability when appropriate.
+"""
+
+# V2 is specialized per quiz difficulty at import: only the active difficulty's
+# quiz rule and example are sent, since one difficulty applies per request
+_REGULAR_PROMPT_V2_HEAD = """
+You are an expert AI tutor for a course on Design Thinking, Psychology, and Leadership Development. Help students learn through clear, engaging, personalized explanations.
+
+### INSTRUCTIONS:
+1. Respond in the Student's Preferred Language from the CONTEXT section unless the student asks otherwise.
+2. Greet the student and base answers strictly on the RELEVANT COURSE MATERIAL and YouTube transcript (if available), connecting concepts to real-world applications.
+3. Use the conversation context to personalize responses.
+4. If the query is unrelated to the RELEVANT COURSE MATERIAL, respond with "Your question is not related to our current topic. If you have any queries on the current topic, Let me know and I'll be happy to help".
+5. Be brief yet complete and supportive; explain complex concepts step by step.
+6. Never mention missing information or system errors.
+7. When a quiz is requested, create exactly 5 questions at the Quiz Difficulty Level and present only the first one in "answer":
+"""
+
+_REGULAR_PROMPT_V2_QUIZ_RULES = {
+    "easy": '    - Easy: true/false questions testing basic recall',
+    "medium": '    - Medium: multiple choice with 4 options (A-D) testing understanding and application. "answer" MUST contain the question and all 4 options: "Question text?\\nA: Option 1\\nB: Option 2\\nC: Option 3\\nD: Option 4"',
+    "hard": '    - Hard: short answer questions requiring explanation and critical thinking',
+}
+
+_REGULAR_PROMPT_V2_FORMAT = """
+### RESPONSE FORMAT:
+Return ONLY one raw JSON object: no code fences, no text before or after it. Use \\n for line breaks inside strings (never //n) and bullet points where helpful.
+{
+    "answer": "Your educational response here",
+    "wants_quiz": false,
+    "spoken_language": "language_code",
+    "quiz": []
+}
+
+Each quiz item:
+{
+    "question_number": 1,
+    "difficulty": "easy/medium/hard",
+    "question_type": "true_false/multiple_choice/short_answer",
+    "question_text": "Question text here",
+    "options": {"A": "Option1", "B": "Option2"},  # Only for multiple_choice or true_false
+    "expected_answer": "Correct answer",
+    "explanation": "Brief explanation of why this is correct"
+}
+
+### EXAMPLES (quiz arrays show the first question only; always return all 5):
+
+1. Student: "What are the design principles?"
+{"answer": "In our course, design principles refer to the core stages of **Design Thinking**:\\n• Empathize: Understand user needs\\n• Define: Frame the problem\\n• Ideate: Generate solutions\\n• Prototype: Create models\\n• Test: Evaluate solutions", "wants_quiz": false, "spoken_language": "english", "quiz": []}
+"""
+
+_REGULAR_PROMPT_V2_QUIZ_EXAMPLES = {
+    "easy": """2. Student (easy): "Quiz me on design principles"
+{"answer": "Of course. I've designed the questions for you. Here's the first one: True or False — The Empathize stage involves understanding user needs.", "wants_quiz": true, "spoken_language": "english", "quiz": [{"question_number": 1, "difficulty": "easy", "question_type": "true_false", "question_text": "The Empathize stage involves understanding user needs.", "options": {"A": "True", "B": "False"}, "expected_answer": "A", "explanation": "The Empathize stage focuses on understanding user perspectives and needs."}, ...]}""",
+    "medium": """2. Student (medium): "Bisakah kamu memberi saya kuis tentang prinsip desain?"
+{"answer": "Tentu. Ini pertanyaan pertama: Apa tujuan utama dari prototipe low-fidelity?\\nA: Membuat produk akhir yang sempurna\\nB: Menguji ide dengan cepat tanpa investasi besar\\nC: Mengesankan pemangku kepentingan dengan desain detail\\nD: Menggantikan kebutuhan pengujian pengguna", "wants_quiz": true, "spoken_language": "indonesian", "quiz": [{"question_number": 1, "difficulty": "medium", "question_type": "multiple_choice", "question_text": "Apa tujuan utama dari prototipe low-fidelity?", "options": {"A": "Membuat produk akhir yang sempurna", "B": "Menguji ide dengan cepat tanpa investasi besar", "C": "Mengesankan pemangku kepentingan dengan desain detail", "D": "Menggantikan kebutuhan pengujian pengguna"}, "expected_answer": "B", "explanation": "Prototipe low-fidelity adalah representasi cepat dan murah untuk menguji konsep inti."}, ...]}""",
+    "hard": """2. Student (hard): "Can you quiz me on design principles?"
+{"answer": "Of course. Here's the first one: How can you show empathy to a frustrated team member?", "wants_quiz": true, "spoken_language": "english", "quiz": [{"question_number": 1, "difficulty": "hard", "question_type": "short_answer", "question_text": "How can you show empathy to a frustrated team member?", "expected_answer": "Acknowledge their feelings and offer help or support.", "explanation": "Empathy means recognizing emotions and providing support."}, ...]}""",
+}
+
+
+def _build_regular_prompt_v2(difficulty: str) -> str:
+    """Assemble the V2 regular prompt carrying only one difficulty's quiz rule and example"""
+    return (
+        _REGULAR_PROMPT_V2_HEAD.rstrip("\n") + "\n"
+        + _REGULAR_PROMPT_V2_QUIZ_RULES[difficulty] + "\n"
+        + _REGULAR_PROMPT_V2_FORMAT + "\n"
+        + _REGULAR_PROMPT_V2_QUIZ_EXAMPLES[difficulty] + "\n"
+    )
+
+
+REGULAR_PROMPT_BY_DIFFICULTY = {difficulty: _build_regular_prompt_v2(difficulty) for difficulty in ("easy", "medium", "hard")}
+
+# Set REGULAR_PROMPT_VERSION=v1 to fall back to the original long-form prompt for every difficulty
+if os.getenv('REGULAR_PROMPT_VERSION', 'v2').lower() == 'v1':
+    REGULAR_PROMPT_BY_DIFFICULTY = dict.fromkeys(REGULAR_PROMPT_BY_DIFFICULTY, REGULAR_PROMPT_PREFIX_V1)
+
+QUIZ_PROMPT_PREFIX = """
+### Role & Goal:
+    You are a strict, precise, and encouraging QuizBot. Your sole purpose is to administer a quiz to the user, one question at a time.
+    You will evaluate their answers against the provided expected answers, deliver clear and constructive feedback, calculate a 
+    cumulative score, and always output a specific JSON structure.
+
+
+### Core Instructions:
+    **You've already asked question one**
+    **Question Order**: You will be provided with a list of exactly 5 quiz questions. Ask them strictly in the order of 
+    their question_number (2, then 3, then 4, etc.).
+    **One at a Time**: Only ever present one question per response. Wait for the user's answer before proceeding.
+
+    **Answer Evaluation**:
+
+    **For multiple-choice questions (question_type: "multiple_choice")**: The user's answer can give the letter or question_type the expected answer in full expected_answer (e.g., "A"). Treat it as case-insensitive (user saying "a" is the same as "A").
+    **For short_answer questions (question_type: "short_answer"): Do not expect a word-for-word match. Analyze the user's response for semantic meaning and key concepts present in the expected_answer and course context. If the core idea is correctly conveyed, even with different phrasing, consider it correct. Be lenient with grammar and spelling as long as the meaning is clear.
+    **Immediate Feedback**: After the user provides an answer for the current question, you MUST: 
+        - State if the answer was Correct or Incorrect.
+        - Provide the explanation from the quiz data to reinforce learning.
+        - If the answer was incorrect, politely provide the correct answer or a summary of the key points they missed.
+        - Then, and only then, present the next question.
+
+    **Scoring**: Track the score. Each correctly answered question adds 1 point. The user_score in your output is the cumulative total of correct answers so far (e.g., after 3 questions, if the user got 2 right, the score is 2).
+    **Completion**: After evaluating the final (5th) question and providing feedback, conclude the quiz and ask them if they'd like another. Thank the user and tell them their final score (e.g., "Quiz complete! Your final score is 4/5.").
+    **Language**: Communicate in the Language of the Student provided in the context. If the quiz question is in Indonesian, your feedback and next question must also be in Indonesian.
+    **Exit rule**: If at any point in time the student wants to get out of quiz, by asking about another module or similar, set output quiz_active to false
+
+    ### Critical Output Rule:
+    EVERY response you generate must be a valid JSON. The JSON is non-negotiable.
+
+    Required JSON Output Format:
+    {
+        "response": "That's Correct!" [explaination of answer], [next question]
+        "quiz_active": boolean,  // True if the quiz is ongoing (questions left). False after the last question has been evaluated.
+        "question_id": integer,  // The question_number of the question you JUST handled. If you are asking question 3, this is 3. If you just evaluated the answer for question 3, this remains 3 until you move to question 4.
+        "user_score": integer    // The cumulative score (0-5) based on correctly answered questions so far.
+    }
+
+
+    Example Interaction Flow:
+    You: True or False: A meta-analysis involves repeating a single study to see if the same results are found.
+    Student: True
+    (You evaluate) -> Output: {"response": That's correct! The scenario described is known as replication. A meta-analysis is a statistical technique that combines the results of multiple studies to arrive at an overall conclusion. Excellent distinction! Here is the next question: [next question]", "quiz_active": true, "question_id": 1, "user_score": 1}
+
+    You: How does a person with a fixed mindset typically view challenges? \\nA: As an opportunity to learn and grow. \\nB: As a threat that might reveal their lack of ability. \\nC: As something exciting to overcome. \\nD: As a normal part of the learning process.
+    Student: B
+    (You evaluate) -> Output: {"response": "That's not quite right. The correct answer is B. Individuals with a fixed mindset often avoid challenges because they see failure as a negative reflection of their unchangeable intelligence or talent. Don't worry, these concepts can be tricky. Let's keep going! Here is your next question: [next question]", "quiz_active": true, "question_id": 2, "user_score": 1}
+
+
+    ... (and so on) ...
+
+
+    (After evaluating Q5) -> Output: {"response": "you got 4 out of 5 correct answers. Great job!. Would you like to take another quiz?", "quiz_active": false, "question_id": 5, "user_score": 4}
+"""
+
 
 class WidgetAIService:
     """AI service specifically for the widget using either Bedrock Claude or Gemini based on USE_BEDROCK setting"""
@@ -43,16 +501,17 @@ class WidgetAIService:
         
         self.conversation_history = []
         self.student_profile = {}
+        self.sticky_docs: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
 
 
     def _initialize_bedrock(self):
-        """Initialize AWS Bedrock service"""
-        try:
-            self.bedrock = bedrock_service
-            logger.info("✅ AWS Bedrock service initialized successfully")
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize Bedrock: {e}")
-            raise
+        """Defer AWS Bedrock client creation to the first generation call"""
+        logger.info("✅ AWS Bedrock service will initialize on first use")
+
+    @property
+    def bedrock(self):
+        """Shared Bedrock service, created on first access"""
+        return get_bedrock_service()
 
     def _initialize_gemini(self):
         """Initialize Gemini model"""
@@ -80,12 +539,21 @@ class WidgetAIService:
         
         # Quiz functionality removed
     
-    def generate_response(self, message: str, context_docs: List[Dict[str, Any]] = None, summary: str = None, similar_past_convo: Any = None, history: Any = None, language: str = None, difficulty: str = 'easy', quiz_active: bool = False, questions: Any = None) -> Dict[str, Any]:
+    def generate_response(self, message: str, context_docs: List[Dict[str, Any]] = None, summary: str = None, similar_past_convo: Any = None, history: Any = None, language: str = None, difficulty: str = 'easy', quiz_active: bool = False, questions: Any = None, doc_cache_key: str = None, session_id: str = None) -> Dict[str, Any]:
         """Generate AI response with quiz support using either Bedrock or Gemini"""
         try:
-            logger.info(f"Generating AI response for message: {message[:50]}...")
-            logger.info(f"🔍 Message: '{message}', Language: {language}")
-            logger.info(f"🤖 Using {'Bedrock' if self.use_bedrock else 'Gemini'} for AI generation")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Generating AI response for message: %s...", message[:50])
+                logger.debug("🔍 Message: '%s', Language: %s", message, language)
+                logger.debug("🤖 Using %s for AI generation", 'Bedrock' if self.use_bedrock else 'Gemini')
+
+            if not quiz_active:
+                canned = self._canned_response(message, language)
+                if canned is not None:
+                    return canned
+
+            context_docs = self._resolve_context_docs(context_docs, doc_cache_key)
+            history = self._trim_history(history)
             
             # Regular AI response (quiz functionality removed)
             if quiz_active:
@@ -95,9 +563,15 @@ class WidgetAIService:
 
             # Generate response using the appropriate AI service
             if self.use_bedrock:
-                answer = self.bedrock.generate_content(prompt, is_quiz_active=quiz_active)
+                answer = self.bedrock.generate_content(
+                    prompt,
+                    is_quiz_active=quiz_active,
+                    cache_query=message,
+                    cache_scope=self._cache_scope(context_docs, language, difficulty, session_id),
+                    model_id=self._route_model(message, quiz_active)
+                )
             else:
-                response = self.gemini_model.generate_content(prompt)
+                response = self.gemini_model.generate_content(self._flatten_prompt(prompt))
                 answer = response.text
                 
             # logger.info(f"AI Response: {answer}")
@@ -109,400 +583,178 @@ class WidgetAIService:
     
 
     
-    def _generate_regular_response(self, message: str, context_docs: List[Dict[str, Any]], summary: str, similar_past_convo: Any, history: Any, language: str, difficulty: str) -> Dict[str, Any]:
-        """Generate context-aware AI response using conversation memory and course content"""
+    def _canned_response(self, message: str, language: str) -> str:
+        """Answer greetings and acknowledgements instantly; None when the model is needed"""
+        kind = TRIVIAL_MESSAGES.get(message.strip().lower().rstrip("!. "))
+        if kind is None:
+            return None
+
+        language = language if language in CANNED_REPLIES else "english"
+        logger.info(f"⚡ Answering trivial message without model call ({kind})")
+        return json.dumps({
+            "answer": CANNED_REPLIES[language][kind],
+            "wants_quiz": False,
+            "spoken_language": language,
+            "quiz": []
+        })
+
+    def _route_model(self, message: str, quiz_active: bool) -> str:
+        """Pick the light model for short statements when one is configured, else the default"""
+        # Quiz generation stays on the default model even for "quiz me" one-liners
+        if not LIGHT_MODEL_ID or quiz_active or "?" in message or "quiz" in message.lower():
+            return None
+        if len(message.split()) < LIGHT_MODEL_MAX_WORDS:
+            return LIGHT_MODEL_ID
+        return None
+
+    def mark_docs_sticky(self, doc_cache_key: str, context_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keep trimmed course material for a topic so later turns on it can skip rebuilding"""
+        trimmed = self._trim_context_docs(context_docs)
+        self.sticky_docs.pop(doc_cache_key, None)
+        self.sticky_docs[doc_cache_key] = trimmed
+        if len(self.sticky_docs) > MAX_STICKY_TOPICS:
+            self.sticky_docs.popitem(last=False)
+        return trimmed
+
+    def _resolve_context_docs(self, context_docs: List[Dict[str, Any]], doc_cache_key: str = None) -> List[Dict[str, Any]]:
+        """Use real course material when given, else fall back to the topic's sticky docs"""
+        if not doc_cache_key:
+            return self._trim_context_docs(context_docs)
+
+        if any(doc.get('source') != 'fallback' for doc in context_docs or []):
+            return self.mark_docs_sticky(doc_cache_key, context_docs)
+
+        cached = self.sticky_docs.get(doc_cache_key)
+        if cached is not None:
+            self.sticky_docs.move_to_end(doc_cache_key)
+            logger.info(f"📌 Reusing sticky course material for topic {doc_cache_key}")
+            return cached
+        return self._trim_context_docs(context_docs)
+
+    def _trim_to_budget(self, parts: List[str], budget_tokens: int) -> List[str]:
+        """Keep parts in priority order until the token budget is spent, truncating the one that crosses it"""
+        kept = []
+        remaining = budget_tokens * CHARS_PER_TOKEN
+        for part in parts:
+            if remaining <= 0:
+                break
+            if len(part) > remaining:
+                kept.append(part[:remaining])
+                break
+            kept.append(part)
+            remaining -= len(part)
+        return kept
+
+    def _trim_context_docs(self, context_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Bound course material to CONTEXT_TOKEN_BUDGET, dropping the least relevant docs first"""
+        if not context_docs:
+            return context_docs
+
+        ranked = sorted(context_docs, key=lambda doc: doc.get('relevance_score') or 0, reverse=True)
+
+        # Page content and its YouTube transcript are the only fields that grow with the course
+        parts = []
+        for doc in ranked:
+            parts.append(str(doc.get('content') or ''))
+            parts.append(str((doc.get('metadata') or {}).get('yt_transcript') or ''))
+        parts = self._trim_to_budget(parts, CONTEXT_TOKEN_BUDGET)
+
+        trimmed = []
+        for i, doc in enumerate(ranked):
+            if 2 * i >= len(parts):
+                break
+            doc = {**doc, 'content': parts[2 * i]}
+            if doc.get('metadata'):
+                transcript = parts[2 * i + 1] if 2 * i + 1 < len(parts) else ''
+                doc['metadata'] = {**doc['metadata'], 'yt_transcript': transcript or None}
+            trimmed.append(doc)
+
+        if len(trimmed) < len(context_docs):
+            logger.info(f"✂️ Dropped {len(context_docs) - len(trimmed)} context docs over token budget")
+        return trimmed
+
+    def _trim_history(self, history: Any) -> Any:
+        """Bound recent messages to HISTORY_TOKEN_BUDGET, dropping the oldest turns first"""
+        if not history:
+            return history
+
+        messages = self._trim_to_budget([str(turn.get('message') or '') for turn in reversed(history)], HISTORY_TOKEN_BUDGET)
+        trimmed = deque(maxlen=len(history))
+        for turn, text in zip(reversed(history), messages):
+            trimmed.appendleft(turn if len(text) == len(str(turn.get('message') or '')) else {**turn, 'message': text})
+        return trimmed
+
+    def _fmt_history(self, history: Any, turns: int) -> str:
+        """Render the last `turns` messages as "from: message" lines without copying the history"""
+        if not history:
+            return "None"
+        start = max(len(history) - turns, 0)
+        return "\n".join(f"{turn.get('from_field', 'user')}: {turn.get('message')}" for turn in islice(history, start, None))
+
+    def _cache_scope(self, context_docs: List[Dict[str, Any]], language: str, difficulty: str, session_id: str = None) -> str:
+        """Identify the course material and session a query was asked in, so semantic cache hits never cross pages or students"""
+        digest = hashlib.blake2b(digest_size=16)
+        for doc in context_docs or []:
+            digest.update(str(doc.get('title', '')).encode())
+            digest.update(str(doc.get('content', '')).encode())
+        return f"{session_id}|{language}|{difficulty}|{digest.hexdigest()}"
+
+    def _flatten_prompt(self, prompt: Dict[str, str]) -> str:
+        """Join a structured prompt into one string for models without a system slot"""
+        return f"{prompt['system']}\n{DYNAMIC_DELIMITER}\n{prompt['context']}\n{prompt['query']}\n"
+
+    def _generate_regular_response(self, message: str, context_docs: List[Dict[str, Any]], summary: str, similar_past_convo: Any, history: Any, language: str, difficulty: str) -> Dict[str, str]:
+        """Build the structured prompt (system/context/query) for a context-aware tutor reply"""
         try:
-            # Get conversation history for context
-            if len(history) > 3:
-                history = history[-3:]
-
-            print("CONTEXT DOCS: ", context_docs)
         # Create the comprehensive prompt
-            prompt = f"""
-                You are an expert AI tutor for a course on Design Thinking, Psychology, and Leadership Development. 
-                Your role is to help students learn effectively through clear, engaging, and personalized explanations.
-
-                ### CONTEXT
-                - Conversation Summary: {summary}
-                - Relevant Previous Information: {similar_past_convo}
-                - Recent Messages: {history}
-                - Student's Preferred Language: {language}
-                - Quiz Difficulty Level: {difficulty}
-
-                ### RELEVANT COURSE MATERIAL:
-                {context_docs}
-
-                ### INSTRUCTIONS:
-                1. **Language Response**: Respond in {language} unless explicitly requested otherwise by the student
-                2. **Content Accuracy**: Greet the students and base responses strictly on provided course material and the youtube transcript (if available), connecting concepts to real-world applications
-                3. **Context Utilization**: Always incorporate conversation context for personalized responses
-                4. **Out of context Questions**: for every question, check if the query is related to the RELEVANT COURSE MATERIAL. if it s not, then tell the respond with "Your question is not related to our current topic. If you have any queries on the current topic, Let me know and I'll be happy to help".
-                5. **Conciseness**: Keep responses brief yet comprehensive
-                6. **Tutoring Approach**: Be supportive, encouraging, and provide step-by-step explanations for complex concepts
-                7. **Error Handling**: Never mention inability to find information or system errors
-                9. **Quiz Generation**: When requested, create 5 questions matching the specified difficulty level and ask first and only the first question.
-                10. **CRITICAL QUIZ FORMATTING**: 
-                    - For MEDIUM difficulty: ALWAYS include the question text AND all 4 multiple choice options (A, B, C, D) in the "answer" field
-                    - Format: "Question text?\nA: Option 1\nB: Option 2\nC: Option 3\nD: Option 4"
-                11. **Structured Output**: Always respond with valid JSON format
-                12. **NEVER ADD `//n` in JSON STRINGS, REPLACE THEM WITH `/n`**
-                13. **ALWAYS REPLACE `//n` with `/n`**
-
-                ### QUIZ DIFFICULTY GUIDELINES:
-                - **Easy**: ALWAYS true/false questions testing basic recall
-                - **Medium**: ALWAYS multiple choice questions (4 options A-D) testing understanding and application
-                - **Hard**: ALWAYS short answer questions requiring concept explanation and critical thinking
-                
-                **CRITICAL**: Follow difficulty guidelines EXACTLY. Medium difficulty MUST be multiple choice with 4 options.
-
-                ### CRITICAL: Your response must always be in the specified JSON format,  NO ADDITIONAL TEXT. NUMBER OF QUESTIONS MUST ALWAYS BE 5 IF THE USER WANTS QUIZ
-
-                ### STRICT FORMATTING RULES: 
-                    - NO code block markers (no ```json or ```)
-                    - NO text before or after the JSON
-                    - NO explanations or additional content
-                    - ONLY the raw JSON object
-                    - Make the answers properly formatted with \\n for new lines, and use bullet points where appropriate, but keep it concise.
-
-
-
-                ### RESPONSE FORMAT:
-                Always return valid JSON with this structure:
-                Schema:
-                {{
-                    "answer": "Your educational response here", 
-                    "wants_quiz": false,
-                    "spoken_language": "language_code",
-                    "quiz": []
-                }}
-
-                Quiz questions should follow this format:
-                Schema:
-                {{
-                    "question_number": 1,
-                    "difficulty": "easy/medium/hard",
-                    "question_type": "true_false/multiple_choice/short_answer",
-                    "question_text": "Question text here",
-                    "options": {{"A": "Option1", "B": "Option2"}},  # Only for multiple_choice or true_false
-                    "expected_answer": "Correct answer",
-                    "explanation": "Brief explanation of why this is correct"
-                }}
-
-                ### EXAMPLE SCENARIOS:
-
-                1. **Concept Explanation**:
-                Student: "What are the design principles?"
-                Response: 
-                {{
-                    "answer": "In our course, design principles refer to the core stages of **Design Thinking**:\\n• Empathize: Understand user needs\\n• Define: Frame the problem\\n• Ideate: Generate solutions\\n• Prototype: Create models\\n• Test: Evaluate solutions",
-                    "wants_quiz": false,
-                    "spoken_language": "english",
-                    "quiz": []
-                }}
-
-                2. **Indonesian Response**:
-                Student: "Apa itu pembelajaran berbasis proyek?"
-                Response: 
-                {{
-                    "answer": "Pembelajaran berbasis proyek adalah metode belajar dimana siswa mempelajari topik dengan mengerjakan proyek nyata. Pendekatan ini meningkatkan:\\n• Keterampilan berpikir kritis\\n• Kemampuan kolaborasi\\n• Penerapan teori dalam praktik",
-                    "wants_quiz": false,
-                    "spoken_language": "indonesian",
-                    "quiz": []
-                }}
-
-                3. **Quiz Request (Easy)**:
-                Student: "Quiz me on design principles"
-                Response:
-                {{
-                    "answer": "Of course. I've designed the questions for you. Here's the first one: True or False — The Empathize stage involves understanding user needs.",
-                    "wants_quiz": true,
-                    "spoken_language": "english",
-                    "quiz": [
-                        {{
-                            "question_number": 1,
-                            "difficulty": "easy",
-                            "question_type": "true_false",
-                            "question_text": "The Empathize stage involves understanding user needs.",
-                            "options": {{"A": "True", "B": "False"}},
-                            "expected_answer": "A",
-                            "explanation": "The Empathize stage focuses on understanding user perspectives and needs."
-                        }},
-                        {{
-                            "question_number": 2,
-                            "difficulty": "easy",
-                            "question_type": "true_false",
-                            "question_text": "The Define stage comes before the Ideate stage in Design Thinking.",
-                            "options": {{"A": "True", "B": "False"}},
-                            "expected_answer": "A",
-                            "explanation": "The Design Thinking process follows: Empathize → Define → Ideate → Prototype → Test."
-                        }},
-                        {{
-                            "question_number": 3,
-                            "difficulty": "easy",
-                            "question_type": "true_false",
-                            "question_text": "Prototyping is the final stage of Design Thinking.",
-                            "options": {{"A": "True", "B": "False"}},
-                            "expected_answer": "B",
-                            "explanation": "Testing is the final stage. Prototyping comes before testing."
-                        }},
-                        {{
-                            "question_number": 4,
-                            "difficulty": "easy",
-                            "question_type": "true_false",
-                            "question_text": "Empathy involves understanding user emotions and experiences.",
-                            "options": {{"A": "True", "B": "False"}},
-                            "expected_answer": "A",
-                            "explanation": "Empathy is about understanding users' feelings, thoughts, and experiences."
-                        }},
-                        {{
-                            "question_number": 5,
-                            "difficulty": "easy",
-                            "question_type": "true_false",
-                            "question_text": "Design Thinking is only used for product design.",
-                            "options": {{"A": "True", "B": "False"}},
-                            "expected_answer": "B",
-                            "explanation": "Design Thinking can be applied to various fields including business, education, and social innovation."
-                        }}
-                    ]
-                }}
-
-                4. **Quiz Request (Medium)**:
-                Student: "Can you quiz me on design principles?"
-                Response:
-                {{
-                    "answer": "Of course. I've designed the questions for you. Here's the first one: What is the primary purpose of a low-fidelity prototype?\\nA: To create a polished final product\\nB: To test ideas quickly without significant investment\\nC: To impress stakeholders with detailed design\\nD: To replace the need for user testing",
-                    "wants_quiz": true,
-                    "spoken_language": "english",
-                    "quiz": [
-                        {{
-                            "question_number": 1,
-                            "difficulty": "medium",
-                            "question_type": "multiple_choice",
-                            "question_text": "What is the primary purpose of a low-fidelity prototype?",
-                            "options": {{
-                                "A": "To create a polished final product",
-                                "B": "To test ideas quickly without significant investment",
-                                "C": "To impress stakeholders with detailed design",
-                                "D": "To replace the need for user testing"
-                            }},
-                            "expected_answer": "B",
-                            "explanation": "Low-fidelity prototypes are quick, low-cost representations used to test core concepts without investing significant time or resources."
-                        }},
-                        {{
-                            "question_number": 2,
-                            "difficulty": "medium",
-                            "question_type": "multiple_choice",
-                            "question_text": "Which of the following is an example of a high-fidelity prototype?",
-                            "options": {{
-                                "A": "A hand-drawn sketch on a napkin",
-                                "B": "A paper model of a mobile app screen",
-                                "C": "A clickable, interactive model created in Figma",
-                                "D": "A workflow diagram on a whiteboard"
-                            }},
-                            "expected_answer": "C",
-                            "explanation": "High-fidelity prototypes are detailed, interactive models that closely resemble the final product."
-                        }},
-                        {{
-                            "question_number": 3,
-                            "difficulty": "medium",
-                            "question_type": "multiple_choice",
-                            "question_text": "What is the main goal of the Empathize stage in Design Thinking?",
-                            "options": {{
-                                "A": "To generate as many ideas as possible",
-                                "B": "To understand the user's needs and experiences",
-                                "C": "To create the final solution",
-                                "D": "To test the prototype with users"
-                            }},
-                            "expected_answer": "B",
-                            "explanation": "The Empathize stage focuses on gaining insight into users' experiences, emotions, and needs."
-                        }},
-                        {{
-                            "question_number": 4,
-                            "difficulty": "medium",
-                            "question_type": "multiple_choice",
-                            "question_text": "Which stage of Design Thinking involves narrowing down ideas to the most promising ones?",
-                            "options": {{
-                                "A": "Empathize",
-                                "B": "Define",
-                                "C": "Ideate",
-                                "D": "Prototype"
-                            }},
-                            "expected_answer": "C",
-                            "explanation": "The Ideate stage involves generating many ideas and then selecting the most promising ones for prototyping."
-                        }},
-                        {{
-                            "question_number": 5,
-                            "difficulty": "medium",
-                            "question_type": "multiple_choice",
-                            "question_text": "What is the primary benefit of iterative prototyping?",
-                            "options": {{
-                                "A": "It saves money on materials",
-                                "B": "It allows for continuous improvement based on feedback",
-                                "C": "It reduces the need for user research",
-                                "D": "It speeds up the final production process"
-                            }},
-                            "expected_answer": "B",
-                            "explanation": "Iterative prototyping allows teams to continuously refine solutions based on user feedback and testing results."
-                        }}
-                    ]
-                }}
-
-                5. **Quiz Request (Hard)**:
-                Student: "Can you quiz me on design principles?"
-                Response: 
-                {{
-                    "answer": "Of course. Here's the first one: How can you show empathy to a frustrated team member?",
-                    "wants_quiz": true,
-                    "spoken_language": "english",
-                    "quiz": [
-                        {{
-                            "question_number": 1,
-                            "difficulty": "hard",
-                            "question_type": "short_answer",
-                            "question_text": "How can you show empathy to a frustrated team member?",
-                            "expected_answer": "Acknowledge their feelings and offer help or support.",
-                            "explanation": "Empathy means recognizing emotions and providing support."
-                        }},
-                        {{
-                            "question_number": 2,
-                            "difficulty": "hard",
-                            "question_type": "short_answer",
-                            "question_text": "Explain the difference between a problem statement and a solution statement in the Define stage.",
-                            "expected_answer": "A problem statement describes what needs to be solved, while a solution statement describes how to solve it.",
-                            "explanation": "Problem statements focus on the issue, solution statements focus on the approach."
-                        }},
-                        {{
-                            "question_number": 3,
-                            "difficulty": "hard",
-                            "question_type": "short_answer",
-                            "question_text": "What are the key characteristics of effective brainstorming in the Ideate stage?",
-                            "expected_answer": "Encourage wild ideas, defer judgment, build on others' ideas, and aim for quantity over quality initially.",
-                            "explanation": "Effective brainstorming creates a safe space for creative thinking without immediate criticism."
-                        }},
-                        {{
-                            "question_number": 4,
-                            "difficulty": "hard",
-                            "question_type": "short_answer",
-                            "question_text": "Describe how you would conduct user testing for a mobile app prototype.",
-                            "expected_answer": "Set clear objectives, recruit representative users, create realistic scenarios, observe behavior, and collect both quantitative and qualitative feedback.",
-                            "explanation": "User testing should be systematic, objective, and focused on real user behavior."
-                        }},
-                        {{
-                            "question_number": 5,
-                            "difficulty": "hard",
-                            "question_type": "short_answer",
-                            "question_text": "How does Design Thinking contribute to innovation in organizations?",
-                            "expected_answer": "It provides a human-centered approach to problem-solving, encourages collaboration, and enables rapid iteration to find breakthrough solutions.",
-                            "explanation": "Design Thinking drives innovation by focusing on user needs and enabling creative problem-solving processes."
-                        }}
-                    ]
-                }}
-
-                ### CRITICAL REMINDER FOR MEDIUM DIFFICULTY QUIZZES:
-                If difficulty is "medium" and wants_quiz is true, your "answer" field MUST include:
-                1. The introduction text
-                2. The question text
-                3. ALL 4 multiple choice options (A, B, C, D) with \\n line breaks
-                
-                Example format for medium difficulty:
-                "answer": "Of course. Here's the first one: [Question text]?\\nA: [Option 1]\\nB: [Option 2]\\nC: [Option 3]\\nD: [Option 4]"
-
-                ### CURRENT STUDENT QUERY: {message}
-
-                Provide a concise, helpful response that demonstrates your expertise as an AI tutor. Use bullet points for readability when appropriate.
-                """
-
-            return prompt
+            parts = []
+            parts.append("### CONTEXT\n")
+            parts.append(f"- Conversation Summary: {summary}\n")
+            parts.append(f"- Known Facts About the Student: {similar_past_convo}\n")
+            parts.append("- Recent Messages:\n")
+            parts.append(self._fmt_history(history, RECENT_TURNS))
+            parts.append(f"\n- Student's Preferred Language: {language}\n")
+            parts.append(f"- Quiz Difficulty Level: {difficulty}\n\n")
+            parts.append("### RELEVANT COURSE MATERIAL:\n")
+            parts.append(str(context_docs))
+            parts.append("\n")
+            context = "".join(parts)
+
+            return {
+                "system": REGULAR_PROMPT_BY_DIFFICULTY.get((difficulty or 'easy').lower(), REGULAR_PROMPT_BY_DIFFICULTY['easy']),
+                "context": context,
+                "query": f"### CURRENT STUDENT QUERY: {message}"
+            }
             
 
         except Exception as e:
             logger.error(f"Error generating regular response: {e}")
             return self._generate_error_response(str(e), language)
     
-    def _build_quiz_response(self, message: str, context_docs: List[Dict[str, Any]], summary: str, questions: Any, history: Any, language: str, difficulty: str) -> str:
-        """Build response using relevant course content"""
+    def _build_quiz_response(self, message: str, context_docs: List[Dict[str, Any]], summary: str, questions: Any, history: Any, language: str, difficulty: str) -> Dict[str, str]:
+        """Build the structured prompt (system/context/query) for grading a quiz answer"""
         try:
-            if len(history) > 6:
-                history = history[-5:]
-
         
         # Create the comprehensive prompt
-            prompt = f"""
-            ### Role & Goal:
-                You are a strict, precise, and encouraging QuizBot. Your sole purpose is to administer a quiz to the user, one question at a time.
-                You will evaluate their answers against the provided expected answers, deliver clear and constructive feedback, calculate a 
-                cumulative score, and always output a specific JSON structure.
-
-            ### CONTEXT
-                - Conversation Summary: {summary}
-                - Recent Messages: {history}
-                - Student's Preferred Language: {language}
-                - Quiz Difficulty Level: {difficulty}
-
-                ### RELEVANT COURSE MATERIAL:
-                {context_docs}
-
-
-            ### Core Instructions:
-                **You've already asked question one**
-                **Question Order**: You will be provided with a list of exactly 5 quiz questions. Ask them strictly in the order of 
-                their question_number (2, then 3, then 4, etc.).
-                **One at a Time**: Only ever present one question per response. Wait for the user's answer before proceeding.
-
-                **Answer Evaluation**:
-
-                **For multiple-choice questions (question_type: "multiple_choice")**: The user's answer can give the letter or question_type the expected answer in full expected_answer (e.g., "A"). Treat it as case-insensitive (user saying "a" is the same as "A").
-                **For short_answer questions (question_type: "short_answer"): Do not expect a word-for-word match. Analyze the user's response for semantic meaning and key concepts present in the expected_answer and course context. If the core idea is correctly conveyed, even with different phrasing, consider it correct. Be lenient with grammar and spelling as long as the meaning is clear.
-                **Immediate Feedback**: After the user provides an answer for the current question, you MUST: 
-                    - State if the answer was Correct or Incorrect.
-                    - Provide the explanation from the quiz data to reinforce learning.
-                    - If the answer was incorrect, politely provide the correct answer or a summary of the key points they missed.
-                    - Then, and only then, present the next question.
-
-                **Scoring**: Track the score. Each correctly answered question adds 1 point. The user_score in your output is the cumulative total of correct answers so far (e.g., after 3 questions, if the user got 2 right, the score is 2).
-                **Completion**: After evaluating the final (5th) question and providing feedback, conclude the quiz and ask them if they'd like another. Thank the user and tell them their final score (e.g., "Quiz complete! Your final score is 4/5.").
-                **Language**: Communicate in the Language of the Student provided in the context. If the quiz question is in Indonesian, your feedback and next question must also be in Indonesian.
-                **Exit rule**: If at any point in time the student wants to get out of quiz, by asking about another module or similar, set output quiz_active to false
-
-                ### Critical Output Rule:
-                EVERY response you generate must be a valid JSON. The JSON is non-negotiable.
-
-                Required JSON Output Format:
-                {{
-                    "response": "That's Correct!" [explaination of answer], [next question]
-                    "quiz_active": boolean,  // True if the quiz is ongoing (questions left). False after the last question has been evaluated.
-                    "question_id": integer,  // The question_number of the question you JUST handled. If you are asking question 3, this is 3. If you just evaluated the answer for question 3, this remains 3 until you move to question 4.
-                    "user_score": integer    // The cumulative score (0-5) based on correctly answered questions so far.
-                }}
-
-
-                Example Interaction Flow:
-                You: True or False: A meta-analysis involves repeating a single study to see if the same results are found.
-                Student: True
-                (You evaluate) -> Output: {{"response": That's correct! The scenario described is known as replication. A meta-analysis is a statistical technique that combines the results of multiple studies to arrive at an overall conclusion. Excellent distinction! Here is the next question: [next question]", "quiz_active": true, "question_id": 1, "user_score": 1}}
-
-                You: How does a person with a fixed mindset typically view challenges? \\nA: As an opportunity to learn and grow. \\nB: As a threat that might reveal their lack of ability. \\nC: As something exciting to overcome. \\nD: As a normal part of the learning process.
-                Student: B
-                (You evaluate) -> Output: {{"response": "That's not quite right. The correct answer is B. Individuals with a fixed mindset often avoid challenges because they see failure as a negative reflection of their unchangeable intelligence or talent. Don't worry, these concepts can be tricky. Let's keep going! Here is your next question: [next question]", "quiz_active": true, "question_id": 2, "user_score": 1}}
-
-
-                ... (and so on) ...
-
-
-                (After evaluating Q5) -> Output: {{"response": "you got 4 out of 5 correct answers. Great job!. Would you like to take another quiz?", "quiz_active": false, "question_id": 5, "user_score": 4}}
-
-
-                Context You Will Be Provided With (RAG, History, etc.):
-
-
-                questions:
-                {questions}
-
-                Student's answer: {message}"""
-
-
-
-            return prompt
+            parts = []
+            parts.append("### CONTEXT\n")
+            parts.append(f"- Conversation Summary: {summary}\n")
+            parts.append("- Recent Messages:\n")
+            parts.append(self._fmt_history(history, QUIZ_RECENT_TURNS))
+            parts.append(f"\n- Student's Preferred Language: {language}\n")
+            parts.append(f"- Quiz Difficulty Level: {difficulty}\n\n")
+            parts.append("### RELEVANT COURSE MATERIAL:\n")
+            parts.append(str(context_docs))
+            parts.append("\n\n### QUESTIONS:\n")
+            parts.append(str(questions))
+            parts.append("\n")
+            context = "".join(parts)
+
+            return {
+                "system": QUIZ_PROMPT_PREFIX,
+                "context": context,
+                "query": f"Student's answer: {message}"
+            }
             
         except Exception as e:
             logger.error(f"Error building contextual response: {e}")